@@ -0,0 +1,325 @@
+import argparse
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import database_manager as db
+import transaction_graph as tg
+import graph_render
+import metrics
+
+
+# Traces many root transactions without the interactive menu of main.py:
+#
+#   python batch_trace.py roots.txt --workers 8 --limit 5000 > traces.ndjson
+#   cat roots.txt | python batch_trace.py - --format graphml --output-dir traces
+#
+# The input has one hex hash per line; empty lines and lines starting with '#' are skipped.
+
+DB_PATH = 'database/output_to_ring_signature.db'
+
+
+class LRUCache:
+    """
+    Thread-safe dictionary holding at most max_entries items, dropping the least recently used first.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys):
+        # Returns ({key: value} for the cached keys, list of the missing keys).
+        found = {}
+        missing = []
+        with self.lock:
+            for key in keys:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    found[key] = self.entries[key]
+                else:
+                    missing.append(key)
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, items):
+        with self.lock:
+            for key, value in items:
+                self.entries[key] = value
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class SharedTraceCache:
+    """
+    Query interface of DatabaseManager shared by all worker threads.
+
+    Ring lookups, output lists and transactions fetched from monerod are cached, so roots with
+    overlapping neighbourhoods look each of them up only once. Cache misses go to the backend of
+    the calling thread: its own DatabaseManager (SQLite connections cannot be shared between
+    threads) or, if given, one RingIndex shared by all threads. Transactions missing from the
+    backend are requested with fetch_transactions, which can be a persistent TransactionCache.
+    """
+
+    def __init__(self, db_path, ring_index=None, max_entries=1_000_000, fetch_transactions=tg.get_transactions):
+        self.db_path = db_path
+        self.ring_index = ring_index
+        self.fetch_transactions = fetch_transactions
+        self.rings = LRUCache(max_entries)        # output -> [(tx key, hex hash)]
+        self.outputs = LRUCache(max_entries)      # tx key -> [output]
+        self.origins = LRUCache(max_entries)      # output -> (tx key, hex hash) of its creator
+        self.ref_counts = LRUCache(max_entries)   # output -> number of rings referencing it
+        self.transactions = LRUCache(max_entries) # hex hash -> transaction from get_transactions
+        self.local = threading.local()
+        self.db_managers = []
+        self.db_managers_lock = threading.Lock()
+
+    def backend(self):
+        if self.ring_index is not None:
+            return self.ring_index
+        if not hasattr(self.local, 'db_manager'):
+            # Each connection is only used by its thread, but close() runs on the main thread.
+            self.local.db_manager = db.open_database_manager(self.db_path, check_same_thread=False)
+            with self.db_managers_lock:
+                self.db_managers.append(self.local.db_manager)
+        return self.local.db_manager
+
+    def find_transaction_by_hash(self, hash_value):
+        return self.backend().find_transaction_by_hash(hash_value)
+
+    def get_tx_key_range(self, first_block, last_block):
+        return self.backend().get_tx_key_range(first_block, last_block)
+
+    def find_transactions_by_outputs(self, output_values, max_tx_key=None):
+        # Only complete rings are cached. Lookups bounded by max_tx_key trim the cached rings and
+        # send the missing outputs to the backend with the bound, without caching the result.
+        rings, missing = self.rings.get_many(set(output_values))
+        if missing:
+            found = self.backend().find_transactions_by_outputs(missing, max_tx_key)
+            if max_tx_key is None:
+                # Outputs nobody spends are cached as well, as empty rings.
+                self.rings.put_many((output, found.get(output, [])) for output in missing)
+            rings.update(found)
+        if max_tx_key is not None:
+            rings = {output: [member for member in ring if member[0] <= max_tx_key] for output, ring in rings.items()}
+        return {output: ring for output, ring in rings.items() if ring}
+
+    def find_origins_by_outputs(self, output_values, min_tx_key=None):
+        # Each output has one origin, so whatever the backend finds is cached, bounded or not.
+        origins, missing = self.origins.get_many(set(output_values))
+        if missing:
+            found = self.backend().find_origins_by_outputs(missing, min_tx_key)
+            self.origins.put_many(found.items())
+            origins.update(found)
+        if min_tx_key is not None:
+            origins = {output: origin for output, origin in origins.items() if origin[0] >= min_tx_key}
+        return origins
+
+    def get_reference_counts(self, output_values):
+        counts, missing = self.ref_counts.get_many(set(output_values))
+        if missing:
+            found = self.backend().get_reference_counts(missing)
+            # Outputs nobody references are cached as well, with a count of 0.
+            self.ref_counts.put_many((output, found.get(output, 0)) for output in missing)
+            counts.update(found)
+        return {output: count for output, count in counts.items() if count}
+
+    def get_outputs_by_tx_keys(self, tx_keys):
+        outputs, missing = self.outputs.get_many(set(tx_keys))
+        if missing:
+            found = self.backend().get_outputs_by_tx_keys(missing)
+            self.outputs.put_many(found.items())
+            outputs.update(found)
+        return outputs
+
+    def get_transactions(self, tx_hashes):
+        # Stands in for transaction_graph.get_transactions. Only the outputs and ring members are kept.
+        transactions, missing = self.transactions.get_many(set(tx_hashes))
+        if missing:
+            found = {tx_hash: {'tx_id': transaction['tx_id'], 'outputs': transaction['outputs'],
+                               'ring_members': tg.ring_members_of(transaction), 'full': None}
+                     for tx_hash, transaction in self.fetch_transactions(missing).items()}
+            self.transactions.put_many(found.items())
+            transactions.update(found)
+        return transactions
+
+    def stats(self):
+        return {name: {'hits': cache.hits, 'misses': cache.misses, 'entries': len(cache.entries)}
+                for name, cache in (('rings', self.rings), ('outputs', self.outputs),
+                                    ('origins', self.origins), ('ref_counts', self.ref_counts),
+                                    ('transactions', self.transactions))}
+
+    def close(self):
+        for db_manager in self.db_managers:
+            db_manager.close()
+        if self.ring_index is not None:
+            self.ring_index.close()
+
+
+def read_roots(lines):
+    # Yields the roots as the lines are read; each root is traced once, in input order.
+    seen = set()
+    for line in lines:
+        line = line.strip().lower()
+        if line and not line.startswith('#') and line not in seen:
+            seen.add(line)
+            yield line
+
+
+def trace_root(root, cache, limit, direction=tg.DESCENDANTS, max_block_distance=None, max_depth=None, max_ref_count=None):
+    """
+    Builds the graph of one root transaction.
+
+    Returns:
+    tuple: (root, graph or None, seconds taken, error message or None)
+    """
+    start = time.time()
+    try:
+        if len(root) != 64:
+            raise ValueError('Not a 64 character hex hash.')
+        bytes.fromhex(root)
+        with metrics.profile(f'graph-{root[:16]}'):
+            graph = tg.create_transaction_graph_from_tx_id(root, cache, limit, cache.get_transactions, direction,
+                                                           max_block_distance, max_depth, max_ref_count)
+        return root, graph, time.time() - start, None
+    except tg.TransactionNotFoundError:
+        return root, None, time.time() - start, 'Transaction not found.'
+    except Exception as e:
+        return root, None, time.time() - start, f'{type(e).__name__}: {e}'
+
+
+def batch_trace(roots, cache, limit, n_workers, output_format, output, output_dir=None, direction=tg.DESCENDANTS,
+                max_block_distance=None, max_depth=None, max_ref_count=None):
+    """
+    Traces every root on a pool of n_workers threads sharing one SharedTraceCache.
+
+    Roots are taken from the iterable as workers free up, with at most 2 * n_workers traces submitted
+    at a time, so neither the roots nor the finished graphs pile up in memory. One JSON line per root is
+    written to output as soon as its trace finishes, with the timing and either the graph ('ndjson') or
+    the path of the GraphML file written to output_dir ('graphml').
+
+    Returns:
+    tuple: (number of roots traced, number of roots that failed)
+    """
+    n_done = n_failed = 0
+    roots = iter(roots)
+    pending = set()
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        while True:
+            for root in roots:
+                pending.add(executor.submit(trace_root, root, cache, limit, direction, max_block_distance,
+                                            max_depth, max_ref_count))
+                if len(pending) >= 2 * n_workers:
+                    break
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            while done:
+                # Each graph is released once its line is written.
+                root, graph, seconds, error = done.pop().result()
+                n_done += 1
+                record = {'root': root, 'seconds': round(seconds, 3)}
+
+                if error is not None:
+                    n_failed += 1
+                    record['error'] = error
+                else:
+                    record['nodes'] = len(graph)
+                    record['edges'] = len(graph.edge_sources)
+                    record['missing'] = len(graph.missing)
+                    if output_format == 'graphml':
+                        record['path'] = os.path.join(output_dir, f'{root}.graphml')
+                        graph_render.write_graphml(graph, record['path'])
+                    else:
+                        record['graph'] = graph_render.graph_to_json(graph, root)
+
+                output.write(json.dumps(record) + '\n')
+                output.flush()
+                print(f'TRACED {n_done} | {root} | {record.get("nodes", 0)} nodes | '
+                      f'{record["seconds"]}s{" | " + error if error else ""}', file=sys.stderr)
+                graph = record = None
+
+    return n_done, n_failed
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Trace many root transactions in parallel.')
+    parser.add_argument('roots', nargs='?', default='-',
+                        help="File with one root hash per line, or '-' for stdin (default).")
+    parser.add_argument('--db', default=DB_PATH, help=f'SQLite database (default: {DB_PATH}).')
+    parser.add_argument('--ring-index', help='Read rings from a ring index directory instead of the database.')
+    parser.add_argument('--workers', type=int, default=8, help='Number of worker threads (default: 8).')
+    parser.add_argument('--limit', type=int, default=1000, help='Maximum nodes per graph (default: 1000).')
+    parser.add_argument('--direction', choices=tg.DIRECTIONS, default=tg.DESCENDANTS,
+                        help='Trace the spenders of each root, the sources of its inputs, or both (default: descendants).')
+    parser.add_argument('--max-block-distance', type=int,
+                        help='Only follow transactions at most this many blocks from the root (default: no limit).')
+    parser.add_argument('--max-depth', type=int, help='Maximum number of levels in each direction (default: no limit).')
+    parser.add_argument('--max-ref-count', type=int,
+                        help='Do not follow outputs used by more rings than this (default: no limit).')
+    parser.add_argument('--format', choices=('ndjson', 'graphml'), default='ndjson',
+                        help='ndjson: graphs inline; graphml: one file per root in --output-dir.')
+    parser.add_argument('--output', default='-', help="Results file, or '-' for stdout (default).")
+    parser.add_argument('--output-dir', default='traces', help='Directory of the GraphML files (default: traces).')
+    parser.add_argument('--tx-cache', help='Persistent transaction cache in front of monerod, e.g. database/tx_cache.db.')
+    parser.add_argument('--cache-entries', type=int, default=1_000_000,
+                        help='Maximum entries of each shared cache (default: 1000000).')
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+
+    # The roots are read as the workers take them, so the file stays open until the end.
+    roots_file = sys.stdin if arguments.roots == '-' else open(arguments.roots)
+
+    if arguments.format == 'graphml':
+        os.makedirs(arguments.output_dir, exist_ok=True)
+
+    to_stdout = arguments.output == '-'
+    output = sys.stdout if to_stdout else open(arguments.output, 'w')
+    start = time.time()
+
+    # Progress messages printed by the other modules go to stderr, so stdout only carries results.
+    with contextlib.redirect_stdout(sys.stderr):
+        metrics.configure_from_environment()
+        ring_index = None
+        if arguments.ring_index:
+            import ring_index as ri
+            ring_index = ri.RingIndex(arguments.ring_index)
+
+        persistent_cache = None
+        fetch_transactions = tg.get_transactions
+        if arguments.tx_cache:
+            import tx_cache
+            persistent_cache = tx_cache.TransactionCache(arguments.tx_cache)
+            fetch_transactions = persistent_cache.get_transactions
+
+        cache = SharedTraceCache(arguments.db, ring_index, arguments.cache_entries, fetch_transactions)
+        try:
+            n_traced, n_failed = batch_trace(read_roots(roots_file), cache, max(1, arguments.limit), max(1, arguments.workers),
+                                             arguments.format, output, arguments.output_dir, arguments.direction,
+                                             arguments.max_block_distance, arguments.max_depth, arguments.max_ref_count)
+        finally:
+            if roots_file is not sys.stdin:
+                roots_file.close()
+            if not to_stdout:
+                output.close()
+            cache.close()
+            if persistent_cache is not None:
+                persistent_cache.print_stats()
+                persistent_cache.close()
+            metrics.stop_reporting()
+
+    print(f'Traced {n_traced} roots ({n_failed} failed) in {round(time.time() - start, 2)}s.', file=sys.stderr)
+    print(f'Cache: {json.dumps(cache.stats())}', file=sys.stderr)
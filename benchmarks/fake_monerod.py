@@ -0,0 +1,123 @@
+"""
+Local stand-in for monerod that serves a SyntheticChain over HTTP.
+
+Implements the calls this project makes:
+    /json_rpc           get_info, get_block_count, get_block, get_block_headers_range
+    /get_transactions   pruned blobs ('as_hex') and 'output_indices'
+
+Run standalone and point the tool at it:
+    python benchmarks/fake_monerod.py --blocks 2000 --port 18089
+    MONEROD_URL=http://127.0.0.1:18089 python main.py
+"""
+import argparse
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from synthetic_chain import SyntheticChain
+
+
+class FakeMonerod:
+    def __init__(self, chain, host='127.0.0.1', port=0):
+        self.chain = chain
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out in one segment, so keep-alive connections are not held up
+            # by Nagle's algorithm and delayed ACKs.
+            wbufsize = 1 << 16
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if self.path == '/json_rpc':
+                    response = fake.json_rpc(request.get('method'), request.get('params') or {})
+                elif self.path == '/get_transactions':
+                    response = fake.get_transactions(request.get('txs_hashes', []))
+                else:
+                    self.send_error(404)
+                    return
+                body = json.dumps(response).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://{host}:{self.server.server_port}'
+        self.thread = None
+
+    def json_rpc(self, method, params):
+        blocks = self.chain.blocks
+
+        def header(height):
+            block = blocks[height]
+            return {'height': height, 'hash': block['hash'], 'prev_hash': block['prev_hash'],
+                    'num_txes': len(block['tx_hashes'])}
+
+        if method == 'get_info':
+            result = {'height': len(blocks), 'status': 'OK'}
+        elif method == 'get_block_count':
+            result = {'count': len(blocks), 'status': 'OK'}
+        elif method == 'get_block' and 0 <= params.get('height', -1) < len(blocks):
+            block = blocks[params['height']]
+            result = {'block_header': header(params['height']), 'miner_tx_hash': block['miner_tx_hash'], 'status': 'OK'}
+            if block['tx_hashes']:
+                result['tx_hashes'] = block['tx_hashes']
+        elif method == 'get_block_headers_range':
+            start, end = params.get('start_height', 0), min(params.get('end_height', 0), len(blocks) - 1)
+            result = {'headers': [header(height) for height in range(start, end + 1)], 'status': 'OK'}
+        else:
+            return {'jsonrpc': '2.0', 'id': '0', 'error': {'code': -2, 'message': f'Unsupported call: {method}'}}
+        return {'jsonrpc': '2.0', 'id': '0', 'result': result}
+
+    def get_transactions(self, tx_hashes):
+        txs = []
+        missed = []
+        for tx_hash in tx_hashes:
+            transaction = self.chain.transactions.get(tx_hash)
+            if transaction is None:
+                missed.append(tx_hash)
+                continue
+            txs.append({'tx_hash': tx_hash, 'as_hex': transaction['blob'], 'as_json': '',
+                        'block_height': transaction['height'], 'output_indices': transaction['output_indices']})
+        response = {'txs': txs, 'status': 'OK'}
+        if missed:
+            response['missed_tx'] = missed
+        return response
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve a synthetic chain with the monerod RPC interface.')
+    parser.add_argument('--blocks', type=int, default=2000)
+    parser.add_argument('--txs-per-block', type=int, default=20)
+    parser.add_argument('--ring-size', type=int, default=16)
+    parser.add_argument('--spend-pattern', choices=('uniform', 'recent'), default='recent')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--port', type=int, default=18089)
+    arguments = parser.parse_args()
+
+    chain = SyntheticChain(arguments.blocks, arguments.txs_per_block, arguments.ring_size,
+                           spend_pattern=arguments.spend_pattern, seed=arguments.seed)
+    fake = FakeMonerod(chain, port=arguments.port)
+    print(f'Serving {len(chain.blocks)} blocks and {len(chain.transactions)} transactions on {fake.url}. Press Ctrl+C to stop.')
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,108 @@
+"""
+Times blockchain_import.py against the RPC sync on the same synthetic chain and checks that both
+produce the same database.
+
+    python benchmarks/import_benchmark.py --blocks 2000 --txs-per-block 20
+
+The chain is written as a raw export with synthetic_export.py and imported into one database, and
+synced from fake_monerod.py into another. The 'tx', 'signature', 'tx_output' and 'rct_output_origin'
+tables are then compared. Miner transaction hashes differ between the two by construction (see
+synthetic_export.py), so 'tx' is compared on regular transactions and block heights only.
+"""
+import argparse
+import contextlib
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+import blockchain_import as bi
+import database_manager as db
+from run_benchmarks import run_benchmark
+from synthetic_chain import SyntheticChain
+from synthetic_export import write_raw_export
+
+
+def table_rows(db_path, query):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(query).fetchall()
+    finally:
+        conn.close()
+
+
+def compare_databases(imported_path, synced_path, miner_hashes):
+    """
+    Returns:
+    list: The names of the tables that differ.
+    """
+    queries = {
+        'signature': "SELECT output, tx_key FROM signature ORDER BY output, tx_key",
+        'tx_output': "SELECT tx_key, outputs FROM tx_output ORDER BY tx_key",
+        'rct_output_origin': "SELECT output, tx_key FROM rct_output_origin ORDER BY output",
+    }
+    differences = [table for table, query in queries.items()
+                   if table_rows(imported_path, query) != table_rows(synced_path, query)]
+
+    imported_tx = table_rows(imported_path, "SELECT key, hash, block FROM tx ORDER BY key")
+    synced_tx = table_rows(synced_path, "SELECT key, hash, block FROM tx ORDER BY key")
+    if len(imported_tx) != len(synced_tx) or any(
+            (key, block) != (synced_key, synced_block) or (hash != synced_hash and hash not in miner_hashes)
+            for (key, hash, block), (synced_key, synced_hash, synced_block) in zip(imported_tx, synced_tx)):
+        differences.append('tx')
+    return differences
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare the raw export importer with the RPC sync.')
+    parser.add_argument('--blocks', type=int, default=2000)
+    parser.add_argument('--txs-per-block', type=int, default=20)
+    parser.add_argument('--ring-size', type=int, default=16)
+    parser.add_argument('--spend-pattern', choices=('uniform', 'recent'), default='recent')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--blocks-per-commit', type=int, default=1000)
+    arguments = parser.parse_args()
+
+    print('Generating synthetic chain.')
+    chain = SyntheticChain(arguments.blocks, arguments.txs_per_block, arguments.ring_size,
+                           spend_pattern=arguments.spend_pattern, seed=arguments.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        export_path = os.path.join(directory, 'blockchain.raw')
+        imported_path = os.path.join(directory, 'imported.db')
+        synced_path = os.path.join(directory, 'synced.db')
+
+        print('Writing raw export.')
+        block_hashes = write_raw_export(chain, export_path, arguments.seed)
+        print(f'{len(chain.blocks)} blocks, {os.path.getsize(export_path)} bytes.')
+
+        print('Importing raw export.')
+        with contextlib.redirect_stdout(io.StringIO()):
+            db.create_database(imported_path)
+            db_manager = db.open_database_manager(imported_path)
+            import_start = time.perf_counter()
+            bi.import_raw_export(db_manager, export_path, arguments.blocks_per_commit)
+            import_seconds = time.perf_counter() - import_start
+            stored_last_hash = db_manager.get_block_hash(len(chain.blocks) - 1)
+            db_manager.close()
+
+        print('Syncing through fake monerod.')
+        synced = run_benchmark(chain, synced_path, graph_queries=0)
+        sync_seconds = synced['tx_stage_seconds'] + synced['signature_stage_seconds']
+
+        miner_hashes = set(row[0] for row in table_rows(
+            imported_path, "SELECT hash FROM tx WHERE key IN (SELECT first_tx_key FROM block)"))
+        differences = compare_databases(imported_path, synced_path, miner_hashes)
+        stored_hashes = [row[0] for row in table_rows(imported_path, "SELECT hash FROM block ORDER BY height")]
+
+    print(f"{'':<12}{'seconds':>10}{'blocks/s':>12}")
+    print(f"{'import':<12}{import_seconds:>10.2f}{len(chain.blocks) / import_seconds:>12.1f}")
+    print(f"{'rpc sync':<12}{sync_seconds:>10.2f}{len(chain.blocks) / sync_seconds:>12.1f}")
+    print(f'Block hashes match: {stored_hashes == block_hashes and stored_last_hash == block_hashes[-1]}')
+    print('Databases match.' if not differences else f'Tables differ: {", ".join(differences)}')
+    sys.exit(1 if differences or stored_hashes != block_hashes else 0)
@@ -0,0 +1,222 @@
+"""
+End-to-end benchmark of the sync and graph stages against a synthetic chain served by a local
+fake monerod, so no synced node is needed.
+
+    python benchmarks/run_benchmarks.py --blocks 2000 --txs-per-block 20 --label my-change
+
+Runs update_tx_table, update_output_tx_pairs_table (with the bulk load used by main.py) and
+create_transaction_graph_from_tx_id on a fresh database, then appends one JSON line to the results
+file (benchmarks/results.jsonl by default) with the configuration, the git commit and:
+
+    blocks_per_second       tx stage
+    pairs_per_second        signature stage
+    db_size_bytes           database file after the bulk load
+    graph_p50_seconds       graph query latency over --graph-queries random roots
+    graph_p99_seconds
+
+The previous result with the same configuration is printed next to the new one.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+import database_manager as db
+import monerod_rpc as rpc
+import posting_list_database as postings
+import transaction_graph as tg
+import update_signature_table as sig
+import update_tx_table as tx
+from synthetic_chain import SyntheticChain
+from fake_monerod import FakeMonerod
+
+RESULTS_PATH = os.path.join(BENCHMARKS_DIR, 'results.jsonl')
+COMPARED_KEYS = ('blocks_per_second', 'pairs_per_second', 'db_size_bytes', 'graph_p50_seconds', 'graph_p99_seconds')
+
+
+def percentile(values, q):
+    # Nearest-rank percentile.
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(round(q * len(values) + 0.5)) - 1))]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARKS_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(chain, db_path, graph_queries=50, graph_limit=1000, verbose=False, posting_lists=False,
+                  max_block_distance=None, max_depth=None, max_ref_count=None):
+    """
+    Syncs db_path from the chain through a fake monerod and times the graph queries.
+    With posting_lists, ring membership is stored in 'ring_posting' instead of 'signature'.
+    max_block_distance, max_depth and max_ref_count bound the graph queries.
+
+    Returns:
+    dict: The measurements.
+    """
+    fake = FakeMonerod(chain).start()
+    rpc.set_client(rpc.MonerodClient(fake.url, max_retries=2))
+    log = sys.stdout if verbose else io.StringIO()
+
+    try:
+        with contextlib.redirect_stdout(log):
+            db.create_database(db_path)
+            if posting_lists:
+                postings.convert_database(db_path)
+            db_manager = db.open_database_manager(db_path)
+            bulk_load = db_manager.should_bulk_load()
+            if bulk_load:
+                db_manager.begin_bulk_load()
+
+            tx_start = time.perf_counter()
+            tx.update_tx_table(db_manager)
+            tx_seconds = time.perf_counter() - tx_start
+
+            sig_start = time.perf_counter()
+            sig.update_output_tx_pairs_table(db_manager)
+            if bulk_load:
+                db_manager.end_bulk_load()
+            sig_seconds = time.perf_counter() - sig_start
+
+            n_pairs = db_manager.get_table_row_count('signature')
+
+            # Roots from the first half of the chain, so most of them have descendants.
+            roots = chain.random_transactions(graph_queries, min_height=0)
+            roots = [root for root in roots if chain.transactions[root]['height'] < len(chain.blocks) // 2] or roots
+            latencies = []
+            nodes = []
+            for root in roots:
+                query_start = time.perf_counter()
+                graph = tg.create_transaction_graph_from_tx_id(root, db_manager, graph_limit,
+                                                               max_block_distance=max_block_distance, max_depth=max_depth,
+                                                               max_ref_count=max_ref_count)
+                latencies.append(time.perf_counter() - query_start)
+                nodes.append(len(graph))
+            db_manager.close()
+    finally:
+        fake.stop()
+        rpc.get_client().close()
+        rpc.set_client(None)
+
+    return {
+        'blocks_per_second': len(chain.blocks) / tx_seconds,
+        'transactions': len(chain.transactions),
+        'pairs': n_pairs,
+        'expected_pairs': chain.n_ring_members,
+        'pairs_per_second': n_pairs / sig_seconds,
+        'tx_stage_seconds': tx_seconds,
+        'signature_stage_seconds': sig_seconds,
+        'db_size_bytes': os.path.getsize(db_path),
+        'graph_queries': len(latencies),
+        'graph_mean_nodes': sum(nodes) / len(nodes) if nodes else 0,
+        'graph_p50_seconds': percentile(latencies, 0.50),
+        'graph_p99_seconds': percentile(latencies, 0.99),
+    }
+
+
+def previous_result(results_path, config):
+    if not os.path.exists(results_path):
+        return None
+    previous = None
+    with open(results_path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get('config') == config:
+                previous = record
+    return previous
+
+
+def print_comparison(result, previous):
+    print(f"{'metric':<22}{'this run':>16}{'previous':>16}{'change':>10}")
+    for key in COMPARED_KEYS:
+        value = result['measurements'][key]
+        old = previous['measurements'][key] if previous else None
+        change = f'{(value - old) / old * 100:+.1f}%' if old else ''
+        old_text = f'{old:.4g}' if old is not None else '-'
+        print(f'{key:<22}{value:>16.4g}{old_text:>16}{change:>10}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark sync and graph queries against a synthetic chain.')
+    parser.add_argument('--blocks', type=int, default=2000)
+    parser.add_argument('--txs-per-block', type=int, default=20)
+    parser.add_argument('--ring-size', type=int, default=16)
+    parser.add_argument('--inputs-per-tx', type=int, default=2)
+    parser.add_argument('--outputs-per-tx', type=int, default=2)
+    parser.add_argument('--spend-pattern', choices=('uniform', 'recent'), default='recent')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--graph-queries', type=int, default=50)
+    parser.add_argument('--graph-limit', type=int, default=1000)
+    parser.add_argument('--posting-lists', action='store_true', help='Store ring membership as posting lists.')
+    parser.add_argument('--max-block-distance', type=int, help='Bound the graph queries to this many blocks from the root.')
+    parser.add_argument('--max-depth', type=int, help='Bound the graph queries to this many levels.')
+    parser.add_argument('--max-ref-count', type=int, help='Do not follow outputs used by more rings than this.')
+    parser.add_argument('--label', default='', help='Free text stored with the result, e.g. the change being measured.')
+    parser.add_argument('--results', default=RESULTS_PATH, help='JSON-lines file the result is appended to.')
+    parser.add_argument('--keep-db', help='Keep the synced database at this path instead of a temporary file.')
+    parser.add_argument('--overwrite', action='store_true', help='Replace the file at --keep-db if it exists.')
+    parser.add_argument('--verbose', action='store_true', help='Show the progress output of the sync.')
+    arguments = parser.parse_args()
+    if arguments.keep_db and os.path.exists(arguments.keep_db) and not arguments.overwrite:
+        parser.error(f'{arguments.keep_db} already exists; pass --overwrite to replace it.')
+
+    config = {
+        'blocks': arguments.blocks, 'txs_per_block': arguments.txs_per_block, 'ring_size': arguments.ring_size,
+        'inputs_per_tx': arguments.inputs_per_tx, 'outputs_per_tx': arguments.outputs_per_tx,
+        'spend_pattern': arguments.spend_pattern, 'seed': arguments.seed,
+        'graph_queries': arguments.graph_queries, 'graph_limit': arguments.graph_limit,
+        'posting_lists': arguments.posting_lists,
+    }
+    # Only recorded when set, so unbounded runs still compare with the results recorded before them.
+    for key in ('max_block_distance', 'max_depth', 'max_ref_count'):
+        if getattr(arguments, key) is not None:
+            config[key] = getattr(arguments, key)
+
+    print('Generating synthetic chain.')
+    chain = SyntheticChain(arguments.blocks, arguments.txs_per_block, arguments.ring_size, arguments.inputs_per_tx,
+                           arguments.outputs_per_tx, arguments.spend_pattern, seed=arguments.seed)
+    print(f'{len(chain.blocks)} blocks, {len(chain.transactions)} transactions, {chain.n_outputs} outputs.')
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = arguments.keep_db or os.path.join(directory, 'benchmark.db')
+        # Only reached for an existing --keep-db file if --overwrite was given.
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        print('Running benchmark.')
+        measurements = run_benchmark(chain, db_path, arguments.graph_queries, arguments.graph_limit, arguments.verbose,
+                                     arguments.posting_lists, arguments.max_block_distance, arguments.max_depth,
+                                     arguments.max_ref_count)
+
+    if measurements['pairs'] != measurements['expected_pairs']:
+        print(f"Warning: {measurements['pairs']} pairs stored, {measurements['expected_pairs']} expected.")
+
+    result = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'label': arguments.label,
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'sqlite': db.sqlite3.sqlite_version,
+        'config': config,
+        'measurements': measurements,
+    }
+    previous = previous_result(arguments.results, config)
+    with open(arguments.results, 'a') as f:
+        f.write(json.dumps(result) + '\n')
+
+    print_comparison(result, previous)
+    print(f'Result appended to {arguments.results}.')
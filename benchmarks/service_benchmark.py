@@ -0,0 +1,155 @@
+"""
+Load test of query_service.py: several clients asking for graphs at once, against a database
+synced from a synthetic chain, compared with opening a DatabaseManager per query as main.py does.
+
+    python benchmarks/service_benchmark.py --clients 8 --requests 20 --pool-size 4
+
+Each client sends --requests graph queries over one keep-alive connection. Roots are drawn from a
+pool of --distinct-roots transactions, so concurrent clients often ask for the same graph and the
+service can coalesce them. The baseline runs the same queries on as many threads, each query
+opening and closing its own database connection.
+"""
+import argparse
+import asyncio
+import contextlib
+import http.client
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+import database_manager as db
+import metrics
+import query_service
+import transaction_graph as tg
+from run_benchmarks import percentile, run_benchmark
+from synthetic_chain import SyntheticChain
+
+
+def no_monerod(tx_hashes):
+    # Every transaction of the synthetic chain is in 'tx_output', so monerod is never needed. Like
+    # monerod, it returns nothing for hashes it does not know.
+    return {}
+
+
+def start_service(db_path, pool_size, shared_cache):
+    # Runs the service on its own event loop thread. Returns (service, port, stop function).
+    service = query_service.QueryService(db_path, pool_size, shared_cache, no_monerod)
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    state = {}
+
+    async def main():
+        state['server'] = await service.start('127.0.0.1', 0)
+        started.set()
+        async with state['server']:
+            try:
+                await state['server'].serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    thread = threading.Thread(target=lambda: loop.run_until_complete(main()), daemon=True)
+    thread.start()
+    started.wait()
+
+    def stop():
+        loop.call_soon_threadsafe(state['server'].close)
+        thread.join(timeout=5)
+        service.close()
+
+    return service, state['server'].sockets[0].getsockname()[1], stop
+
+
+def run_clients(port, client_roots, limit):
+    # One keep-alive connection per client. Returns the latency of every request.
+    def client(roots):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+        latencies = []
+        for root in roots:
+            start = time.perf_counter()
+            connection.request('GET', f'/graph/{root}?limit={limit}')
+            response = connection.getresponse()
+            body = response.read()
+            if response.status != 200:
+                raise RuntimeError(f'{response.status}: {body[:200]}')
+            json.loads(body)
+            latencies.append(time.perf_counter() - start)
+        connection.close()
+        return latencies
+
+    with ThreadPoolExecutor(max_workers=len(client_roots)) as executor:
+        return [latency for latencies in executor.map(client, client_roots) for latency in latencies]
+
+
+def run_baseline(db_path, client_roots, limit):
+    # Same queries, each on a freshly opened DatabaseManager.
+    def client(roots):
+        latencies = []
+        for root in roots:
+            start = time.perf_counter()
+            db_manager = db.open_database_manager(db_path, check_same_thread=False)
+            try:
+                tg.create_transaction_graph_from_tx_id(root, db_manager, limit, no_monerod)
+            finally:
+                db_manager.close()
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(max_workers=len(client_roots)) as executor:
+        return [latency for latencies in executor.map(client, client_roots) for latency in latencies]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load test the query service against a synthetic chain.')
+    parser.add_argument('--blocks', type=int, default=2000)
+    parser.add_argument('--txs-per-block', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=20, help='Requests per client.')
+    parser.add_argument('--distinct-roots', type=int, default=40)
+    parser.add_argument('--limit', type=int, default=1000)
+    parser.add_argument('--pool-size', type=int, default=4)
+    parser.add_argument('--no-shared-cache', action='store_true')
+    arguments = parser.parse_args()
+
+    print('Generating synthetic chain.')
+    chain = SyntheticChain(arguments.blocks, arguments.txs_per_block, seed=arguments.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'service.db')
+        print('Syncing through fake monerod.')
+        run_benchmark(chain, db_path, graph_queries=0)
+
+        rng = random.Random(arguments.seed)
+        roots = [root for root in chain.random_transactions(arguments.distinct_roots, min_height=0)]
+        client_roots = [[rng.choice(roots) for _ in range(arguments.requests)] for _ in range(arguments.clients)]
+        n_requests = arguments.clients * arguments.requests
+
+        print('Running the baseline.')
+        baseline_start = time.perf_counter()
+        baseline = run_baseline(db_path, client_roots, arguments.limit)
+        baseline_seconds = time.perf_counter() - baseline_start
+
+        print('Running the service.')
+        with contextlib.redirect_stdout(io.StringIO()):
+            service, port, stop = start_service(db_path, arguments.pool_size, not arguments.no_shared_cache)
+        try:
+            service_start = time.perf_counter()
+            served = run_clients(port, client_roots, arguments.limit)
+            service_seconds = time.perf_counter() - service_start
+        finally:
+            stop()
+
+    coalesced = sum(series['value'] for series in metrics.REGISTRY.snapshot().get('service_coalesced_total', []))
+    print(f"{'':<10}{'requests/s':>12}{'p50 s':>10}{'p99 s':>10}")
+    for name, latencies, seconds in (('baseline', baseline, baseline_seconds), ('service', served, service_seconds)):
+        print(f'{name:<10}{n_requests / seconds:>12.1f}{percentile(latencies, 0.5):>10.3f}{percentile(latencies, 0.99):>10.3f}')
+    print(f'{int(coalesced)} of {n_requests} service requests were coalesced.')
@@ -0,0 +1,97 @@
+"""
+Checks the startup cost of the entry points: the time to import each module in a fresh interpreter,
+the peak RSS of that interpreter, and that heavy modules are only loaded by the entry points that
+need them.
+
+    python benchmarks/startup_budget.py
+    python benchmarks/startup_budget.py --runs 10 --time-scale 2
+
+Exits with status 1 if an entry point is over its budget or loads a module it should not.
+Import times vary between machines; --time-scale multiplies the time budgets.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+# Modules that must not be loaded by importing an entry point.
+PLOTTING = ('numpy', 'matplotlib', 'networkx')
+SERVERS = ('asyncio', 'http.server')
+
+# entry point: (import time budget in ms, peak RSS budget in MB, forbidden modules)
+BUDGETS = {
+    'sync': (150, 30, PLOTTING + SERVERS + ('graph_render', 'transaction_graph')),
+    'query': (150, 30, PLOTTING + SERVERS + ('requests',)),
+    'render': (150, 30, PLOTTING + SERVERS + ('requests',)),
+    'main': (150, 30, PLOTTING + SERVERS + ('requests',)),
+    'batch_trace': (150, 30, PLOTTING + SERVERS + ('requests',)),
+    'output_stats': (150, 30, PLOTTING + SERVERS + ('requests',)),
+    'query_service': (200, 40, PLOTTING + ('requests',)),
+}
+
+# Run in a fresh interpreter: imports the entry point and prints the import time, peak RSS and the
+# forbidden modules found in sys.modules. On Linux, ru_maxrss keeps the peak of the process before it
+# exec'd the interpreter, which is the RSS of the caller (a test runner with NumPy loaded, say), so the
+# peak of the interpreter's own memory is read from VmHWM instead.
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+try:
+    with open('/proc/self/status') as status:
+        rss_mb = next(int(line.split()[1]) for line in status if line.startswith('VmHWM:')) / 1024
+except (OSError, StopIteration):
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_mb = rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+print(json.dumps({{'seconds': seconds, 'rss_mb': rss_mb,
+                  'loaded': [name for name in {forbidden!r} if name in sys.modules]}}))
+"""
+
+
+def measure(module, forbidden):
+    """
+    Imports module in a new interpreter started from the repository directory.
+
+    Returns:
+    dict: 'seconds' to import, peak 'rss_mb' of the interpreter, and the forbidden modules 'loaded'.
+    """
+    result = subprocess.run([sys.executable, '-c', PROBE.format(module=module, forbidden=list(forbidden))],
+                            cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def check_budgets(runs, time_scale):
+    # Prints one line per entry point and returns the number of failures.
+    failures = 0
+    print(f"{'entry point':<16}{'import ms':>10}{'budget':>8}{'RSS MB':>8}{'budget':>8}  loaded")
+    for module, (max_ms, max_rss_mb, forbidden) in BUDGETS.items():
+        samples = [measure(module, forbidden) for _ in range(runs)]
+        import_ms = statistics.median(sample['seconds'] for sample in samples) * 1000
+        rss_mb = max(sample['rss_mb'] for sample in samples)
+        loaded = sorted(set(name for sample in samples for name in sample['loaded']))
+        max_ms *= time_scale
+
+        failed = import_ms > max_ms or rss_mb > max_rss_mb or loaded
+        failures += bool(failed)
+        print(f"{module:<16}{import_ms:>10.1f}{max_ms:>8.0f}{rss_mb:>8.1f}{max_rss_mb:>8}  "
+              f"{', '.join(loaded) or '-'}{'  FAIL' if failed else ''}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check the import time and memory budgets of the entry points.')
+    parser.add_argument('--runs', type=int, default=5, help='Interpreters started per entry point (default: 5).')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='Multiplier of the time budgets (default: 1).')
+    arguments = parser.parse_args()
+
+    failures = check_budgets(max(1, arguments.runs), arguments.time_scale)
+    if failures:
+        print(f'{failures} entry points over budget.')
+        sys.exit(1)
+    print('All entry points within budget.')
@@ -0,0 +1,105 @@
+"""
+Deterministic synthetic blockchain for benchmarks.
+
+Every block has a coinbase transaction with one output and txs_per_block regular transactions.
+Each regular transaction has inputs_per_tx key inputs with rings of ring_size distinct earlier
+outputs, and outputs_per_tx new outputs. Ring members are drawn according to spend_pattern:
+
+    uniform   any earlier output is equally likely
+    recent    ages follow an exponential distribution with a mean of recent_mean outputs,
+              like wallets that favour recent decoys
+
+Transactions are serialized with the real prefix layout (version, unlock time, inputs), so the
+blobs go through tx_prefix_parser like blobs from monerod.
+"""
+import hashlib
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tx_prefix_parser import encode_varint, TXIN_GEN, TXIN_TO_KEY, KEY_IMAGE_SIZE
+
+
+def synthetic_hash(*parts):
+    return hashlib.blake2b(repr(parts).encode(), digest_size=32).hexdigest()
+
+
+class SyntheticChain:
+    def __init__(self, n_blocks=2000, txs_per_block=20, ring_size=16, inputs_per_tx=2, outputs_per_tx=2,
+                 spend_pattern='recent', recent_mean=5000, seed=0):
+        if spend_pattern not in ('uniform', 'recent'):
+            raise ValueError(f'Unknown spend pattern: {spend_pattern}')
+
+        self.config = {
+            'n_blocks': n_blocks, 'txs_per_block': txs_per_block, 'ring_size': ring_size,
+            'inputs_per_tx': inputs_per_tx, 'outputs_per_tx': outputs_per_tx,
+            'spend_pattern': spend_pattern, 'recent_mean': recent_mean, 'seed': seed,
+        }
+        self.blocks = []        # per height: {'hash', 'prev_hash', 'miner_tx_hash', 'tx_hashes'}
+        self.transactions = {}  # hex hash -> {'blob': hex, 'output_indices': [...], 'height': h}
+        self.n_outputs = 0
+        self.n_ring_members = 0
+
+        rng = random.Random(seed)
+        prev_hash = '0' * 64
+        for height in range(n_blocks):
+            miner_tx_hash = self._add_transaction(height, 0, self._coinbase_blob(height), 1)
+
+            tx_hashes = []
+            # Regular transactions only start once there are enough outputs to fill a ring.
+            if self.n_outputs >= ring_size:
+                for index in range(1, txs_per_block + 1):
+                    rings = [self._pick_ring(rng) for _ in range(inputs_per_tx)]
+                    self.n_ring_members += len(set(member for ring in rings for member in ring))
+                    tx_hashes.append(self._add_transaction(height, index, self._key_blob(rings, rng), outputs_per_tx))
+
+            block_hash = synthetic_hash('block', seed, height)
+            self.blocks.append({'hash': block_hash, 'prev_hash': prev_hash,
+                                'miner_tx_hash': miner_tx_hash, 'tx_hashes': tx_hashes})
+            prev_hash = block_hash
+
+    def _add_transaction(self, height, index, blob, n_outputs):
+        tx_hash = synthetic_hash('tx', self.config['seed'], height, index)
+        self.transactions[tx_hash] = {
+            'blob': blob.hex(),
+            'output_indices': list(range(self.n_outputs, self.n_outputs + n_outputs)),
+            'height': height,
+        }
+        self.n_outputs += n_outputs
+        return tx_hash
+
+    def _pick_ring(self, rng):
+        ring_size = self.config['ring_size']
+        ring = set()
+        while len(ring) < ring_size:
+            if self.config['spend_pattern'] == 'uniform':
+                ring.add(rng.randrange(self.n_outputs))
+            else:
+                age = int(rng.expovariate(1 / self.config['recent_mean']))
+                ring.add(max(0, self.n_outputs - 1 - age))
+        return sorted(ring)
+
+    @staticmethod
+    def _coinbase_blob(height):
+        return encode_varint(2) + encode_varint(height + 60) + encode_varint(1) + bytes([TXIN_GEN]) + encode_varint(height)
+
+    @staticmethod
+    def _key_blob(rings, rng):
+        blob = bytearray(encode_varint(2) + encode_varint(0) + encode_varint(len(rings)))
+        for ring in rings:
+            blob.append(TXIN_TO_KEY)
+            blob += encode_varint(0)
+            blob += encode_varint(len(ring))
+            previous = 0
+            for member in ring:
+                blob += encode_varint(member - previous)
+                previous = member
+            blob += rng.randbytes(KEY_IMAGE_SIZE)
+        return bytes(blob)
+
+    def random_transactions(self, n, seed=1, min_height=0):
+        # Hashes of n transactions, for example roots for graph queries.
+        hashes = [tx_hash for tx_hash, transaction in self.transactions.items() if transaction['height'] >= min_height]
+        return random.Random(seed).sample(hashes, min(n, len(hashes)))
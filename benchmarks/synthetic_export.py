@@ -0,0 +1,162 @@
+"""
+Writes a SyntheticChain as a raw blockchain export, in the format of monero-blockchain-export, so
+blockchain_import.py can be tested and timed without a real export.
+
+    python benchmarks/synthetic_export.py blockchain.raw --blocks 2000 --txs-per-block 20
+
+The inputs (rings) and output counts of every transaction come from the chain. Outputs, extra and
+RingCT data are random bytes of the right sizes; regular transactions cycle through the RingCT types
+so every layout the importer skips over is exercised. Regular transactions keep their synthetic hashes,
+which the blocks list, so an import matches a sync from fake_monerod.py. Miner transaction and block
+hashes are real Keccak hashes, so blocks link to each other through their prev_id like on the real
+chain; they differ from the ones served by fake_monerod.py.
+"""
+import argparse
+import os
+import random
+import struct
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import blockchain_import as bi
+from tx_prefix_parser import encode_varint, parse_transaction_prefix_inputs
+from synthetic_chain import SyntheticChain
+
+HEADER_SIZE = 1024
+COINBASE_AMOUNT = 600_000_000_000
+RCT_TYPES = (bi.RCT_TYPE_FULL, bi.RCT_TYPE_SIMPLE, bi.RCT_TYPE_BULLETPROOF, bi.RCT_TYPE_BULLETPROOF2,
+             bi.RCT_TYPE_CLSAG, bi.RCT_TYPE_BULLETPROOF_PLUS)
+
+
+def _keys(rng, n):
+    return rng.randbytes(n * bi.KEY_SIZE)
+
+
+def _key_vector(rng, n):
+    return encode_varint(n) + _keys(rng, n)
+
+
+def _outputs(rng, amounts):
+    blob = bytearray(encode_varint(len(amounts)))
+    for amount in amounts:
+        blob += encode_varint(amount)
+        blob.append(bi.TXOUT_TO_TAGGED_KEY)
+        blob += rng.randbytes(bi.KEY_SIZE + 1)
+    # Extra: a tx public key.
+    blob += encode_varint(33) + b'\x01' + rng.randbytes(bi.KEY_SIZE)
+    return bytes(blob)
+
+
+def coinbase_transaction(prefix, rng):
+    # Version 2 miner transaction: prefix, one output, RingCT type null.
+    return prefix + _outputs(rng, [COINBASE_AMOUNT]) + bytes([bi.RCT_TYPE_NULL])
+
+
+def regular_transaction(prefix, n_outputs, rct_type, rng):
+    inputs = parse_transaction_prefix_inputs(prefix)['inputs']
+    n_inputs = len(inputs)
+    ring_size = len(inputs[0]['key_offsets'])
+
+    blob = bytearray(prefix + _outputs(rng, [0] * n_outputs))
+
+    # RingCT base.
+    blob.append(rct_type)
+    blob += encode_varint(30_000_000)
+    if rct_type == bi.RCT_TYPE_SIMPLE:
+        blob += _keys(rng, n_inputs)
+    compact = rct_type in (bi.RCT_TYPE_BULLETPROOF2, bi.RCT_TYPE_CLSAG, bi.RCT_TYPE_BULLETPROOF_PLUS)
+    blob += rng.randbytes(n_outputs * (8 if compact else 2 * bi.KEY_SIZE))
+    blob += _keys(rng, n_outputs)
+
+    # Prunable part: range proofs, ring signatures, pseudo outputs.
+    rounds = 6 + (n_outputs - 1).bit_length()
+    if rct_type in (bi.RCT_TYPE_FULL, bi.RCT_TYPE_SIMPLE):
+        blob += rng.randbytes(n_outputs * bi.RANGE_SIG_SIZE)
+    else:
+        blob += struct.pack('<I', 1) if rct_type == bi.RCT_TYPE_BULLETPROOF else encode_varint(1)
+        blob += _keys(rng, 6) + _key_vector(rng, rounds) + _key_vector(rng, rounds)
+        if rct_type != bi.RCT_TYPE_BULLETPROOF_PLUS:
+            blob += _keys(rng, 3)
+
+    if rct_type in (bi.RCT_TYPE_CLSAG, bi.RCT_TYPE_BULLETPROOF_PLUS):
+        blob += _keys(rng, n_inputs * (ring_size + 2))
+    elif rct_type == bi.RCT_TYPE_FULL:
+        blob += _keys(rng, ring_size * (n_inputs + 1) + 1)
+    else:
+        blob += _keys(rng, n_inputs * (ring_size * 2 + 1))
+
+    if rct_type not in (bi.RCT_TYPE_SIMPLE, bi.RCT_TYPE_FULL):
+        blob += _keys(rng, n_inputs)
+    return bytes(blob)
+
+
+def block_blob(prev_id, timestamp, miner_tx, tx_hashes):
+    header = encode_varint(16) + encode_varint(16) + encode_varint(timestamp) + prev_id + struct.pack('<I', 0)
+    return header + miner_tx + encode_varint(len(tx_hashes)) + b''.join(tx_hashes)
+
+
+def write_raw_export(chain, path, seed=0, real_tx_hashes=False):
+    """
+    Writes chain to path as a raw blockchain export. With real_tx_hashes, blocks list the Keccak
+    hashes of their regular transactions instead of the synthetic ones, as blockchain_import.py
+    --verify expects.
+
+    Returns:
+    list: The hash (bytes) of every block, by height.
+    """
+    rng = random.Random(seed)
+    block_hashes = []
+    prev_id = bytes(bi.KEY_SIZE)
+
+    with open(path, 'wb') as f:
+        # Header: magic, then file_info and blocks_info, each after its uint32 size, padded to HEADER_SIZE.
+        file_info = struct.pack('<II', 0, 1) + encode_varint(HEADER_SIZE)
+        blocks_info = encode_varint(0) + encode_varint(len(chain.blocks) - 1) + encode_varint(0)
+        header = struct.pack('<I', len(file_info)) + file_info + struct.pack('<I', len(blocks_info)) + blocks_info
+        f.write(struct.pack('<I', bi.BLOCKCHAIN_RAW_MAGIC) + header + bytes(HEADER_SIZE - len(header)))
+
+        for height, block in enumerate(chain.blocks):
+            transactions = chain.transactions
+            miner_prefix = bytes.fromhex(transactions[block['miner_tx_hash']]['blob'])
+            miner_tx = coinbase_transaction(miner_prefix, rng)
+
+            tx_blobs = [regular_transaction(bytes.fromhex(transactions[tx_hash]['blob']),
+                                            len(transactions[tx_hash]['output_indices']),
+                                            RCT_TYPES[(height + index) % len(RCT_TYPES)], rng)
+                        for index, tx_hash in enumerate(block['tx_hashes'])]
+            if real_tx_hashes:
+                tx_hashes = [bi.transaction_hash(tx_blob, bi.read_transaction(tx_blob, 0)) for tx_blob in tx_blobs]
+            else:
+                tx_hashes = [bytes.fromhex(tx_hash) for tx_hash in block['tx_hashes']]
+
+            blob = block_blob(prev_id, 1_400_000_000 + 120 * height, miner_tx, tx_hashes)
+            package = blob + encode_varint(len(tx_blobs)) + b''.join(tx_blobs)
+            # Block weight, cumulative difficulty and coins generated.
+            package += encode_varint(len(package)) + encode_varint(height + 1) + encode_varint(COINBASE_AMOUNT * (height + 1))
+            f.write(struct.pack('<I', len(package)) + package)
+
+            parsed = bi.read_block(blob, 0)
+            prev_id = bi.block_hash(blob, parsed, bi.transaction_hash(blob, parsed['miner_tx']))
+            block_hashes.append(prev_id)
+
+    return block_hashes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write a synthetic chain as a raw blockchain export.')
+    parser.add_argument('path')
+    parser.add_argument('--blocks', type=int, default=2000)
+    parser.add_argument('--txs-per-block', type=int, default=20)
+    parser.add_argument('--ring-size', type=int, default=16)
+    parser.add_argument('--spend-pattern', choices=('uniform', 'recent'), default='recent')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--real-tx-hashes', action='store_true',
+                        help='List the Keccak hashes of the regular transactions, for blockchain_import.py --verify.')
+    arguments = parser.parse_args()
+
+    chain = SyntheticChain(arguments.blocks, arguments.txs_per_block, arguments.ring_size,
+                           spend_pattern=arguments.spend_pattern, seed=arguments.seed)
+    write_raw_export(chain, arguments.path, arguments.seed, arguments.real_tx_hashes)
+    print(f'Wrote {len(chain.blocks)} blocks and {len(chain.transactions)} transactions to {arguments.path} '
+          f'({os.path.getsize(arguments.path)} bytes).')
@@ -0,0 +1,158 @@
+"""
+Differential check and throughput benchmark for tx_prefix_parser.
+
+Compares the ring members read from the raw 'as_hex' blob with the ones read from monerod's
+'as_json' decoding, then reports transactions per second for both paths.
+
+Record fixtures from a running monerod (the full and pruned blobs and the JSON decoding of every
+transaction in a block range):
+    python benchmarks/tx_parser_benchmark.py record fixtures.json --start-height 3000000 --blocks 20
+
+Check and benchmark recorded fixtures:
+    python benchmarks/tx_parser_benchmark.py run fixtures.json
+
+Without a daemon, 'run --synthetic 5000' generates random transactions with a matching JSON encoding.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import monerod_rpc as rpc
+import tx_prefix_parser
+from tx_prefix_parser import encode_varint, relative_to_absolute
+
+
+def ring_members_from_json(as_json):
+    # The decoding used by update_output_tx_pairs_table before the binary parser.
+    ring_members = set()
+    for tx_input in json.loads(as_json)['vin']:
+        if 'key' in tx_input:
+            ring_members.update(relative_to_absolute(tx_input['key']['key_offsets']))
+    return ring_members
+
+
+def record_fixtures(path, start_height, n_blocks):
+    client = rpc.get_client()
+    tx_hashes = []
+    for result in client.json_rpc_batch(('get_block', {'height': height})
+                                        for height in range(start_height, start_height + n_blocks)):
+        tx_hashes.append(result['miner_tx_hash'])
+        tx_hashes.extend(result.get('tx_hashes', []))
+
+    payload = {"txs_hashes": tx_hashes, "decode_as_json": True}
+    transactions = client.post_json('/get_transactions', payload)['txs']
+    # The blobs the sync actually receives.
+    pruned = {tx['tx_hash']: tx.get('pruned_as_hex') or tx['as_hex']
+              for tx in client.post_json('/get_transactions', dict(txs_hashes=tx_hashes, prune=True))['txs']}
+
+    fixtures = [{'tx_hash': tx['tx_hash'], 'as_hex': tx['as_hex'], 'pruned_as_hex': pruned[tx['tx_hash']],
+                 'as_json': tx['as_json']} for tx in transactions]
+    with open(path, 'w') as f:
+        json.dump(fixtures, f)
+    print(f'Recorded {len(fixtures)} transactions from blocks {start_height} to {start_height + n_blocks - 1} to {path}.')
+
+
+def synthetic_fixtures(n_transactions, ring_size=16, n_outputs=2, seed=0):
+    # Blobs look like what the sync requests (pruned: prefix and RingCT base only), while the
+    # JSON carries the prunable CLSAG and Bulletproof+ data that decode_as_json always includes.
+    rng = random.Random(seed)
+
+    def random_hex(n_bytes):
+        return rng.randbytes(n_bytes).hex()
+
+    fixtures = []
+    for i in range(n_transactions):
+        blob = bytearray(encode_varint(2) + encode_varint(0))
+        vin = []
+        n_inputs = rng.randint(1, 4)
+        blob += encode_varint(n_inputs)
+        for _ in range(n_inputs):
+            absolute = sorted(rng.sample(range(90_000_000), ring_size))
+            relative = [absolute[0]] + [b - a for a, b in zip(absolute, absolute[1:])]
+            key_image = rng.randbytes(32)
+            blob += bytes([tx_prefix_parser.TXIN_TO_KEY]) + encode_varint(0) + encode_varint(ring_size)
+            for offset in relative:
+                blob += encode_varint(offset)
+            blob += key_image
+            vin.append({'key': {'amount': 0, 'key_offsets': relative, 'k_image': key_image.hex()}})
+
+        # Outputs, extra and the RingCT base follow the inputs; the parser must ignore them.
+        blob += rng.randbytes(n_outputs * 35 + 44 + 1 + 3 + n_outputs * 40)
+
+        as_json = {
+            'version': 2,
+            'unlock_time': 0,
+            'vin': vin,
+            'vout': [{'amount': 0, 'target': {'tagged_key': {'key': random_hex(32), 'view_tag': random_hex(1)}}} for _ in range(n_outputs)],
+            'extra': list(rng.randbytes(44)),
+            'rct_signatures': {
+                'type': 6,
+                'txnFee': rng.randint(10_000_000, 100_000_000),
+                'ecdhInfo': [{'amount': random_hex(8)} for _ in range(n_outputs)],
+                'outPk': [random_hex(32) for _ in range(n_outputs)],
+            },
+            'rctsig_prunable': {
+                'nbp': 1,
+                'bpp': [{'A': random_hex(32), 'A1': random_hex(32), 'B': random_hex(32), 'r1': random_hex(32),
+                         's1': random_hex(32), 'd1': random_hex(32),
+                         'L': [random_hex(32) for _ in range(7)], 'R': [random_hex(32) for _ in range(7)]}],
+                'CLSAGs': [{'s': [random_hex(32) for _ in range(ring_size)], 'c1': random_hex(32), 'D': random_hex(32)}
+                           for _ in range(n_inputs)],
+                'pseudoOuts': [random_hex(32) for _ in range(n_inputs)],
+            },
+        }
+        fixtures.append({'tx_hash': f'{i:064x}', 'as_hex': bytes(blob).hex(), 'as_json': json.dumps(as_json, indent=2)})
+    return fixtures
+
+
+def run(fixtures, repeat):
+    mismatches = 0
+    for fixture in fixtures:
+        if tx_prefix_parser.ring_members_from_hex(fixture['as_hex']) != ring_members_from_json(fixture['as_json']):
+            mismatches += 1
+            print(f"MISMATCH {fixture['tx_hash']}")
+    print(f'Differential check: {len(fixtures) - mismatches}/{len(fixtures)} transactions match.')
+
+    for name, function, field in [('as_json + json.loads', ring_members_from_json, 'as_json'),
+                                  ('as_hex + tx_prefix_parser', tx_prefix_parser.ring_members_from_hex, 'as_hex')]:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for fixture in fixtures:
+                function(fixture[field])
+        duration = time.perf_counter() - start
+        payload_bytes = sum(len(fixture[field]) for fixture in fixtures)
+        print(f'{name:<28} {round(len(fixtures) * repeat / duration):>10} txs/s | payload {round(payload_bytes / len(fixtures))} bytes/tx')
+
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Differential check and benchmark of the binary transaction prefix parser.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = subparsers.add_parser('record', help='Record fixtures from a running monerod.')
+    record_parser.add_argument('path')
+    record_parser.add_argument('--start-height', type=int, required=True)
+    record_parser.add_argument('--blocks', type=int, default=10)
+
+    run_parser = subparsers.add_parser('run', help='Check and benchmark fixtures.')
+    run_parser.add_argument('path', nargs='?')
+    run_parser.add_argument('--synthetic', type=int, default=0, help='Generate this many transactions instead of loading a file.')
+    run_parser.add_argument('--repeat', type=int, default=3)
+
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        record_fixtures(args.path, args.start_height, args.blocks)
+    else:
+        if args.synthetic:
+            fixtures = synthetic_fixtures(args.synthetic)
+        else:
+            with open(args.path) as f:
+                fixtures = json.load(f)
+        sys.exit(1 if run(fixtures, args.repeat) else 0)
@@ -0,0 +1,443 @@
+"""
+Offline import from a raw blockchain export, the file written by monero-blockchain-export
+(~/.bitmonero/export/blockchain.raw by default), so the initial sync needs no daemon.
+
+File layout, all integers little-endian:
+
+    magic           uint32 0x28721586
+    header          header_size bytes: uint32 length of file_info, file_info (uint32 major_version,
+                    uint32 minor_version, varint header_size), blocks_info, zero padding
+    chunks          uint32 chunk_size, then a block_package of chunk_size bytes, one per block
+
+    block_package   block, varint tx count, the full transactions of the block (not the miner
+                    transaction), then the block weight, cumulative difficulty and coins generated
+
+The file is memory-mapped and parsed sequentially. Only the fields the database needs are decoded:
+the ring members of every input and the amounts of the outputs. Everything else (signatures, range
+proofs) is skipped by computing its size, so the whole transaction has to be understood, unlike
+tx_prefix_parser which stops after the inputs.
+
+Hashes of regular transactions are taken from the block. Miner transaction hashes are computed with
+Keccak-256, and block hashes are taken from the prev_id of the next block, so the only block hash
+computed is the last one. Global output indices are counted per amount from the start of the chain
+(RingCT outputs, including the outputs of version 2 miner transactions, all count under amount 0),
+the way monerod assigns them.
+"""
+import argparse
+import mmap
+import struct
+import time
+import database_manager as db
+import keccak
+import metrics
+from tx_prefix_parser import read_varint, encode_varint, TXIN_GEN, TXIN_TO_KEY, KEY_IMAGE_SIZE
+
+BLOCKCHAIN_RAW_MAGIC = 0x28721586
+
+TXOUT_TO_KEY = 0x02
+TXOUT_TO_TAGGED_KEY = 0x03
+
+RCT_TYPE_NULL = 0
+RCT_TYPE_FULL = 1
+RCT_TYPE_SIMPLE = 2
+RCT_TYPE_BULLETPROOF = 3
+RCT_TYPE_BULLETPROOF2 = 4
+RCT_TYPE_CLSAG = 5
+RCT_TYPE_BULLETPROOF_PLUS = 6
+
+KEY_SIZE = 32
+SIGNATURE_SIZE = 64
+RANGE_SIG_SIZE = 64 * KEY_SIZE * 3 + KEY_SIZE  # Borromean signature (s0, s1, ee) and 64 commitments
+NULL_HASH = bytes(KEY_SIZE)
+NULL_RCT_BASE_HASH = keccak.keccak_256(bytes([RCT_TYPE_NULL]))  # the base of miner transactions
+
+
+def _read_key_vector(blob, offset):
+    # Skips a varint counted vector of 32 byte keys.
+    count, offset = read_varint(blob, offset)
+    return offset + count * KEY_SIZE
+
+
+def read_transaction(blob, offset):
+    """
+    Parses one fully serialized transaction.
+
+    Parameters:
+    blob (bytes or mmap): The data holding the transaction.
+    offset (int): Position of the first byte of the transaction.
+
+    Returns:
+    dict: 'version', 'rct_type', 'ring_members' (set of absolute output indices), 'output_amounts',
+          and the offsets 'start', 'prefix_end', 'base_end' and 'end'.
+    """
+    start = offset
+    version, offset = read_varint(blob, offset)
+    _, offset = read_varint(blob, offset)  # unlock time
+
+    n_inputs, offset = read_varint(blob, offset)
+    ring_members = set()
+    ring_sizes = []
+    for _ in range(n_inputs):
+        tag = blob[offset]
+        offset += 1
+        if tag == TXIN_TO_KEY:
+            _, offset = read_varint(blob, offset)  # amount
+            n_offsets, offset = read_varint(blob, offset)
+            member = 0
+            for _ in range(n_offsets):
+                key_offset, offset = read_varint(blob, offset)
+                member += key_offset
+                ring_members.add(member)
+            offset += KEY_IMAGE_SIZE
+            ring_sizes.append(n_offsets)
+        elif tag == TXIN_GEN:
+            _, offset = read_varint(blob, offset)  # height
+            ring_sizes.append(0)
+        else:
+            raise ValueError(f'Unsupported transaction input type: {tag:#04x}')
+
+    n_outputs, offset = read_varint(blob, offset)
+    output_amounts = []
+    for _ in range(n_outputs):
+        amount, offset = read_varint(blob, offset)
+        tag = blob[offset]
+        offset += 1
+        if tag == TXOUT_TO_KEY:
+            offset += KEY_SIZE
+        elif tag == TXOUT_TO_TAGGED_KEY:
+            offset += KEY_SIZE + 1
+        else:
+            raise ValueError(f'Unsupported transaction output type: {tag:#04x}')
+        output_amounts.append(amount)
+
+    extra_size, offset = read_varint(blob, offset)
+    offset += extra_size
+    prefix_end = offset
+
+    rct_type = RCT_TYPE_NULL
+    if version == 1:
+        # One ring signature per input, one 64 byte signature per ring member, without length prefixes.
+        offset += SIGNATURE_SIZE * sum(ring_sizes)
+        base_end = offset
+    else:
+        rct_type = blob[offset]
+        offset += 1
+        if rct_type != RCT_TYPE_NULL:
+            if rct_type > RCT_TYPE_BULLETPROOF_PLUS:
+                raise ValueError(f'Unsupported RingCT type: {rct_type}')
+            _, offset = read_varint(blob, offset)  # fee
+            if rct_type == RCT_TYPE_SIMPLE:
+                offset += n_inputs * KEY_SIZE  # pseudo outputs
+            compact_amounts = rct_type in (RCT_TYPE_BULLETPROOF2, RCT_TYPE_CLSAG, RCT_TYPE_BULLETPROOF_PLUS)
+            offset += n_outputs * (8 if compact_amounts else 2 * KEY_SIZE)  # encrypted amounts
+            offset += n_outputs * KEY_SIZE  # output commitments
+        base_end = offset
+
+        if rct_type != RCT_TYPE_NULL:
+            # Every ring has the size of the first one.
+            ring_size = ring_sizes[0] if ring_sizes else 0
+
+            if rct_type in (RCT_TYPE_BULLETPROOF, RCT_TYPE_BULLETPROOF2, RCT_TYPE_CLSAG, RCT_TYPE_BULLETPROOF_PLUS):
+                if rct_type == RCT_TYPE_BULLETPROOF:
+                    n_proofs = struct.unpack_from('<I', blob, offset)[0]
+                    offset += 4
+                else:
+                    n_proofs, offset = read_varint(blob, offset)
+                for _ in range(n_proofs):
+                    offset += 6 * KEY_SIZE  # A, S, T1, T2, taux, mu or A, A1, B, r1, s1, d1
+                    offset = _read_key_vector(blob, offset)  # L
+                    offset = _read_key_vector(blob, offset)  # R
+                    if rct_type != RCT_TYPE_BULLETPROOF_PLUS:
+                        offset += 3 * KEY_SIZE  # a, b, t
+            else:
+                offset += n_outputs * RANGE_SIG_SIZE
+
+            if rct_type in (RCT_TYPE_CLSAG, RCT_TYPE_BULLETPROOF_PLUS):
+                offset += n_inputs * (ring_size * KEY_SIZE + 2 * KEY_SIZE)  # s, c1, D
+            elif rct_type == RCT_TYPE_FULL:
+                offset += ring_size * (n_inputs + 1) * KEY_SIZE + KEY_SIZE  # one MLSAG over all inputs
+            else:
+                offset += n_inputs * (ring_size * 2 * KEY_SIZE + KEY_SIZE)  # one MLSAG per input
+
+            if rct_type not in (RCT_TYPE_SIMPLE, RCT_TYPE_FULL):
+                offset += n_inputs * KEY_SIZE  # pseudo outputs
+
+    if offset > len(blob):
+        raise ValueError('Truncated transaction.')
+
+    return {
+        'version': version,
+        'rct_type': rct_type,
+        'ring_members': ring_members,
+        'output_amounts': output_amounts,
+        'start': start,
+        'prefix_end': prefix_end,
+        'base_end': base_end,
+        'end': offset,
+    }
+
+
+def transaction_hash(blob, transaction):
+    """
+    Computes the hash of a transaction parsed by read_transaction.
+    """
+    if transaction['version'] == 1:
+        return keccak.keccak_256(blob[transaction['start']:transaction['end']])
+
+    # Version 2 hashes the prefix, the RingCT base and the prunable part separately.
+    if transaction['rct_type'] == RCT_TYPE_NULL:
+        base_hash, prunable_hash = NULL_RCT_BASE_HASH, NULL_HASH
+    else:
+        base_hash = keccak.keccak_256(blob[transaction['prefix_end']:transaction['base_end']])
+        prunable_hash = keccak.keccak_256(blob[transaction['base_end']:transaction['end']])
+    return keccak.keccak_256(keccak.keccak_256(blob[transaction['start']:transaction['prefix_end']]) +
+                             base_hash + prunable_hash)
+
+
+def read_block(blob, offset):
+    """
+    Parses a serialized block: header, miner transaction and the hashes of the other transactions.
+
+    Returns:
+    dict: 'prev_id', 'miner_tx' (as returned by read_transaction), 'tx_hashes' (list of bytes),
+          and the offsets 'start', 'header_end' and 'end'.
+    """
+    start = offset
+    _, offset = read_varint(blob, offset)  # major version
+    _, offset = read_varint(blob, offset)  # minor version
+    _, offset = read_varint(blob, offset)  # timestamp
+    prev_id = bytes(blob[offset:offset + KEY_SIZE])
+    offset += KEY_SIZE + 4  # prev_id, nonce
+    header_end = offset
+
+    miner_tx = read_transaction(blob, offset)
+    offset = miner_tx['end']
+
+    n_hashes, offset = read_varint(blob, offset)
+    tx_hashes = [bytes(blob[position:position + KEY_SIZE])
+                 for position in range(offset, offset + n_hashes * KEY_SIZE, KEY_SIZE)]
+    offset += n_hashes * KEY_SIZE
+
+    return {
+        'prev_id': prev_id,
+        'miner_tx': miner_tx,
+        'tx_hashes': tx_hashes,
+        'start': start,
+        'header_end': header_end,
+        'end': offset,
+    }
+
+
+def block_hash(blob, block, miner_tx_hash):
+    # Keccak of the length-prefixed hashing blob: header, Merkle root of all tx hashes, tx count.
+    hashing_blob = (bytes(blob[block['start']:block['header_end']]) +
+                    keccak.tree_hash([miner_tx_hash] + block['tx_hashes']) +
+                    encode_varint(len(block['tx_hashes']) + 1))
+    return keccak.keccak_256(encode_varint(len(hashing_blob)) + hashing_blob)
+
+
+class RawBlockchainExport:
+    """
+    Memory-mapped raw blockchain export, read one block package at a time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.data) < 8 or struct.unpack_from('<I', self.data, 0)[0] != BLOCKCHAIN_RAW_MAGIC:
+            self.close()
+            raise ValueError(f'{path} is not a raw blockchain export.')
+        file_info_size = struct.unpack_from('<I', self.data, 4)[0]
+        self.major_version, self.minor_version = struct.unpack_from('<II', self.data, 8)
+        header_size, _ = read_varint(self.data, 16)
+        if 8 + file_info_size > 4 + header_size:
+            self.close()
+            raise ValueError(f'Invalid header size in {path}.')
+        self.first_chunk = 4 + header_size
+
+    def block_packages(self):
+        """
+        Yields every block package in file order.
+
+        Yields:
+        dict: What read_block returns, plus 'height' (from the miner transaction input) and
+              'transactions', the regular transactions parsed by read_transaction.
+        """
+        data = self.data
+        offset = self.first_chunk
+        while offset + 4 <= len(data):
+            chunk_size = struct.unpack_from('<I', data, offset)[0]
+            chunk_start = offset + 4
+            offset = chunk_start + chunk_size
+            if offset > len(data):
+                raise ValueError(f'Truncated chunk at byte {chunk_start - 4} of {self.path}.')
+
+            block = read_block(data, chunk_start)
+            height, _ = read_varint(data, miner_tx_height_offset(data, block['miner_tx']))
+            block['height'] = height
+
+            n_transactions, position = read_varint(data, block['end'])
+            if n_transactions != len(block['tx_hashes']):
+                raise ValueError(f'Block {height} lists {len(block["tx_hashes"])} transactions but holds {n_transactions}.')
+            transactions = []
+            for _ in range(n_transactions):
+                transaction = read_transaction(data, position)
+                position = transaction['end']
+                transactions.append(transaction)
+            if position > offset:
+                raise ValueError(f'Block {height} overruns its chunk.')
+            block['transactions'] = transactions
+            yield block
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+def miner_tx_height_offset(blob, miner_tx):
+    # Offset of the height in the txin_gen input of a miner transaction.
+    offset = miner_tx['start']
+    _, offset = read_varint(blob, offset)  # version
+    _, offset = read_varint(blob, offset)  # unlock time
+    n_inputs, offset = read_varint(blob, offset)
+    if n_inputs != 1 or blob[offset] != TXIN_GEN:
+        raise ValueError('Miner transaction without a generation input.')
+    return offset + 1
+
+
+def assign_output_indices(transaction, output_counts):
+    # Global output indices are counted per amount; every version 2 output counts under amount 0.
+    output_indices = []
+    for amount in transaction['output_amounts']:
+        amount = amount if transaction['version'] == 1 else 0
+        output_indices.append(output_counts.get(amount, 0))
+        output_counts[amount] = output_counts.get(amount, 0) + 1
+    return output_indices
+
+
+def import_raw_export(db_manager, path, blocks_per_commit=1000, verify_hashes=False):
+    """
+    Saves the blocks of a raw blockchain export that are not in the database yet, through add_blocks,
+    with blocks_per_commit blocks per transaction.
+
+    Blocks already in the database are still parsed, to count their outputs, but not hashed or saved.
+    Like the RPC sync, an empty database is filled in bulk-load mode.
+    The first new block must follow the last saved one (checked through its prev_id when that block's
+    hash is stored), so an import can resume one interrupted earlier or continue an RPC sync of the
+    same chain.
+
+    Parameters:
+    db_manager (DatabaseManager): The open database.
+    path (str): The raw blockchain export.
+    blocks_per_commit (int): Number of blocks saved per transaction.
+    verify_hashes (bool): Also compute every block hash and regular transaction hash and compare them
+                          with the chain, which is several times slower.
+
+    Returns:
+    int: The number of blocks imported.
+    """
+    print('--------------------------------')
+    print(f'Importing raw blockchain export {path}.')
+    print('This might take a while.\n')
+
+    latest_block = db_manager.get_latest_block_completed()
+    first_height = latest_block + 1 if latest_block is not None else 0
+    print(f'Importing from block {first_height}.')
+
+    blocks_imported = metrics.counter('import_blocks_total', 'Blocks imported from a raw export.')
+    txs_imported = metrics.counter('sync_transactions_total', 'Transactions processed.', stage='import')
+    blocks_per_second = metrics.gauge('sync_rows_per_second', 'Processing rate since the stage started.', stage='import')
+
+    export = RawBlockchainExport(path)
+    bulk_load = db_manager.should_bulk_load()
+    if bulk_load:
+        db_manager.begin_bulk_load()
+    output_counts = {}
+    pending = []        # [height, block hash or None, transactions] waiting for the next block's prev_id
+    n_imported = 0
+    previous = None     # (height, block dict) of the last block parsed, to compute its hash at the end
+    stage_start = time.time()
+
+    try:
+        for block in export.block_packages():
+            height = block['height']
+            if previous is not None and height != previous[0] + 1:
+                raise ValueError(f'Block {height} follows block {previous[0]} in {path}.')
+
+            miner_outputs = assign_output_indices(block['miner_tx'], output_counts)
+            outputs = [assign_output_indices(transaction, output_counts) for transaction in block['transactions']]
+            previous = (height, block)
+            if height < first_height:
+                continue
+
+            if pending:
+                pending[-1][1] = block['prev_id']
+            elif height > 0:
+                stored_hash = db_manager.get_block_hash(height - 1)
+                if stored_hash is not None and stored_hash != block['prev_id']:
+                    raise ValueError(f'Block {height} of {path} does not follow block {height - 1} of the database.')
+
+            if verify_hashes:
+                if pending and block_hash(export.data, pending_block, pending[-1][2][0][0]) != block['prev_id']:
+                    raise ValueError(f'Hash mismatch for block {height - 1}.')
+                for transaction, tx_hash in zip(block['transactions'], block['tx_hashes']):
+                    if transaction_hash(export.data, transaction) != tx_hash:
+                        raise ValueError(f'Hash mismatch for transaction {tx_hash.hex()} in block {height}.')
+            pending_block = block
+
+            miner_tx_hash = transaction_hash(export.data, block['miner_tx'])
+            transactions = [(miner_tx_hash, block['miner_tx']['ring_members'], miner_outputs, block['miner_tx']['version'])]
+            transactions.extend((tx_hash, transaction['ring_members'], output_indices, transaction['version'])
+                                for tx_hash, transaction, output_indices
+                                in zip(block['tx_hashes'], block['transactions'], outputs))
+            pending.append([height, None, transactions])
+
+            # The last pending block still waits for its hash.
+            if len(pending) > blocks_per_commit:
+                n_imported += save_blocks(db_manager, pending[:-1], blocks_imported, txs_imported)
+                pending = pending[-1:]
+                blocks_per_second.set(n_imported / max(time.time() - stage_start, 1e-9))
+
+        if pending:
+            pending[-1][1] = block_hash(export.data, pending_block, pending[-1][2][0][0])
+            n_imported += save_blocks(db_manager, pending, blocks_imported, txs_imported)
+        if bulk_load:
+            db_manager.end_bulk_load()
+    finally:
+        export.close()
+
+    print(f'Imported {n_imported} blocks in {round(time.time() - stage_start, 2)}s.')
+    print('--------------------------------\n')
+    return n_imported
+
+
+def save_blocks(db_manager, pending, blocks_imported, txs_imported):
+    db_manager.add_blocks([tuple(block) for block in pending])
+    db_manager.flush()
+    blocks_imported.inc(len(pending))
+    txs_imported.inc(sum(len(transactions) for _, _, transactions in pending))
+    return len(pending)
+
+
+if __name__ == "__main__":
+    DB_PATH = 'database/output_to_ring_signature.db'
+
+    parser = argparse.ArgumentParser(description='Import a raw blockchain export (monero-blockchain-export) without monerod.')
+    parser.add_argument('export', help='Raw export file, e.g. ~/.bitmonero/export/blockchain.raw.')
+    parser.add_argument('--db', default=DB_PATH, help=f'SQLite database (default: {DB_PATH}).')
+    parser.add_argument('--blocks-per-commit', type=int, default=1000,
+                        help='Blocks saved per transaction (default: 1000).')
+    parser.add_argument('--verify', action='store_true',
+                        help='Check every block and transaction hash while importing.')
+    arguments = parser.parse_args()
+
+    metrics.configure_from_environment()
+    db.create_database(arguments.db)
+    db_manager = db.open_database_manager(arguments.db)
+    try:
+        import_raw_export(db_manager, arguments.export, max(1, arguments.blocks_per_commit), arguments.verify)
+    finally:
+        db_manager.close()
+        metrics.stop_reporting()
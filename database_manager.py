@@ -1,5 +1,60 @@
 import sqlite3
 import os
+from collections import Counter
+from urllib.parse import quote
+import metrics
+from tx_prefix_parser import encode_varint, read_varint
+
+# Largest value of an SQLite integer, the upper bound of ring lookups without a block window.
+MAX_TX_KEY = (1 << 63) - 1
+
+# Temporary tables the batch lookups join against, and their one column.
+QUERY_TABLE_COLUMNS = {'query_outputs': 'output', 'query_tx_keys': 'tx_key'}
+
+
+def pack_output_indices(output_indices):
+    # Global output indices of one transaction, stored as a varint count followed by varint deltas.
+    # RingCT outputs are consecutive, so most deltas take a single byte.
+    packed = bytearray(encode_varint(len(output_indices)))
+    previous = 0
+    for output in output_indices:
+        # Pre-RingCT indices are per amount and need not increase, so store the sign in the low bit.
+        delta = output - previous
+        packed += encode_varint((delta << 1) if delta >= 0 else (((-delta) << 1) | 1))
+        previous = output
+    return bytes(packed)
+
+
+def unpack_output_indices(packed):
+    count, offset = read_varint(packed, 0)
+    output_indices = []
+    previous = 0
+    for _ in range(count):
+        zigzag, offset = read_varint(packed, offset)
+        previous += -(zigzag >> 1) if zigzag & 1 else (zigzag >> 1)
+        output_indices.append(previous)
+    return output_indices
+
+
+def connect(db_path, check_same_thread=True, read_only=False, shared_cache=False):
+    """
+    Opens an SQLite connection to db_path. Read-only connections never write to the database file,
+    which must exist; with shared_cache, the read-only connections of a process share one page cache.
+    """
+    if not read_only:
+        return sqlite3.connect(db_path, check_same_thread=check_same_thread)
+    uri = f"file:{quote(os.path.abspath(db_path))}?mode=ro{'&cache=shared' if shared_cache else ''}"
+    return sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+
+
+SIGNATURE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    output INTEGER NOT NULL,
+    tx_key INTEGER NOT NULL,
+    FOREIGN KEY(tx_key) REFERENCES tx(key),
+    PRIMARY KEY (output, tx_key)
+) WITHOUT ROWID;
+"""
 
 
 def create_database(db_path):
@@ -23,37 +78,232 @@ def create_database(db_path):
         
         # Create table 'signature' if it doesn't exist with columns: 'output' (integer), 'tx_key' (integer),
         # set 'tx_key' as a foreign key referencing 'key' from the 'tx' table.
-        # The primary key is a composite of 'output' and 'tx_key'.
+        # The primary key is a composite of 'output' and 'tx_key'. The table is stored WITHOUT ROWID, so the
+        # rows are clustered by output and the primary key doubles as the lookup index.
+        cursor.execute(SIGNATURE_TABLE_SQL.format(table='signature'))
+
+        # Commit the changes and close the connection
+        conn.commit()
+        conn.close()
+
+    # Tables added after the first release are created on existing databases as well.
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    # Create table 'sync_state' which records, per sync stage ('tx', 'signature', 'tx_output'), the last
+    # block and tx key completed. It is written in the same commit as each batch, so resuming is a single
+    # lookup and never sees a half-written batch.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sync_state (
+        stage TEXT PRIMARY KEY,
+        last_block INTEGER,
+        last_tx_key INTEGER
+    );
+    """)
+
+    # Create table 'block' which stores the hash of each block and the key of its first transaction
+    # (the miner transaction), so chain reorganisations can be detected and rolled back.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS block (
+        height INTEGER PRIMARY KEY,
+        hash BLOB,
+        first_tx_key INTEGER
+    );
+    """)
+
+    # Create table 'ring_journal' which keeps the ring members of the transactions added by follow mode,
+    # so their 'signature' rows can be found again if their block is orphaned. Old entries are pruned.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS ring_journal (
+        tx_key INTEGER PRIMARY KEY,
+        ring_members BLOB
+    );
+    """)
+
+    # Create table 'tx_output' which stores the global output indices created by each transaction,
+    # packed with pack_output_indices, so graphs can be built without asking monerod.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS tx_output (
+        tx_key INTEGER PRIMARY KEY,
+        outputs BLOB,
+        FOREIGN KEY(tx_key) REFERENCES tx(key)
+    );
+    """)
+    conn.commit()
+
+    # Create table 'rct_output_origin' which maps each RingCT output to the key of the transaction that
+    # created it, the reverse of 'tx_output', so the ring members of a transaction can be traced back to
+    # their sources. Only outputs of version 2 transactions are indexed: they all share the amount 0 index
+    # space, while pre-RingCT outputs are indexed per amount and the same index names one output of every
+    # amount, so they cannot be keyed by index alone.
+    # It replaces 'output_origin', which mixed both spaces. 'tx_output' does not record versions, so on
+    # databases synced before, the 'tx_output' stage is restarted and the next sync fills the table.
+    if cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rct_output_origin'").fetchone() is None:
+        cursor.execute("BEGIN")
         cursor.execute("""
-        CREATE TABLE IF NOT EXISTS signature (
-            output INTEGER,
-            tx_key INTEGER,
-            FOREIGN KEY(tx_key) REFERENCES tx(key),
-            PRIMARY KEY (output, tx_key)
+        CREATE TABLE rct_output_origin (
+            output INTEGER PRIMARY KEY,
+            tx_key INTEGER NOT NULL,
+            FOREIGN KEY(tx_key) REFERENCES tx(key)
         );
         """)
+        cursor.execute("DROP TABLE IF EXISTS output_origin")
+        if cursor.execute("SELECT 1 FROM tx_output LIMIT 1").fetchone() is not None:
+            print('The output origins will be indexed again by the next sync.')
+            cursor.execute("INSERT OR REPLACE INTO sync_state (stage, last_block, last_tx_key) VALUES ('tx_output', NULL, 0)")
+        conn.commit()
 
-        # Add index to output column of signature table to make it easy to lookup outputs.
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_signature_output_desc
-            ON signature(output DESC)
-        """)
-        # Commit the changes and close the connection
+    # Create table 'output_stats' which counts, for each output, the rings that reference it: the rows of
+    # 'signature' per output, kept up to date by every write so they never have to be counted with a scan.
+    # Outputs that no ring references have no row. Databases synced before it existed are counted below,
+    # through the manager of their storage layout.
+    count_references = (
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'output_stats'").fetchone() is None
+        and cursor.execute("SELECT 1 FROM tx LIMIT 1").fetchone() is not None)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS output_stats (
+        output INTEGER PRIMARY KEY,
+        ref_count INTEGER NOT NULL
+    );
+    """)
+    conn.commit()
+
+    # Create index 'idx_tx_block' on the block of each transaction, so block windows of graph queries
+    # map to tx key ranges with a single index lookup (see get_tx_key_range).
+    if cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_tx_block'").fetchone() is None:
+        if cursor.execute("SELECT 1 FROM tx LIMIT 1").fetchone() is not None:
+            print('Indexing the block of every transaction already saved. This might take a while.')
+        cursor.execute("CREATE INDEX idx_tx_block ON tx (block)")
         conn.commit()
-        conn.close()
+    conn.close()
+
+    if count_references:
+        db_manager = open_database_manager(db_path)
+        try:
+            # A bulk load in progress is counted by end_bulk_load.
+            if not db_manager.should_bulk_load() and db_manager.get_largest_tx_value_from_signature_table() is not None:
+                db_manager.rebuild_output_stats()
+        finally:
+            db_manager.close()
     
     print('Database and table creation or verification complete.')
 
 
 class DatabaseManager:
-    def __init__(self, db_path):
-        self.conn = sqlite3.connect(db_path)
+    def __init__(self, db_path, check_same_thread=True, read_only=False, shared_cache=False):
+        # Pass check_same_thread=False to close the connection from a thread other than the one using it.
+        # Read-only managers (see connect) only serve queries; their temporary query tables are private.
+        self.conn = connect(db_path, check_same_thread, read_only, shared_cache)
         self.conn.execute('PRAGMA foreign_keys = ON')
         self.conn.commit()
+        self.read_only = read_only
+        self.bulk_load = False
         print('Database manager started.')
 
-    def add_transactions(self, transactions):
+    def should_bulk_load(self):
+        # Bulk loading pays off for the initial sync, or to finish one that was interrupted.
+        if self.has_signature_staging_table():
+            return True
+        return self.conn.execute("SELECT 1 FROM signature LIMIT 1").fetchone() is None
+
+    def is_signature_table_without_rowid(self):
+        # Databases created before the compact schema keep a rowid table until migrate_signature_table.py is run.
+        row = self.conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'signature'").fetchone()
+        return row is not None and 'WITHOUT ROWID' in row[0].upper()
+
+    def has_signature_staging_table(self):
+        row = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'signature_staging'").fetchone()
+        return row is not None
+
+    def begin_bulk_load(self):
+        """
+        Switches the connection to bulk-load mode for the initial sync.
+
+        Output-tx pairs are appended to an unindexed 'signature_staging' table instead of 'signature',
+        foreign keys are not enforced and commits are not synced to disk. The WAL journal keeps the
+        database consistent if the process is killed, but not on power loss.
+        Call end_bulk_load once the sync is done to build 'signature' and restore the normal settings.
+        """
+        self.conn.execute('PRAGMA foreign_keys = OFF')
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = OFF')
+        self.conn.execute('PRAGMA cache_size = -1000000') # ~1 GB
+        self.conn.execute('PRAGMA temp_store = MEMORY')
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS signature_staging (
+            output INTEGER,
+            tx_key INTEGER
+        );
+        """)
+        self.conn.commit()
+        self.bulk_load = True
+        print('Bulk-load mode enabled.')
+
+    def end_bulk_load(self, outputs_per_commit=1_000_000):
+        """
+        Moves the staged output-tx pairs into 'signature' in sorted order, builds the output index
+        (only needed by the old rowid schema), counts the references of every output and restores the normal journaling, synchronous and foreign key settings.
+
+        The staged pairs are sorted once by an index on the staging table, whose sort spills to
+        temporary files, and copied outputs_per_commit outputs at a time, one transaction each, so
+        neither memory nor the journal grows with the size of the table. An interrupted copy is
+        resumed by the next end_bulk_load.
+        """
+        print('Building signature table from staged pairs. This might take a while.')
+        # Sorts of a mainnet-sized table do not fit in memory; let them spill to disk again. Without
+        # the WAL, a transaction only journals the pages it overwrites, and the copy mostly appends.
+        self.conn.execute('PRAGMA temp_store = DEFAULT')
+        self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.conn.execute('PRAGMA journal_mode = DELETE')
+        cursor = self.conn.cursor()
+        try:
+            without_rowid = self.is_signature_table_without_rowid()
+
+            # Maintaining the secondary index of the old schema during the copy would mean random
+            # B-tree inserts, so drop it and build it once the table is complete.
+            if not without_rowid:
+                cursor.execute("DROP INDEX IF EXISTS idx_signature_output_desc")
+
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_signature_staging ON signature_staging (output, tx_key)")
+            self.conn.commit()
+
+            # Inserting in primary key order only ever appends to the B-tree.
+            first_output, last_output = cursor.execute("SELECT MIN(output), MAX(output) FROM signature_staging").fetchone()
+            if first_output is not None:
+                for start in range(first_output, last_output + 1, outputs_per_commit):
+                    cursor.execute("""
+                    INSERT OR IGNORE INTO signature (output, tx_key)
+                    SELECT output, tx_key FROM signature_staging
+                    WHERE output >= ? AND output < ?
+                    ORDER BY output, tx_key
+                    """, (start, start + outputs_per_commit))
+                    self.conn.commit()
+                    print(f'Copied the staged pairs of outputs up to {min(start + outputs_per_commit, last_output + 1) - 1} of {last_output}.')
+
+            if not without_rowid:
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_signature_output_desc
+                    ON signature(output DESC)
+                """)
+            cursor.execute("DROP TABLE signature_staging")
+
+            # Reference counts are not kept while bulk loading; count them in one pass over 'signature'.
+            cursor.execute("DELETE FROM output_stats")
+            self._count_all_references(cursor)
+            self.conn.commit()
+        finally:
+            cursor.close()
+
+        self.conn.execute('PRAGMA synchronous = FULL')
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self.bulk_load = False
+        print('Bulk-load complete. Normal mode restored.')
+
+    def add_transactions(self, transactions, blocks=()):
         # transactions = [(b'\x00\x01\x02', 1), (b'\x03\x04\x05', 2)]
+        # blocks = [(height, block_hash, number_of_transactions), ...] for the blocks in transactions, in order.
         
         # Prepare the SQL statement for inserting a new transaction
         sql_insert_transaction = """
@@ -63,7 +313,22 @@ class DatabaseManager:
         cursor = self.conn.cursor()
         try:
             cursor.executemany(sql_insert_transaction, transactions)
-            self.conn.commit()
+            if transactions:
+                # 'key' is the rowid, so MAX() is a single B-tree lookup.
+                cursor.execute("SELECT MAX(key) FROM tx")
+                last_tx_key = cursor.fetchone()[0]
+                self._record_sync_state(cursor, 'tx', transactions[-1][1], last_tx_key)
+
+                # Keys inserted in one transaction are consecutive, so each block's first key follows from the counts.
+                first_tx_key = last_tx_key - sum(n_txs for _, _, n_txs in blocks) + 1
+                block_rows = []
+                for height, block_hash, n_txs in blocks:
+                    block_rows.append((height, block_hash, first_tx_key))
+                    first_tx_key += n_txs
+                cursor.executemany("INSERT OR REPLACE INTO block (height, hash, first_tx_key) VALUES (?, ?, ?)", block_rows)
+            with metrics.histogram('sqlite_commit_seconds', 'Time spent in COMMIT.', operation='add_transactions').time():
+                self.conn.commit()
+            metrics.counter('sqlite_rows_written_total', 'Rows written.', table='tx').inc(len(transactions))
             print(f'SAVED {len(transactions)} TRANSACTIONS to DATABASE.')
         except sqlite3.Error as e:
             print(f"An error occurred: {e}")
@@ -72,16 +337,28 @@ class DatabaseManager:
             cursor.close()
 
 
-    def add_output_tx_pair(self, output_tx_pairs):
+    def add_output_tx_pair(self, output_tx_pairs, tx_outputs=(), last_tx_key=None):
+        # tx_outputs = [(tx_key, [output_index, ...], tx version), ...] is saved in the same commit as the pairs.
+        # last_tx_key is the last transaction covered by this batch; it is recorded as completed in
+        # 'sync_state' in the same commit, even if the batch has no pairs (e.g. only coinbase transactions).
+
         # Prepare the SQL statement for inserting a new output-transaction pair
         sql_insert_output_tx_pair = """
-        INSERT INTO signature (output, tx_key) VALUES (?, ?);
-        """
+        INSERT INTO {table} (output, tx_key) VALUES (?, ?);
+        """.format(table='signature_staging' if self.bulk_load else 'signature')
         cursor = self.conn.cursor()
         try:
             cursor.executemany(sql_insert_output_tx_pair, output_tx_pairs)
-            self.conn.commit()
-            print(f'SAVED {len(output_tx_pairs)} OUTPUT-TX PAIRS to DATABASE.')
+            self._count_references(cursor, output_tx_pairs)
+            self._insert_tx_outputs(cursor, tx_outputs)
+            if last_tx_key is not None:
+                self._record_sync_state(cursor, 'signature', None, last_tx_key)
+                self._record_sync_state(cursor, 'tx_output', None, last_tx_key)
+            with metrics.histogram('sqlite_commit_seconds', 'Time spent in COMMIT.', operation='add_output_tx_pair').time():
+                self.conn.commit()
+            metrics.counter('sqlite_rows_written_total', 'Rows written.', table='signature').inc(len(output_tx_pairs))
+            metrics.counter('sqlite_rows_written_total', 'Rows written.', table='tx_output').inc(len(tx_outputs))
+            print(f'SAVED {len(output_tx_pairs)} OUTPUT-TX PAIRS and {len(tx_outputs)} TX OUTPUT LISTS to DATABASE.')
         except sqlite3.IntegrityError as e:
             print(f"A foreign key constraint failed: {e}")
             self.conn.rollback()
@@ -91,6 +368,198 @@ class DatabaseManager:
         finally:
             cursor.close()
             
+    def add_block(self, height, block_hash, transactions, journal_depth=100):
+        """
+        Saves one block and everything derived from it in a single transaction: its 'tx' rows,
+        ring members, outputs, block hash, ring journal entries and the sync state of every stage.
+
+        Parameters:
+        height (int): Block height.
+        block_hash (bytes): Block hash.
+        transactions (list): (tx hash bytes, ring members, output indices, tx version) tuples, miner transaction first.
+        journal_depth (int): Number of most recent blocks whose ring members are kept in 'ring_journal'.
+        """
+        self.add_blocks([(height, block_hash, transactions)], journal_depth)
+
+    def add_blocks(self, blocks, journal_depth=100):
+        """
+        Same as add_block for several consecutive blocks, saved in a single transaction.
+        Ring members are only journaled for the blocks within journal_depth of the last one.
+
+        Parameters:
+        blocks (list): (height, block hash, transactions) tuples in height order, as taken by add_block.
+        journal_depth (int): Number of most recent blocks whose ring members are kept in 'ring_journal'.
+        """
+        if not blocks:
+            return
+        cursor = self.conn.cursor()
+        try:
+            last_height = blocks[-1][0]
+            last_tx_key = None
+            n_transactions = 0
+            output_tx_pairs = []
+            tx_outputs = []
+            journal = []
+            block_rows = []
+            for height, block_hash, transactions in blocks:
+                first_tx_key = None
+                for tx_hash, ring_members, output_indices, version in transactions:
+                    cursor.execute("INSERT INTO tx (hash, block) VALUES (?, ?)", (tx_hash, height))
+                    last_tx_key = cursor.lastrowid
+                    first_tx_key = first_tx_key if first_tx_key is not None else last_tx_key
+                    ring_members = sorted(ring_members)
+                    output_tx_pairs.extend((member, last_tx_key) for member in ring_members)
+                    tx_outputs.append((last_tx_key, output_indices, version))
+                    if height > last_height - journal_depth:
+                        journal.append((last_tx_key, pack_output_indices(ring_members)))
+                block_rows.append((height, block_hash, first_tx_key))
+                n_transactions += len(transactions)
+
+            self._insert_signature_pairs(cursor, output_tx_pairs)
+            self._count_references(cursor, output_tx_pairs)
+            self._insert_tx_outputs(cursor, tx_outputs)
+            cursor.executemany("INSERT OR REPLACE INTO ring_journal (tx_key, ring_members) VALUES (?, ?)", journal)
+            cursor.executemany("INSERT OR REPLACE INTO block (height, hash, first_tx_key) VALUES (?, ?, ?)", block_rows)
+
+            # Forget the ring members of blocks that are too deep to be reorganised.
+            cursor.execute("SELECT first_tx_key FROM block WHERE height = ?", (last_height - journal_depth,))
+            row = cursor.fetchone()
+            if row is not None and row[0] is not None:
+                cursor.execute("DELETE FROM ring_journal WHERE tx_key < ?", (row[0],))
+
+            self._record_sync_state(cursor, 'tx', last_height, last_tx_key)
+            self._record_sync_state(cursor, 'signature', None, last_tx_key)
+            self._record_sync_state(cursor, 'tx_output', None, last_tx_key)
+            with metrics.histogram('sqlite_commit_seconds', 'Time spent in COMMIT.', operation='add_block').time():
+                self.conn.commit()
+            metrics.counter('sqlite_rows_written_total', 'Rows written.', table='tx').inc(n_transactions)
+            metrics.counter('sqlite_rows_written_total', 'Rows written.', table='signature').inc(len(output_tx_pairs))
+            if len(blocks) == 1:
+                print(f'SAVED BLOCK {last_height} with {n_transactions} TRANSACTIONS and {len(output_tx_pairs)} OUTPUT-TX PAIRS to DATABASE.')
+            else:
+                print(f'SAVED BLOCKS {blocks[0][0]} to {last_height} with {n_transactions} TRANSACTIONS and '
+                      f'{len(output_tx_pairs)} OUTPUT-TX PAIRS to DATABASE.')
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    # Writes to 'signature' made by add_block and rollback_to_block, inside the caller's transaction.
+    # ShardedDatabaseManager sends them to the shard files instead.
+    def _insert_signature_pairs(self, cursor, output_tx_pairs):
+        cursor.executemany("INSERT INTO {table} (output, tx_key) VALUES (?, ?)".format(
+            table='signature_staging' if self.bulk_load else 'signature'), output_tx_pairs)
+
+    def _delete_signature_pairs(self, cursor, output_tx_pairs):
+        cursor.executemany("DELETE FROM signature WHERE output = ? AND tx_key = ?", output_tx_pairs)
+
+    def _delete_signature_from_tx_key(self, cursor, first_tx_key):
+        # Returns the deleted pairs, so their references can be uncounted.
+        cursor.execute("SELECT output, tx_key FROM signature WHERE tx_key >= ?", (first_tx_key,))
+        removed = cursor.fetchall()
+        cursor.execute("DELETE FROM signature WHERE tx_key >= ?", (first_tx_key,))
+        return removed
+
+    def _count_all_references(self, cursor):
+        # Fills an empty 'output_stats' from the stored ring membership.
+        # 'signature' is clustered by output, so this is one sequential pass without a sort.
+        cursor.execute("INSERT INTO output_stats (output, ref_count) SELECT output, COUNT(*) FROM signature GROUP BY output")
+
+    def _count_references(self, cursor, output_tx_pairs, sign=1):
+        # Adds the pairs to 'output_stats', or removes them with sign=-1, in the caller's transaction.
+        # Bulk loading skips this; end_bulk_load counts every output at once.
+        if self.bulk_load:
+            return
+        counts = sorted(Counter(output for output, _ in output_tx_pairs).items())
+        cursor.executemany("""
+        INSERT INTO output_stats (output, ref_count) VALUES (?, ?)
+        ON CONFLICT(output) DO UPDATE SET ref_count = ref_count + excluded.ref_count
+        """, ((output, sign * count) for output, count in counts))
+        if sign < 0:
+            cursor.executemany("DELETE FROM output_stats WHERE output = ? AND ref_count <= 0",
+                               ((output,) for output, _ in counts))
+
+    def _insert_tx_outputs(self, cursor, tx_outputs):
+        # tx_outputs = [(tx_key, [output_index, ...], tx version), ...], saved in 'tx_output' and, reversed,
+        # in 'rct_output_origin' for RingCT transactions.
+        cursor.executemany("INSERT OR REPLACE INTO tx_output (tx_key, outputs) VALUES (?, ?)",
+                           ((tx_key, pack_output_indices(outputs)) for tx_key, outputs, _ in tx_outputs))
+        cursor.executemany("INSERT OR REPLACE INTO rct_output_origin (output, tx_key) VALUES (?, ?)",
+                           ((output, tx_key) for tx_key, outputs, version in tx_outputs if version >= 2
+                            for output in outputs))
+
+    def flush(self):
+        # Writes are committed before the add_* methods return. ShardedDatabaseManager overrides this
+        # to wait for its shard writers.
+        pass
+
+    def set_block(self, height, block_hash, first_tx_key):
+        self.conn.execute("INSERT OR REPLACE INTO block (height, hash, first_tx_key) VALUES (?, ?, ?)",
+                          (height, block_hash, first_tx_key))
+        self.conn.commit()
+
+    def get_block_hash(self, height):
+        row = self.conn.execute("SELECT hash FROM block WHERE height = ?", (height,)).fetchone()
+        return row[0] if row is not None else None
+
+    def rollback_to_block(self, height):
+        """
+        Removes every block above height and all rows derived from them, in a single transaction.
+        Used when the chain is reorganised.
+
+        Parameters:
+        height (int): The last block to keep.
+        """
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("SELECT first_tx_key FROM block WHERE height = ?", (height + 1,))
+            row = cursor.fetchone()
+            if row is not None and row[0] is not None:
+                cutoff_tx_key = row[0]
+            else:
+                cursor.execute("SELECT MIN(key) FROM tx WHERE block > ?", (height,))
+                cutoff_tx_key = cursor.fetchone()[0]
+
+            if cutoff_tx_key is not None:
+                # Delete the ring members through the journal when it covers every removed transaction;
+                # otherwise 'signature' has to be scanned, since it is not indexed by tx_key.
+                cursor.execute("SELECT COUNT(*) FROM ring_journal WHERE tx_key >= ?", (cutoff_tx_key,))
+                n_journaled = cursor.fetchone()[0]
+                cursor.execute("SELECT COUNT(*) FROM tx WHERE key >= ?", (cutoff_tx_key,))
+                if n_journaled == cursor.fetchone()[0]:
+                    cursor.execute("SELECT tx_key, ring_members FROM ring_journal WHERE tx_key >= ?", (cutoff_tx_key,))
+                    pairs = [(member, tx_key) for tx_key, packed in cursor.fetchall()
+                             for member in unpack_output_indices(packed)]
+                    self._delete_signature_pairs(cursor, pairs)
+                else:
+                    print('Ring journal does not cover the rolled back blocks. Scanning signature table.')
+                    pairs = self._delete_signature_from_tx_key(cursor, cutoff_tx_key)
+                self._count_references(cursor, pairs, sign=-1)
+
+                cursor.execute("DELETE FROM ring_journal WHERE tx_key >= ?", (cutoff_tx_key,))
+                cursor.execute("SELECT outputs FROM tx_output WHERE tx_key >= ?", (cutoff_tx_key,))
+                cursor.executemany("DELETE FROM rct_output_origin WHERE output = ? AND tx_key >= ?",
+                                   [(output, cutoff_tx_key) for (packed,) in cursor.fetchall()
+                                    for output in unpack_output_indices(packed)])
+                cursor.execute("DELETE FROM tx_output WHERE tx_key >= ?", (cutoff_tx_key,))
+                cursor.execute("DELETE FROM tx WHERE key >= ?", (cutoff_tx_key,))
+
+            cursor.execute("DELETE FROM block WHERE height > ?", (height,))
+
+            # Progress moves backwards here, so set it directly instead of through _record_sync_state.
+            last_tx_key = cutoff_tx_key - 1 if cutoff_tx_key is not None else None
+            cursor.execute("UPDATE sync_state SET last_block = ? WHERE stage = 'tx'", (height,))
+            if last_tx_key is not None:
+                cursor.execute("UPDATE sync_state SET last_tx_key = MIN(last_tx_key, ?)", (last_tx_key,))
+            self.conn.commit()
+            print(f'ROLLED BACK DATABASE to BLOCK {height}.')
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
     def retrieve_tx_keys_in_range(self, start, end):
         """
         Retrieves rows from the 'tx' table where 'key' is within the specified range.
@@ -162,10 +631,17 @@ class DatabaseManager:
 
     def get_largest_tx_value_from_signature_table(self):
         sql_query = "SELECT MAX(tx_key) FROM signature;"
+        # Pairs are staged in tx key order, so the newest staged row holds the largest key.
+        sql_query_staging = "SELECT tx_key FROM signature_staging ORDER BY rowid DESC LIMIT 1;"
         cursor = self.conn.cursor()
         try:
             cursor.execute(sql_query)
             max_block = cursor.fetchone()[0]  # fetchone() returns a tuple, [0] gets the first element
+            if self.has_signature_staging_table():
+                cursor.execute(sql_query_staging)
+                row = cursor.fetchone()
+                if row is not None and (max_block is None or row[0] > max_block):
+                    max_block = row[0]
             return max_block
         except sqlite3.Error as e:
             print(f"An error occurred: {e}")
@@ -173,6 +649,166 @@ class DatabaseManager:
         finally:
             cursor.close()
             
+    def get_largest_key_from_tx_output_table(self):
+        # tx_key is the rowid of tx_output, so this is a single B-tree lookup.
+        sql_query = "SELECT MAX(tx_key) FROM tx_output;"
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(sql_query)
+            return cursor.fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            return None
+        finally:
+            cursor.close()
+
+    def _select_joined(self, table, values, sql, parameters=()):
+        """
+        Loads values into the temporary table 'query_outputs' or 'query_tx_keys' and returns the rows
+        of sql, which joins it, so a batch of lookups runs as one query instead of one per value.
+        Only the temporary table is written, so the implicit transaction is ended before returning.
+        """
+        column = QUERY_TABLE_COLUMNS[table]
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {table} ({column} INTEGER PRIMARY KEY)")
+            cursor.execute(f"DELETE FROM {table}")
+            cursor.executemany(f"INSERT OR IGNORE INTO {table} ({column}) VALUES (?)", ((value,) for value in values))
+            rows = cursor.execute(sql, parameters).fetchall()
+            self.conn.commit()
+            return rows
+        finally:
+            cursor.close()
+
+    def get_outputs_by_tx_keys(self, tx_keys):
+        """
+        Retrieves the global output indices created by each of the given transactions.
+
+        Parameters:
+        tx_keys (iterable): Keys of the transactions in the 'tx' table.
+
+        Returns:
+        dict: Maps each tx key to its list of output indices. Keys not in 'tx_output' are absent.
+        """
+        rows = self._select_joined('query_tx_keys', tx_keys, """
+        SELECT tx_output.tx_key, tx_output.outputs
+        FROM query_tx_keys
+        INNER JOIN tx_output ON tx_output.tx_key = query_tx_keys.tx_key
+        """)
+        return {tx_key: unpack_output_indices(packed) for tx_key, packed in rows}
+
+    def get_tx_key_range(self, first_block, last_block):
+        """
+        Maps a range of blocks to the range of tx keys of their transactions. Transactions are saved
+        in block order, so a block window and a tx key window select the same transactions.
+
+        Parameters:
+        first_block (int): The first block of the range (inclusive).
+        last_block (int): The last block of the range (inclusive).
+
+        Returns:
+        tuple: (first tx key, last tx key). Either is None if no transaction is on that side of the range.
+        """
+        # Both lookups walk 'idx_tx_block', whose entries are ordered by block, then key.
+        first = self.conn.execute(
+            "SELECT key FROM tx WHERE block >= ? ORDER BY block, key LIMIT 1", (first_block,)).fetchone()
+        last = self.conn.execute(
+            "SELECT key FROM tx WHERE block <= ? ORDER BY block DESC, key DESC LIMIT 1", (last_block,)).fetchone()
+        return (first[0] if first else None, last[0] if last else None)
+
+    def find_origins_by_outputs(self, output_values, min_tx_key=None):
+        """
+        Finds the transactions that created the given RingCT outputs, with a single query.
+
+        Parameters:
+        output_values (iterable): The global output indices to look up, in the amount 0 index space.
+        min_tx_key (int): If given, origins with a smaller tx key are left out.
+
+        Returns:
+        dict: Maps each output to the (tx key, hex hash) of the transaction that created it.
+              Outputs not in 'rct_output_origin', or created before min_tx_key, are absent.
+        """
+        rows = self._select_joined('query_outputs', output_values, """
+        SELECT query_outputs.output, tx.key, tx.hash
+        FROM query_outputs
+        INNER JOIN rct_output_origin ON rct_output_origin.output = query_outputs.output
+        INNER JOIN tx ON rct_output_origin.tx_key = tx.key
+        WHERE rct_output_origin.tx_key >= ?
+        """, (min_tx_key if min_tx_key is not None else 0,))
+        return {output: (tx_key, hash.hex()) for output, tx_key, hash in rows}
+
+    def rebuild_output_stats(self):
+        """
+        Recounts the references of every output into 'output_stats', in one transaction.
+        Only needed for databases synced before the table existed, see create_database.
+        """
+        print('Counting the references of every output already saved. This might take a while.')
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("DELETE FROM output_stats")
+            self._count_all_references(cursor)
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def get_reference_counts(self, output_values):
+        """
+        Retrieves how many rings reference each of the given outputs, with a single query.
+
+        Parameters:
+        output_values (iterable): The global output indices to look up.
+
+        Returns:
+        dict: Maps each output to its reference count. Outputs that no ring references are absent.
+        """
+        return dict(self._select_joined('query_outputs', output_values, """
+        SELECT output_stats.output, output_stats.ref_count
+        FROM query_outputs
+        INNER JOIN output_stats ON output_stats.output = query_outputs.output
+        """))
+
+    def get_transaction_reference_counts(self, tx_keys):
+        """
+        Sums the reference counts of the outputs created by each of the given transactions.
+
+        Returns:
+        dict: Maps each tx key to the number of rings referencing its outputs. Keys not in 'tx_output' are absent.
+        """
+        outputs = self.get_outputs_by_tx_keys(tx_keys)
+        counts = self.get_reference_counts(output for tx_outputs in outputs.values() for output in tx_outputs)
+        return {tx_key: sum(counts.get(output, 0) for output in tx_outputs) for tx_key, tx_outputs in outputs.items()}
+
+    def get_most_referenced_outputs(self, n):
+        """
+        Returns:
+        list: The (output, reference count) tuples of the n most referenced outputs, most referenced first.
+        """
+        return self.conn.execute(
+            "SELECT output, ref_count FROM output_stats ORDER BY ref_count DESC, output LIMIT ?", (n,)).fetchall()
+
+    def get_largest_ring_output(self):
+        # Largest output used as a ring member, or None if no ring is stored.
+        return self.conn.execute("SELECT MAX(output) FROM signature").fetchone()[0]
+
+    def iter_ring_pairs(self, rows_per_chunk=1_000_000):
+        """
+        Yields every stored (output, tx key) pair, in (output, tx key) order, in lists of about
+        rows_per_chunk pairs. The storage layouts override it, so the rings can be exported from any
+        of them, as ring_index.build_ring_index does.
+        """
+        cursor = self.conn.execute("SELECT output, tx_key FROM signature ORDER BY output, tx_key")
+        try:
+            while True:
+                rows = cursor.fetchmany(rows_per_chunk)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
     def get_table_row_count(self, table_name):
         cursor = self.conn.cursor()
         cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
@@ -209,9 +845,122 @@ class DatabaseManager:
         hashes = [row[0].hex() for row in rows]
         
         return hashes
-    
+
+    def find_transactions_by_outputs(self, output_values, max_tx_key=None):
+        """
+        Finds the transactions that use any of the given outputs as a ring member, with a single query.
+
+        Parameters:
+        output_values (iterable): The global output indices to look up.
+        max_tx_key (int): If given, transactions with a larger tx key are left out.
+
+        Returns:
+        dict: Maps each output to a list of (tx key, hex hash) tuples of the transactions referencing it.
+              Outputs that are not referenced by any ring (up to max_tx_key) are absent.
+        """
+        # The primary key (output, tx_key) of 'signature' covers the max_tx_key bound too, so pairs
+        # out of range end the scan of their output before any 'tx' row is read.
+        rows = self._select_joined('query_outputs', output_values, """
+        SELECT query_outputs.output, tx.key, tx.hash
+        FROM query_outputs
+        INNER JOIN signature ON signature.output = query_outputs.output
+        INNER JOIN tx ON signature.tx_key = tx.key
+        WHERE signature.tx_key <= ?
+        ORDER BY query_outputs.output, signature.tx_key
+        """, (max_tx_key if max_tx_key is not None else MAX_TX_KEY,))
+
+        transactions = {}
+        for output, tx_key, hash in rows:
+            transactions.setdefault(output, []).append((tx_key, hash.hex()))
+        return transactions
+
+    def find_hashes_by_outputs(self, output_values):
+        """
+        Same as find_transactions_by_outputs, but maps each output to a list of hex hashes only.
+        """
+        return {output: [hash for _, hash in transactions]
+                for output, transactions in self.find_transactions_by_outputs(output_values).items()}
+
+    def _record_sync_state(self, cursor, stage, last_block, last_tx_key):
+        # Runs inside the caller's transaction. Progress only moves forward here, and a NULL
+        # argument leaves the stored value unchanged.
+        cursor.execute("""
+        INSERT INTO sync_state (stage, last_block, last_tx_key) VALUES (?, ?, ?)
+        ON CONFLICT(stage) DO UPDATE SET
+            last_block = MAX(IFNULL(last_block, excluded.last_block), IFNULL(excluded.last_block, last_block)),
+            last_tx_key = MAX(IFNULL(last_tx_key, excluded.last_tx_key), IFNULL(excluded.last_tx_key, last_tx_key))
+        """, (stage, last_block, last_tx_key))
+
+    def get_sync_state(self, stage):
+        """
+        Returns the (last_block, last_tx_key) tuple recorded for a sync stage, or None if it was never recorded.
+        """
+        return self.conn.execute(
+            "SELECT last_block, last_tx_key FROM sync_state WHERE stage = ?", (stage,)).fetchone()
+
     def get_latest_block_completed(self):
-        pass
+        """
+        Returns the height of the last block whose transactions are saved in the 'tx' table, or None if empty.
+
+        Databases synced before 'sync_state' existed fall back to scanning 'tx' once and record the result.
+        """
+        state = self.get_sync_state('tx')
+        if state is not None:
+            return state[0]
+
+        last_block = self.get_largest_block_value_from_tx_table()
+        if last_block is not None:
+            self._seed_sync_state('tx', last_block, self.get_largest_key_from_tx_table())
+        return last_block
+
+    def get_latest_tx_key_completed(self, stage):
+        """
+        Returns the key of the last transaction completed by the 'signature' or 'tx_output' stage, or None.
+
+        Databases synced before 'sync_state' existed fall back to the MAX() of the table once and record it.
+        """
+        state = self.get_sync_state(stage)
+        if state is not None:
+            return state[1]
+
+        if stage == 'signature':
+            last_tx_key = self.get_largest_tx_value_from_signature_table()
+        else:
+            last_tx_key = self.get_largest_key_from_tx_output_table()
+        if last_tx_key is not None:
+            self._seed_sync_state(stage, None, last_tx_key)
+        return last_tx_key
+
+    def _seed_sync_state(self, stage, last_block, last_tx_key):
+        cursor = self.conn.cursor()
+        try:
+            self._record_sync_state(cursor, stage, last_block, last_tx_key)
+            self.conn.commit()
+        finally:
+            cursor.close()
         
     def close(self):
-        self.conn.close()
\ No newline at end of file
+        self.conn.close()
+
+
+def open_database_manager(db_path, check_same_thread=True, read_only=False, shared_cache=False):
+    """
+    Opens db_path with the manager matching its storage layout: ShardedDatabaseManager if it has a
+    shard layout, PostingListDatabaseManager if ring membership is stored as posting lists, otherwise
+    a DatabaseManager. read_only and shared_cache are passed to connect.
+    """
+    # Imported here, as both modules build on this one.
+    import sharded_database
+    import posting_list_database
+
+    if sharded_database.is_sharded(db_path):
+        return sharded_database.ShardedDatabaseManager(db_path, check_same_thread=check_same_thread,
+                                                       read_only=read_only, shared_cache=shared_cache)
+    conn = connect(db_path, read_only=read_only)
+    try:
+        posting_lists = posting_list_database.uses_posting_lists(conn)
+    finally:
+        conn.close()
+    if posting_lists:
+        return posting_list_database.PostingListDatabaseManager(db_path, check_same_thread, read_only, shared_cache)
+    return DatabaseManager(db_path, check_same_thread, read_only, shared_cache)
\ No newline at end of file
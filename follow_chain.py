@@ -0,0 +1,116 @@
+import time
+import tx_prefix_parser
+import monerod_rpc as rpc
+import update_tx_table as tx
+import update_signature_table as sig
+
+
+# Number of blocks compared per request when looking for the fork point of a reorganisation.
+REORG_CHECK_DEPTH = 100
+
+
+def get_block_header_hashes(start_height, end_height):
+    # Returns {height: hex hash} for the blocks from start_height to end_height (inclusive).
+    result = rpc.get_client().json_rpc('get_block_headers_range', {'start_height': start_height, 'end_height': end_height})
+    return {header['height']: header['hash'] for header in result['headers']}
+
+
+def fetch_block(block_idx):
+    """
+    Fetches a block and its transactions.
+
+    Returns:
+    tuple: (block hash, previous block hash, list of (tx hash bytes, ring members, output indices, tx version)),
+           the miner transaction first.
+    """
+    result = rpc.get_client().get_block(block_idx)
+    header = result['block_header']
+    tx_hashes = [result['miner_tx_hash']] + result.get('tx_hashes', [])
+
+    transactions, _, _ = sig.fetch_transactions(tx_hashes)
+    transactions_by_hash = {transaction['tx_hash']: transaction for transaction in transactions}
+
+    rows = []
+    for tx_hash in tx_hashes:
+        transaction = transactions_by_hash[tx_hash]
+        tx_blob = sig.transaction_blob_hex(transaction)
+        rows.append((bytes.fromhex(tx_hash), tx_prefix_parser.ring_members_from_hex(tx_blob),
+                     transaction.get('output_indices', []), tx_prefix_parser.transaction_version(tx_blob)))
+
+    return header['hash'], header['prev_hash'], rows
+
+
+def backfill_block_hashes(db_manager, last_block):
+    # Databases synced before the 'block' table existed have no hashes to compare against,
+    # so record the most recent ones from the daemon before following the chain.
+    start_height = max(0, last_block - REORG_CHECK_DEPTH + 1)
+    missing = [height for height in range(start_height, last_block + 1) if db_manager.get_block_hash(height) is None]
+    if not missing:
+        return
+
+    print(f'Recording hashes of {len(missing)} recent blocks.')
+    for height in missing:
+        block_hash, tx_hashes = tx.get_block_tx_hashes(height)
+        row = db_manager.find_transaction_by_hash(bytes.fromhex(tx_hashes[0]))
+        db_manager.set_block(height, bytes.fromhex(block_hash), row[0] if row is not None else None)
+
+
+def find_fork_height(db_manager, last_block):
+    """
+    Returns the highest block at or below last_block whose stored hash matches the daemon's chain.
+    Blocks without a stored hash are assumed to match.
+    """
+    height = last_block
+    while height >= 0:
+        low = max(0, height - REORG_CHECK_DEPTH + 1)
+        daemon_hashes = get_block_header_hashes(low, height)
+        for block_idx in range(height, low - 1, -1):
+            stored_hash = db_manager.get_block_hash(block_idx)
+            if stored_hash is None or stored_hash.hex() == daemon_hashes[block_idx]:
+                return block_idx
+        height = low - 1
+    return -1
+
+
+def follow_chain(db_manager, poll_interval=5):
+    """
+    Keeps the database at the tip of the chain until interrupted with Ctrl+C.
+
+    The daemon is polled every poll_interval seconds. Each new block is saved, with its transactions,
+    ring members and outputs, in a single database transaction. If a stored block hash no longer matches
+    the daemon's chain, the database is rolled back to the fork point and the new branch is ingested.
+    The database must already be synced (option 1 of main.py) before following starts.
+    """
+    print('--------------------------------')
+    print('Following the chain. Press Ctrl+C to stop.\n')
+
+    last_block = db_manager.get_latest_block_completed()
+    last_block = last_block if last_block is not None else -1
+    backfill_block_hashes(db_manager, last_block)
+
+    try:
+        while True:
+            fork_height = find_fork_height(db_manager, last_block)
+            if fork_height < last_block:
+                print(f'Chain reorganisation detected. Rolling back {last_block - fork_height} blocks.')
+                db_manager.rollback_to_block(fork_height)
+                last_block = fork_height
+
+            blockchain_height = tx.get_blockchain_height()
+            for block_idx in range(last_block + 1, blockchain_height):
+                block_hash, prev_hash, transactions = fetch_block(block_idx)
+
+                # The chain changed under us; let the next iteration find the fork point.
+                stored_prev_hash = db_manager.get_block_hash(block_idx - 1)
+                if stored_prev_hash is not None and stored_prev_hash.hex() != prev_hash:
+                    break
+
+                db_manager.add_block(block_idx, bytes.fromhex(block_hash), transactions)
+                last_block = block_idx
+            else:
+                time.sleep(poll_interval)
+
+    except KeyboardInterrupt:
+        print('Stopped following the chain.')
+
+    print('--------------------------------\n')
@@ -0,0 +1,289 @@
+import json
+import transaction_graph as tg
+
+
+# NumPy and matplotlib are imported inside the functions that draw, so that query-only workers
+# (query.py, query_service.py) can write JSON and GraphML without loading them.
+
+# Graphs up to this many nodes get per-node labels. Larger ones are drawn as plain points, with
+# the edges rasterized by rasterize_edges, so rendering time does not depend on matplotlib artists.
+MAX_LABELLED_NODES = 300
+MAX_LEGEND_LEVELS = 20
+# Longest side, in pixels, of the rasterized edge image. Rasterization cost grows with the length
+# of the edges in pixels, so the image is computed at this resolution and scaled to the axes.
+MAX_RASTER_SIZE = 1500
+
+
+def layered_layout(graph, levels):
+    """
+    Places every node in a column for its level, ordered within the column by the average
+    position of its predecessors (one barycentre pass), which keeps most edges short.
+
+    Parameters:
+    graph (TransactionGraph): The graph to lay out.
+    levels (list): The level of each node id, as returned by transaction_graph.determine_levels.
+
+    Returns:
+    tuple: (x, y) NumPy arrays with the position of each node id.
+    """
+    import numpy as np
+    levels = np.asarray(levels, dtype=np.int64)
+    sources = np.asarray(graph.edge_sources, dtype=np.int64)
+    targets = np.asarray(graph.edge_targets, dtype=np.int64)
+
+    n_nodes = len(graph)
+    x = levels.astype(np.float64)
+    y = np.zeros(n_nodes, dtype=np.float64)
+    widest_level = max(np.bincount(levels).max(), 2) if n_nodes else 2
+
+    for level in range(int(levels.max()) + 1 if n_nodes else 0):
+        nodes = np.flatnonzero(levels == level)
+
+        # Average position of the predecessors already placed on earlier levels.
+        placed = levels[sources] < level
+        weights = np.bincount(targets[placed], weights=y[sources[placed]], minlength=n_nodes)
+        counts = np.bincount(targets[placed], minlength=n_nodes)
+        barycentre = np.divide(weights, counts, out=np.zeros(n_nodes), where=counts > 0)
+
+        order = nodes[np.argsort(barycentre[nodes], kind='stable')]
+        y[order] = (np.arange(len(order)) - (len(order) - 1) / 2) / (widest_level - 1)
+
+    return x, y
+
+
+def rasterize_edges(x, y, sources, targets, edge_rgb, extent, width_px, height_px, alpha=0.3, samples_per_batch=16_000_000):
+    """
+    Draws straight edges into an RGBA image with NumPy, one sample per pixel along each edge.
+    Overlapping edges accumulate opacity like alpha blending, so dense areas stay visible.
+    Cost grows with the number of pixels covered instead of the number of matplotlib artists.
+
+    Returns:
+    ndarray: float array of shape (height_px, width_px, 4), row 0 at the bottom.
+    """
+    import numpy as np
+    xmin, xmax, ymin, ymax = extent
+    n_pixels = width_px * height_px
+    hits = np.zeros(n_pixels)
+    rgb_sums = np.zeros((n_pixels, 3))
+
+    x0 = (x[sources] - xmin) * ((width_px - 1) / max(xmax - xmin, 1e-12))
+    y0 = (y[sources] - ymin) * ((height_px - 1) / max(ymax - ymin, 1e-12))
+    x1 = (x[targets] - xmin) * ((width_px - 1) / max(xmax - xmin, 1e-12))
+    y1 = (y[targets] - ymin) * ((height_px - 1) / max(ymax - ymin, 1e-12))
+
+    # Sample every edge once per pixel of its longest axis, and process the edges in batches
+    # of roughly samples_per_batch samples to bound memory.
+    n_samples = np.ceil(np.maximum(np.abs(x1 - x0), np.abs(y1 - y0))).astype(np.int64) + 1
+    batch_ends = np.searchsorted(np.cumsum(n_samples), np.arange(samples_per_batch, n_samples.sum(), samples_per_batch))
+    batch_bounds = [0] + sorted(set(batch_ends.tolist()) - {0}) + [len(n_samples)]
+
+    for start, end in zip(batch_bounds[:-1], batch_bounds[1:]):
+        counts = n_samples[start:end]
+        edge_of_sample = np.repeat(np.arange(start, end), counts)
+        first_sample = np.repeat(np.cumsum(counts) - counts, counts)
+        t = (np.arange(len(edge_of_sample)) - first_sample) / np.maximum(n_samples[edge_of_sample] - 1, 1)
+
+        px = np.rint(x0[edge_of_sample] + t * (x1 - x0)[edge_of_sample]).astype(np.int64)
+        py = np.rint(y0[edge_of_sample] + t * (y1 - y0)[edge_of_sample]).astype(np.int64)
+        pixel = py * width_px + px
+
+        hits += np.bincount(pixel, minlength=n_pixels)
+        for channel in range(3):
+            rgb_sums[:, channel] += np.bincount(pixel, weights=edge_rgb[edge_of_sample, channel], minlength=n_pixels)
+
+    image = np.zeros((n_pixels, 4))
+    covered = hits > 0
+    image[covered, :3] = rgb_sums[covered] / hits[covered, None]
+    image[:, 3] = 1 - (1 - alpha) ** hits
+    return image.reshape(height_px, width_px, 4)
+
+
+def draw_graph(graph, tx_hash, figure, vector=False):
+    """
+    Draws a TransactionGraph on a matplotlib figure: one scatter call for the nodes and one
+    line collection per level for the edges.
+
+    Graphs too large to label have their edges rasterized with NumPy into a single image, unless
+    vector is set (for SVG output), in which case the line collections are kept.
+    """
+    import numpy as np
+    import matplotlib
+    from matplotlib.collections import LineCollection
+    from matplotlib.patches import Patch
+
+    levels = tg.determine_levels(graph)
+    max_level = max(levels) if levels else 0
+    x, y = layered_layout(graph, levels)
+    levels = np.asarray(levels, dtype=np.int64)
+
+    # Define a list of distinct colors for each level.
+    colors = matplotlib.colormaps['viridis_r'].resampled(max_level + 1)
+
+    ax = figure.add_subplot(1, 1, 1)
+    ax.axis('off')
+    n_nodes = len(graph)
+    labelled = n_nodes <= MAX_LABELLED_NODES
+
+    margin_x = 0.05 * max(x.max() - x.min(), 1) if n_nodes else 1
+    margin_y = 0.05 * max(y.max() - y.min(), 1) if n_nodes else 1
+    extent = (x.min() - margin_x, x.max() + margin_x, y.min() - margin_y, y.max() + margin_y) if n_nodes else (-1, 1, -1, 1)
+    ax.set_xlim(extent[0], extent[1])
+    ax.set_ylim(extent[2], extent[3])
+
+    sources = np.asarray(graph.edge_sources, dtype=np.int64)
+    targets = np.asarray(graph.edge_targets, dtype=np.int64)
+
+    if labelled or vector:
+        for level in range(max_level + 1):
+            mask = levels[sources] == level
+            if not mask.any():
+                continue
+            segments = np.stack([np.column_stack([x[sources[mask]], y[sources[mask]]]),
+                                 np.column_stack([x[targets[mask]], y[targets[mask]]])], axis=1)
+            ax.add_collection(LineCollection(segments, colors=[colors(level)], linewidths=1.5 if labelled else 0.3,
+                                             alpha=0.6 if labelled else 0.3, zorder=1))
+    elif len(sources):
+        bbox = ax.get_window_extent()
+        scale = min(1.0, MAX_RASTER_SIZE / max(bbox.width, bbox.height, 1))
+        edge_rgb = colors(levels[sources])[:, :3]
+        image = rasterize_edges(x, y, sources, targets, edge_rgb, extent,
+                                max(int(bbox.width * scale), 1), max(int(bbox.height * scale), 1))
+        ax.imshow(image, extent=extent, origin='lower', interpolation='bilinear', aspect='auto', zorder=1)
+
+    # Draw nodes with level-based colors and adjust opacity.
+    node_size = 2000 if labelled else max(1.0, 20000 / max(n_nodes, 1))
+    ax.scatter(x, y, s=node_size, c=colors(levels), alpha=0.5, linewidths=0, zorder=2)
+
+    # Draw labels
+    if labelled:
+        for node_id, tx_id in enumerate(graph.tx_ids):
+            ax.text(x[node_id], y[node_id], f'{tx_id[:3]}...', fontsize=9, ha='center', va='center',
+                    fontweight='bold', color='white', zorder=3)
+
+    # Create a legend for the levels
+    if max_level < MAX_LEGEND_LEVELS:
+        legend_patches = [Patch(color=colors(i), label=f'Level {i}') for i in range(max_level + 1)]
+        ax.legend(handles=legend_patches, title="Node Levels", loc='best')
+
+    ax.set_title(f'Monero Transaction Graph\nTX: {tx_hash}\n{n_nodes} transactions, {len(sources)} edges',
+                 fontweight='bold')
+
+
+def _figure_size(graph):
+    # Grow the canvas with the graph, within limits that keep the image file manageable.
+    import numpy as np
+    levels = tg.determine_levels(graph)
+    n_levels = (max(levels) + 1) if levels else 1
+    widest_level = max(np.bincount(levels).max(), 1) if levels else 1
+    return min(max(15, 3 * n_levels), 60), min(max(10, widest_level / 20), 60)
+
+
+def export_graph(graph, tx_hash, output_path):
+    """
+    Writes a TransactionGraph to output_path without a display. The format follows the extension:
+    .png or .svg (rendered image), .graphml, or .json (nodes with hash and level, and an edge list).
+    """
+    extension = output_path.rsplit('.', 1)[-1].lower()
+
+    if extension in ('png', 'svg'):
+        render_image(graph, tx_hash, output_path, extension)
+
+    elif extension == 'graphml':
+        write_graphml(graph, output_path)
+
+    elif extension == 'json':
+        with open(output_path, 'w') as f:
+            json.dump(graph_to_json(graph, tx_hash), f)
+
+    else:
+        raise ValueError(f'Unsupported graph output format: .{extension}')
+
+    print(f'Graph with {len(graph)} transactions saved to {output_path}.')
+
+
+def render_image(graph, tx_hash, output, image_format):
+    """
+    Renders a TransactionGraph as a 'png' or 'svg' image to output, a path or a binary file object.
+    Uses its own figure and no display, so it can run in worker threads.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure = Figure(figsize=_figure_size(graph))
+    FigureCanvasAgg(figure)
+    draw_graph(graph, tx_hash, figure, vector=(image_format == 'svg'))
+    figure.savefig(output, format=image_format, dpi=100)
+
+
+def show_graph(graph, tx_hash):
+    import matplotlib.pyplot as plt
+
+    figure = plt.figure(figsize=(15, 10))
+    draw_graph(graph, tx_hash, figure)
+    plt.show()
+
+
+def graph_to_json(graph, tx_hash):
+    levels = tg.determine_levels(graph)
+    return {
+        'root': tx_hash,
+        'nodes': [{'id': node_id, 'tx_id': tx_id, 'level': levels[node_id]} for node_id, tx_id in enumerate(graph.tx_ids)],
+        'edges': [[source, target] for source, target in graph.edges()],
+    }
+
+
+def graph_from_json(document):
+    """
+    Rebuilds a TransactionGraph from the document written by graph_to_json or iter_graph_json.
+
+    Returns:
+    tuple: (graph, root transaction hash).
+    """
+    graph = tg.TransactionGraph()
+    for node in sorted(document['nodes'], key=lambda node: node['id']):
+        graph.add_node(node['tx_id'], node['level'])
+    for source, target in document['edges']:
+        graph.add_edge(source, target)
+    return graph, document['root']
+
+
+def iter_graph_json(graph, tx_hash, levels=None, items_per_chunk=10_000):
+    """
+    Yields the JSON text of graph_to_json in chunks of at most items_per_chunk nodes or edges,
+    so large graphs can be streamed without building the whole document.
+    """
+    if levels is None:
+        levels = tg.determine_levels(graph)
+    yield f'{{"root": {json.dumps(tx_hash)}, "nodes": ['
+    for start in range(0, len(graph), items_per_chunk):
+        yield ('' if start == 0 else ', ') + ', '.join(
+            f'{{"id": {node_id}, "tx_id": "{graph.tx_ids[node_id]}", "level": {levels[node_id]}}}'
+            for node_id in range(start, min(start + items_per_chunk, len(graph))))
+    yield '], "edges": ['
+    n_edges = len(graph.edge_sources)
+    for start in range(0, n_edges, items_per_chunk):
+        end = min(start + items_per_chunk, n_edges)
+        yield ('' if start == 0 else ', ') + ', '.join(
+            f'[{source}, {target}]' for source, target in zip(graph.edge_sources[start:end], graph.edge_targets[start:end]))
+    yield ']}'
+
+
+def graphml_lines(graph, levels=None):
+    # Lines of the GraphML document of a TransactionGraph, written by write_graphml or streamed.
+    if levels is None:
+        levels = tg.determine_levels(graph)
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+    yield '  <key id="level" for="node" attr.name="level" attr.type="int"/>\n'
+    yield '  <graph id="G" edgedefault="directed">\n'
+    for node_id, tx_id in enumerate(graph.tx_ids):
+        yield f'    <node id="{tx_id}"><data key="level">{levels[node_id]}</data></node>\n'
+    for source, target in graph.edges():
+        yield f'    <edge source="{graph.tx_ids[source]}" target="{graph.tx_ids[target]}"/>\n'
+    yield '  </graph>\n'
+    yield '</graphml>\n'
+
+
+def write_graphml(graph, output_path):
+    with open(output_path, 'w') as f:
+        f.writelines(graphml_lines(graph))
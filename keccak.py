@@ -0,0 +1,122 @@
+"""
+Keccak-256 as used by Monero (cn_fast_hash): the original Keccak padding, not the SHA3-256 one, so
+hashlib.sha3_256 gives different results.
+
+pycryptodome is used when it is installed. Otherwise a pure Python implementation is used, which is
+fast enough for the few hashes per block the raw importer computes, but much slower.
+"""
+try:
+    from Crypto.Hash import keccak as _pycryptodome_keccak
+except ImportError:
+    _pycryptodome_keccak = None
+
+HASH_SIZE = 32
+RATE = 136  # bytes absorbed per permutation for a 256 bit output
+
+_MASK = (1 << 64) - 1
+
+_ROUND_CONSTANTS = (
+    0x0000000000000001, 0x0000000000008082, 0x800000000000808A, 0x8000000080008000,
+    0x000000000000808B, 0x0000000080000001, 0x8000000080008081, 0x8000000000008009,
+    0x000000000000008A, 0x0000000000000088, 0x0000000080008009, 0x000000008000000A,
+    0x000000008000808B, 0x800000000000008B, 0x8000000000008089, 0x8000000000008003,
+    0x8000000000008002, 0x8000000000000080, 0x000000000000800A, 0x800000008000000A,
+    0x8000000080008081, 0x8000000000008080, 0x0000000080000001, 0x8000000080008008,
+)
+
+# Rotation offset of lane x + 5 * y.
+_ROTATIONS = (
+    0, 1, 62, 28, 27,
+    36, 44, 6, 55, 20,
+    3, 10, 43, 25, 39,
+    41, 45, 15, 21, 8,
+    18, 2, 61, 56, 14,
+)
+
+
+# Rho and pi combined: lane (x, y) is rotated and moves to (y, 2x + 3y).
+_RHO_PI = tuple((x + 5 * y, y + 5 * ((2 * x + 3 * y) % 5), _ROTATIONS[x + 5 * y])
+                for x in range(5) for y in range(5))
+
+
+def _permute(state):
+    # Keccak-f[1600] on 25 64-bit lanes, state[x + 5 * y].
+    mask = _MASK
+    b = [0] * 25
+    for round_constant in _ROUND_CONSTANTS:
+        # Theta
+        c = [state[x] ^ state[x + 5] ^ state[x + 10] ^ state[x + 15] ^ state[x + 20] for x in range(5)]
+        for x in range(5):
+            d = c[(x - 1) % 5] ^ (((c[(x + 1) % 5] << 1) | (c[(x + 1) % 5] >> 63)) & mask)
+            for i in range(x, 25, 5):
+                state[i] ^= d
+
+        # Rho and pi
+        for source, target, shift in _RHO_PI:
+            lane = state[source]
+            b[target] = ((lane << shift) | (lane >> (64 - shift))) & mask if shift else lane
+
+        # Chi
+        for y in range(0, 25, 5):
+            b0, b1, b2, b3, b4 = b[y:y + 5]
+            state[y] = b0 ^ (~b1 & b2)
+            state[y + 1] = b1 ^ (~b2 & b3)
+            state[y + 2] = b2 ^ (~b3 & b4)
+            state[y + 3] = b3 ^ (~b4 & b0)
+            state[y + 4] = b4 ^ (~b0 & b1)
+
+        # Iota
+        state[0] ^= round_constant
+
+
+def _keccak_256_python(data):
+    padded = bytearray(data)
+    padded.append(0x01)
+    padded.extend(b'\x00' * (-len(padded) % RATE))
+    padded[-1] |= 0x80
+
+    state = [0] * 25
+    for block_start in range(0, len(padded), RATE):
+        block = padded[block_start:block_start + RATE]
+        for i in range(RATE // 8):
+            state[i] ^= int.from_bytes(block[8 * i:8 * i + 8], 'little')
+        _permute(state)
+
+    return b''.join(lane.to_bytes(8, 'little') for lane in state[:HASH_SIZE // 8])
+
+
+def keccak_256(data):
+    """
+    Returns the 32 byte Keccak-256 digest of data.
+    """
+    if _pycryptodome_keccak is not None:
+        return _pycryptodome_keccak.new(data=bytes(data), digest_bits=256).digest()
+    return _keccak_256_python(data)
+
+
+def tree_hash(hashes):
+    """
+    Merkle root of a list of 32 byte hashes, computed like Monero's tree_hash: the list is first
+    reduced to a power of two by hashing its last pairs together.
+    """
+    count = len(hashes)
+    if count == 0:
+        raise ValueError('Cannot compute the tree hash of an empty list.')
+    if count == 1:
+        return hashes[0]
+    if count == 2:
+        return keccak_256(hashes[0] + hashes[1])
+
+    width = 1
+    while width * 2 < count:
+        width *= 2
+
+    # The first 2 * width - count hashes go up unchanged, the rest are hashed in pairs.
+    kept = 2 * width - count
+    level = list(hashes[:kept])
+    for i in range(kept, count, 2):
+        level.append(keccak_256(hashes[i] + hashes[i + 1]))
+
+    while len(level) > 2:
+        level = [keccak_256(level[i] + level[i + 1]) for i in range(0, len(level), 2)]
+    return keccak_256(level[0] + level[1])
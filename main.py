@@ -1,9 +1,10 @@
 import database_manager as db
-import update_tx_table as tx
-import update_signature_table as sig
+import sync
 import transaction_graph as tg
-import requests
-import json
+import follow_chain as fc
+import monerod_rpc as rpc
+import tx_cache
+import metrics
 import sys
 
 
@@ -11,36 +12,15 @@ import sys
 # - sanity check of user input of tx hash
 # - create readme
 # - create requirements page
-# - store the latest block and transaction index to a new metadata table
 # - create a table to store metadata from blocks (e.g. timestamp)
 
-def is_monerod_running():
-    print('Checking if monerod is running.')
-
-    url='http://localhost:18081/json_rpc'
-    data = {
-        "jsonrpc": "2.0",
-        "id": "0",
-        "method": "get_info"
-    }
-    headers = {'content-type': 'application/json'}
-
-    try:
-        response = requests.post(url, data=json.dumps(data), headers=headers)
-        # If the request was successful and we get a valid response, assume monerod is running
-        if response.status_code == 200 and "result" in response.json():
-            return True
-        else:
-            return False
-    except:
-        return False
-
 def monerod_check_loop():
-    monerodRunning = is_monerod_running()
+    # The menu asks the user to start monerod instead of retrying.
+    monerodRunning = sync.is_monerod_running()
 
     while not monerodRunning:
-        response = input("\nmonerod is not running. This program cannot run without monerod.\nPress Enter once you have started monerod.\n")
-        monerodRunning = is_monerod_running()
+        response = input("\nmonerod is not running. This option cannot run without monerod.\nPress Enter once you have started monerod.\n")
+        monerodRunning = sync.is_monerod_running()
     
     print("monerod is running.")
 
@@ -49,7 +29,8 @@ def user_options():
         print('\nEnter an option and press enter:')
         print('[1] Create or update transactions database.')
         print('[2] Create transaction graph form transaction hash.')
-        print('[3] Exit program.')
+        print('[3] Follow the chain and keep the database up to date.')
+        print('[4] Exit program.')
         response = input('Choose option: ').strip()
 
         try:
@@ -57,7 +38,7 @@ def user_options():
         except:
             response = 0
 
-        if (response == 1) or (response == 2) or (response == 3):
+        if response in (1, 2, 3, 4):
             break
         else:
             print('Incorrect choice provided. Choose again.')
@@ -70,7 +51,7 @@ def graph_limit_user_logic(ask_user=False):
     if not ask_user:
         return limit
     
-    limit = input('Choose the maximum number of nodes to show (max=1000): ')
+    limit = input('Choose the maximum number of nodes to show (max=100000): ')
     limit = limit.strip()
 
     try:
@@ -81,44 +62,101 @@ def graph_limit_user_logic(ask_user=False):
     if limit < 1:
         limit = 1
     
-    if limit > 1000:
-        limit = 1000
+    if limit > 100000:
+        limit = 100000
     
     return limit
 
+def graph_direction_user_logic():
+    # Spenders of the transaction's outputs (descendants), sources of its inputs (ancestors), or both.
+    direction = input('Trace descendants, ancestors or both (leave empty for descendants): ').strip().lower()
+
+    if direction not in tg.DIRECTIONS:
+        direction = tg.DESCENDANTS
+
+    return direction
+
+def graph_window_user_logic():
+    # Optional bounds on the traversal; empty or invalid answers leave it unbounded.
+    bounds = []
+    for question in ('Maximum block distance from the root (leave empty for no limit): ',
+                     'Maximum depth (leave empty for no limit): ',
+                     'Skip outputs used by more rings than (leave empty for no limit): '):
+        try:
+            bounds.append(max(0, int(input(question).strip())))
+        except ValueError:
+            bounds.append(None)
+
+    return tuple(bounds)
+
 if __name__ == "__main__":
     UPDATE_DATABASE = 1
     CREATE_TRANSACTION_GRAPH = 2
-    EXIT_PROGRAM = 3
+    FOLLOW_CHAIN = 3
+    EXIT_PROGRAM = 4
     DB_PATH = 'database/output_to_ring_signature.db'
+    TX_CACHE_PATH = 'database/tx_cache.db'
 
-    monerod_check_loop()
+    metrics.configure_from_environment()
 
     while True:
         user_choice = user_options()
 
         if user_choice == UPDATE_DATABASE:
             print('')
+            monerod_check_loop()
             db.create_database(DB_PATH)
-            db_manager = db.DatabaseManager(DB_PATH)
-            tx.update_tx_table(db_manager)
-            sig.update_output_tx_pairs_table(db_manager)
+            db_manager = db.open_database_manager(DB_PATH)
+            sync.update_database(db_manager)
 
             db_manager.close()
         
         elif user_choice == CREATE_TRANSACTION_GRAPH:
             print('')
-            db_manager = db.DatabaseManager(DB_PATH)
+            db_manager = db.open_database_manager(DB_PATH)
             hash = input('Enter transcation hash: ')
             hash = hash.strip()
             limit = graph_limit_user_logic()
+            direction = graph_direction_user_logic()
+            max_block_distance, max_depth, max_ref_count = graph_window_user_logic()
             # root_hash = 'dea9c3c11cab362db2356e891cb3c8aff07ece7d71aff8a5a12d3e48929c8227'
-            root = tg.create_transaction_graph_from_tx_id(hash, db_manager, limit)
-            hash_adjacency_list = tg.transaction_graph_to_hash_graph(root)
-            tg.visualise_dag(hash_adjacency_list, hash)
+            # Leave empty to open a window, or give a .png, .svg, .graphml or .json file to save to.
+            output_path = input('Save graph to file (leave empty to display): ').strip() or None
+            # Transactions fetched from monerod are kept in database/tx_cache.db for the next graphs.
+            cache = tx_cache.TransactionCache(TX_CACHE_PATH)
+            # monerod is only needed for transactions that are not in the database.
+            graph = None
+            try:
+                with metrics.profile('graph'):
+                    graph = tg.create_transaction_graph_from_tx_id(hash, db_manager, limit, cache.get_transactions, direction,
+                                                                   max_block_distance, max_depth, max_ref_count)
+            except rpc.RPCError as e:
+                print(f'Could not get transactions from monerod: {e}')
+            except tg.TransactionNotFoundError:
+                print('Transaction not found.')
+            except ValueError as e:
+                # A malformed hash, or a block distance for a transaction whose block is unknown.
+                print(f'Could not create the graph: {e}')
+            finally:
+                cache.print_stats()
+                cache.close()
+                db_manager.close()
+
+            if graph is not None:
+                tg.visualise_dag(graph, hash, output_path)
+        
+        elif user_choice == FOLLOW_CHAIN:
+            print('')
+            monerod_check_loop()
+            db.create_database(DB_PATH)
+            db_manager = db.open_database_manager(DB_PATH)
+            # Catch up with the chain first, then keep up with new blocks.
+            sync.update_database(db_manager)
+            fc.follow_chain(db_manager)
 
             db_manager.close()
-        
+
         elif user_choice == EXIT_PROGRAM:
             print('Exitting program. Good bye.\n')
+            metrics.stop_reporting()
             sys.exit()
\ No newline at end of file
@@ -0,0 +1,334 @@
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+# In-process metrics for the sync and graph stages, with pluggable sinks.
+#
+# Every module records into the shared registry, for example
+#   metrics.counter('sync_blocks_total', 'Blocks fetched.').inc()
+#   with metrics.histogram('sqlite_commit_seconds', 'Commit time.', operation='add_transactions').time():
+#       conn.commit()
+# Calling a function again with the same name and labels returns the same series.
+#
+# Nothing is exported unless a sink is configured, through configure_from_environment():
+#   METRICS_PROMETHEUS_FILE   path of a Prometheus text file, rewritten every METRICS_INTERVAL seconds
+#   METRICS_JSON_LOG          path of a log with one JSON snapshot per line
+#   METRICS_HTTP_PORT         serve /metrics (Prometheus text) and /metrics.json on 127.0.0.1
+#   METRICS_INTERVAL          seconds between writes to the file sinks (default 10)
+#   METRICS_PROFILE_DIR       write a cProfile dump of every graph query to this directory
+
+# Upper bounds, in seconds, of the histogram buckets. Values above the last one land in +Inf.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, lock):
+        self.lock = lock
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def snapshot(self):
+        return {'value': self.value}
+
+
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, lock):
+        self.lock = lock
+        self.value = 0
+
+    def set(self, value):
+        with self.lock:
+            self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def snapshot(self):
+        return {'value': self.value}
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, lock, buckets=DEFAULT_BUCKETS):
+        self.lock = lock
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        with self.lock:
+            self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    @contextlib.contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def quantile(self, q):
+        # Estimated from the buckets: the upper bound of the bucket holding the q-th observation.
+        with self.lock:
+            target = q * self.count
+            running = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), self.bucket_counts):
+                running += bucket_count
+                if running >= target and bucket_count:
+                    return bound
+        return 0.0
+
+    def snapshot(self):
+        return {'count': self.count, 'sum': self.sum,
+                'buckets': dict(zip([str(bound) for bound in self.buckets] + ['+Inf'], self.bucket_counts))}
+
+
+class Registry:
+    """
+    Holds every metric series, keyed by name and labels.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.families = {} # name -> (kind, help, {sorted label tuple: series})
+
+    def _series(self, metric_class, name, help, labels, **kwargs):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            family = self.families.get(name)
+            if family is None:
+                family = self.families[name] = (metric_class.kind, help, {})
+            elif family[0] != metric_class.kind:
+                raise ValueError(f'Metric {name} is a {family[0]}, not a {metric_class.kind}.')
+            series = family[2].get(key)
+            if series is None:
+                series = family[2][key] = metric_class(threading.Lock(), **kwargs)
+            return series
+
+    def counter(self, name, help='', **labels):
+        return self._series(Counter, name, help, labels)
+
+    def gauge(self, name, help='', **labels):
+        return self._series(Gauge, name, help, labels)
+
+    def histogram(self, name, help='', buckets=DEFAULT_BUCKETS, **labels):
+        return self._series(Histogram, name, help, labels, buckets=buckets)
+
+    def _families(self):
+        with self.lock:
+            return [(name, kind, help, list(series.items())) for name, (kind, help, series) in sorted(self.families.items())]
+
+    def snapshot(self):
+        """
+        Returns:
+        dict: {metric name: [{'labels': {...}, and 'value', or 'count', 'sum' and 'buckets'}]}
+        """
+        return {name: [dict(labels=dict(key), **series.snapshot()) for key, series in all_series]
+                for name, _, _, all_series in self._families()}
+
+    def to_prometheus(self):
+        # Prometheus text exposition format, version 0.0.4.
+        def label_text(pairs):
+            return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}' if pairs else ''
+
+        lines = []
+        for name, kind, help, all_series in self._families():
+            if help:
+                lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, series in all_series:
+                if kind == 'histogram':
+                    running = 0
+                    for bound, bucket_count in zip([str(bound) for bound in series.buckets] + ['+Inf'], series.bucket_counts):
+                        running += bucket_count
+                        lines.append(f'{name}_bucket{label_text(key + (("le", bound),))} {running}')
+                    lines.append(f'{name}_sum{label_text(key)} {series.sum}')
+                    lines.append(f'{name}_count{label_text(key)} {series.count}')
+                else:
+                    lines.append(f'{name}{label_text(key)} {series.value}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help='', **labels):
+    return REGISTRY.counter(name, help, **labels)
+
+
+def gauge(name, help='', **labels):
+    return REGISTRY.gauge(name, help, **labels)
+
+
+def histogram(name, help='', buckets=DEFAULT_BUCKETS, **labels):
+    return REGISTRY.histogram(name, help, buckets, **labels)
+
+
+class PrometheusFileSink:
+    # Rewrites a text file for the node_exporter textfile collector. The file is replaced
+    # atomically, so a scrape never sees half of it.
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, registry):
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            f.write(registry.to_prometheus())
+        os.replace(temporary_path, self.path)
+
+
+class JSONLogSink:
+    # Appends one line per write: {"time": unix time, "metrics": snapshot}.
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, registry):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'time': time.time(), 'metrics': registry.snapshot()}) + '\n')
+
+
+class HTTPSink:
+    # Serves the current values on request, so write() has nothing to do.
+    def __init__(self, port, host='127.0.0.1', registry=REGISTRY):
+        # Imported here so processes without an HTTP sink do not load http.server.
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = registry.to_prometheus(), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = json.dumps(registry.snapshot()), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                body = body.encode()
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        print(f'Metrics served on http://{host}:{self.server.server_port}/metrics')
+
+    def write(self, registry):
+        pass
+
+    def close(self):
+        self.server.shutdown()
+
+
+class Reporter:
+    """
+    Writes the registry to every sink each interval seconds from a background thread,
+    and once more when stopped.
+    """
+
+    def __init__(self, sinks, interval=10.0, registry=REGISTRY):
+        self.sinks = sinks
+        self.interval = interval
+        self.registry = registry
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        for sink in self.sinks:
+            try:
+                sink.write(self.registry)
+            except OSError as e:
+                print(f'Could not write metrics: {e}')
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.flush()
+        for sink in self.sinks:
+            if hasattr(sink, 'close'):
+                sink.close()
+
+
+_reporter = None
+_profile_dir = None
+
+
+def configure_from_environment():
+    """
+    Starts the sinks and the profiling hook selected by the METRICS_* environment variables.
+    Does nothing if none is set.
+    """
+    global _reporter
+    sinks = []
+    if os.environ.get('METRICS_PROMETHEUS_FILE'):
+        sinks.append(PrometheusFileSink(os.environ['METRICS_PROMETHEUS_FILE']))
+    if os.environ.get('METRICS_JSON_LOG'):
+        sinks.append(JSONLogSink(os.environ['METRICS_JSON_LOG']))
+    if os.environ.get('METRICS_HTTP_PORT'):
+        sinks.append(HTTPSink(int(os.environ['METRICS_HTTP_PORT'])))
+    if sinks and _reporter is None:
+        _reporter = Reporter(sinks, float(os.environ.get('METRICS_INTERVAL', 10)))
+
+    if os.environ.get('METRICS_PROFILE_DIR'):
+        enable_profiling(os.environ['METRICS_PROFILE_DIR'])
+
+
+def stop_reporting():
+    global _reporter
+    if _reporter is not None:
+        _reporter.stop()
+        _reporter = None
+
+
+def enable_profiling(profile_dir):
+    global _profile_dir
+    os.makedirs(profile_dir, exist_ok=True)
+    _profile_dir = profile_dir
+
+
+@contextlib.contextmanager
+def profile(name):
+    """
+    Profiles the enclosed block with cProfile if profiling is enabled, and writes the statistics to
+    '<profile dir>/<name>-<timestamp>.prof' (open with pstats or snakeviz). Only the calling thread
+    is profiled. Without enable_profiling (or METRICS_PROFILE_DIR) this does nothing.
+    """
+    if _profile_dir is None:
+        yield
+        return
+
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        path = os.path.join(_profile_dir, f'{name}-{time.strftime("%Y%m%d-%H%M%S")}-{threading.get_ident()}.prof')
+        profiler.dump_stats(path)
+        print(f'Profile written to {path}.')
@@ -0,0 +1,93 @@
+import sys
+import time
+import database_manager as db
+
+
+def migrate_signature_table(db_path, rows_per_commit=1_000_000, vacuum=False):
+    """
+    Converts the 'signature' table of an existing database to the compact WITHOUT ROWID schema.
+
+    Rows are copied in primary key order, rows_per_commit at a time, into 'signature_compact', which
+    then replaces 'signature' together with the redundant 'idx_signature_output_desc' index.
+    The copy can be interrupted and resumed. Graph queries keep working on the old table until the
+    final swap, but the database must not be updated while the migration runs.
+
+    Parameters:
+    db_path (str): Path to the SQLite database.
+    rows_per_commit (int): Number of rows copied per transaction.
+    vacuum (bool): Run VACUUM afterwards to return the freed pages to the file system.
+                   This needs as much free disk space as the database itself.
+    """
+    print('--------------------------------')
+    print('Migrating signature table to the WITHOUT ROWID schema.')
+    print('This might take a while.\n')
+
+    db_manager = db.DatabaseManager(db_path)
+    conn = db_manager.conn
+
+    if db_manager.is_signature_table_without_rowid():
+        print('Signature table already uses the WITHOUT ROWID schema. Nothing to do.')
+        db_manager.close()
+        return
+
+    if db_manager.has_signature_staging_table():
+        print('An interrupted bulk load is pending. Finish the database update before migrating.')
+        db_manager.close()
+        return
+
+    conn.execute(db.SIGNATURE_TABLE_SQL.format(table='signature_compact'))
+    conn.commit()
+
+    # Resume after the last row copied by a previous run.
+    last_row = conn.execute(
+        "SELECT output, tx_key FROM signature_compact ORDER BY output DESC, tx_key DESC LIMIT 1").fetchone()
+    last_output, last_tx_key = last_row if last_row is not None else (-1, -1)
+    print(f'Resuming after output {last_output}, tx key {last_tx_key}.')
+
+    # Walk the old primary key index in order, so each chunk is a range scan and only one chunk
+    # is ever held in memory.
+    select_chunk = """
+    SELECT output, tx_key FROM signature
+    WHERE (output, tx_key) > (?, ?)
+    ORDER BY output, tx_key
+    LIMIT ?
+    """
+    insert_chunk = "INSERT OR IGNORE INTO signature_compact (output, tx_key) VALUES (?, ?)"
+
+    total_rows_copied = 0
+    start = time.time()
+    while True:
+        rows = conn.execute(select_chunk, (last_output, last_tx_key, rows_per_commit)).fetchall()
+        if not rows:
+            break
+
+        conn.executemany(insert_chunk, rows)
+        conn.commit()
+
+        last_output, last_tx_key = rows[-1]
+        total_rows_copied += len(rows)
+        rows_per_second = round(total_rows_copied / max(time.time() - start, 1e-9))
+        print(f'COPIED {total_rows_copied} ROWS | Rows/s={rows_per_second} | Output={last_output}')
+
+    print('Replacing signature table.')
+    conn.execute("DROP INDEX IF EXISTS idx_signature_output_desc")
+    conn.execute("DROP TABLE signature")
+    conn.execute("ALTER TABLE signature_compact RENAME TO signature")
+    conn.commit()
+
+    if vacuum:
+        print('Running VACUUM.')
+        conn.execute("VACUUM")
+
+    db_manager.close()
+    print('Migration complete.')
+    print('--------------------------------\n')
+
+
+if __name__ == "__main__":
+    DB_PATH = 'database/output_to_ring_signature.db'
+
+    arguments = [argument for argument in sys.argv[1:] if not argument.startswith('--')]
+    db_path = arguments[0] if arguments else DB_PATH
+
+    migrate_signature_table(db_path, vacuum='--vacuum' in sys.argv)
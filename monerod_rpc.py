@@ -0,0 +1,242 @@
+import functools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+
+# One client for every call to monerod. Requests go through a requests.Session, so connections are
+# pooled and kept alive instead of being opened for every call.
+#
+# The daemon address comes from the MONEROD_URL environment variable, for example
+#   MONEROD_URL=http://192.168.1.10:18081 python main.py
+# and defaults to the local daemon.
+#
+# requests (and asyncio) are imported when first needed, so workers that never call monerod
+# do not pay for loading them.
+
+DEFAULT_URL = 'http://127.0.0.1:18081'
+
+
+class RPCError(Exception):
+    """Raised when monerod returns an error, or cannot be reached after all retries."""
+
+
+class MonerodClient:
+    """
+    Pooled, keep-alive client for the monerod RPC interface.
+
+    Failed requests (connection errors, timeouts and 5xx responses) are retried with exponential
+    backoff: backoff, 2 * backoff, 4 * backoff... seconds, at most max_backoff seconds apart.
+    After max_retries retries an RPCError is raised instead of retrying forever.
+
+    The client is thread-safe and keeps call counts and latencies for every method.
+    """
+
+    def __init__(self, url=None, max_retries=10, backoff=0.5, max_backoff=30.0, timeout=120.0, pool_size=32):
+        self.url = (url or os.environ.get('MONEROD_URL') or DEFAULT_URL).rstrip('/')
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.pool_size = pool_size
+
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'content-type': 'application/json'})
+
+        self.executor = None
+        self.stats = {} # method -> [calls, errors, total seconds, slowest call in seconds]
+        self.lock = threading.Lock()
+
+    def _record(self, method, seconds, failed):
+        with self.lock:
+            stats = self.stats.setdefault(method, [0, 0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += failed
+            stats[2] += seconds
+            stats[3] = max(stats[3], seconds)
+        metrics.histogram('monerod_rpc_seconds', 'Latency of monerod requests.', method=method).observe(seconds)
+        if failed:
+            metrics.counter('monerod_rpc_errors_total', 'Failed monerod requests.', method=method).inc()
+
+    def post(self, path, payload, method=None, max_retries=None):
+        """
+        Sends a JSON payload to a path of the daemon, such as '/get_transactions'.
+
+        Parameters:
+        path (str): The endpoint, starting with '/'.
+        payload (dict): The request body.
+        method (str): Name the latency is recorded under. Defaults to the path.
+        max_retries (int): Overrides the retries of the client for this call.
+
+        Returns:
+        requests.Response: The successful response.
+
+        Raises:
+        RPCError: After max_retries failed attempts, or at once for a 4xx response (for example 401
+                  from a daemon started with --rpc-login), which retrying would not change.
+        """
+        import requests
+        method = method or path.lstrip('/')
+        max_retries = self.max_retries if max_retries is None else max_retries
+        data = json.dumps(payload)
+
+        attempt = 0
+        while True:
+            request_start = time.time()
+            try:
+                response = self.session.post(self.url + path, data=data, timeout=self.timeout)
+                if response.status_code >= 500:
+                    raise requests.HTTPError(f'HTTP {response.status_code}', response=response)
+                if not 200 <= response.status_code < 300:
+                    self._record(method, time.time() - request_start, True)
+                    raise RPCError(f'{method} returned HTTP {response.status_code}.')
+                self._record(method, time.time() - request_start, False)
+                return response
+            except requests.RequestException as e:
+                self._record(method, time.time() - request_start, True)
+                if attempt >= max_retries:
+                    raise RPCError(f'{method} failed after {attempt + 1} attempts: {e}') from e
+                delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+                print(f'Request error encountered ({method}). Waiting {delay} seconds.')
+                time.sleep(delay)
+                attempt += 1
+
+    def post_json(self, path, payload, method=None, max_retries=None):
+        response = self.post(path, payload, method, max_retries)
+        with metrics.histogram('monerod_json_decode_seconds', 'Time spent parsing monerod responses.',
+                               method=method or path.lstrip('/')).time():
+            try:
+                return response.json()
+            except ValueError as e:
+                raise RPCError(f"{method or path.lstrip('/')} returned a response that is not JSON: {e}") from e
+
+    def json_rpc(self, method, params=None, max_retries=None):
+        """
+        Calls a method of the /json_rpc endpoint, for example get_block or get_block_count.
+
+        Returns:
+        dict: The 'result' of the call.
+        """
+        payload = {
+            "jsonrpc": "2.0",
+            "id": "0",
+            "method": method,
+        }
+        if params is not None:
+            payload["params"] = params
+
+        response = self.post_json('/json_rpc', payload, method, max_retries)
+        if 'error' in response:
+            raise RPCError(f"{method} returned an error: {response['error']}")
+        return response.get('result')
+
+    def _map(self, function, arguments):
+        # Runs the calls concurrently over the connection pool and returns the results in order.
+        if self.executor is None:
+            with self.lock:
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(max_workers=self.pool_size)
+        return list(self.executor.map(lambda argument: function(*argument), arguments))
+
+    def json_rpc_batch(self, calls):
+        """
+        Calls several /json_rpc methods and returns their results in order.
+
+        monerod does not accept JSON-RPC batch arrays, so the calls are sent as concurrent
+        requests over the pooled connections instead.
+
+        Parameters:
+        calls (iterable): (method, params) tuples.
+
+        Returns:
+        list: The 'result' of each call.
+        """
+        return self._map(self.json_rpc, calls)
+
+    def post_json_batch(self, path, payloads):
+        # Same as json_rpc_batch, for a plain endpoint such as '/get_transactions'.
+        return self._map(self.post_json, ((path, payload) for payload in payloads))
+
+    async def async_post_json(self, path, payload, method=None, max_retries=None):
+        # The blocking request runs on the default executor, so the event loop is not blocked.
+        import asyncio
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(self.post_json, path, payload, method, max_retries))
+
+    async def async_json_rpc(self, method, params=None, max_retries=None):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(self.json_rpc, method, params, max_retries))
+
+    def get_block_count(self):
+        # Note that this is the height, but block indices go from 0 to height - 1.
+        return self.json_rpc('get_block_count')['count']
+
+    def get_block(self, height):
+        return self.json_rpc('get_block', {'height': height})
+
+    def get_transactions(self, tx_hashes, prune=True):
+        """
+        Requests transactions from /get_transactions as raw blobs ('as_hex', or 'pruned_as_hex'
+        when pruned), without asking the daemon to decode them to JSON.
+
+        Returns:
+        requests.Response: The response, whose JSON carries the transactions under 'txs'.
+        """
+        payload = {
+            "txs_hashes": list(tx_hashes),
+            "decode_as_json": False,
+            "prune": prune
+        }
+        return self.post('/get_transactions', payload)
+
+    def latency_stats(self):
+        """
+        Returns:
+        dict: Per method: 'calls', 'errors', 'mean_seconds' and 'max_seconds'.
+        """
+        with self.lock:
+            return {method: {'calls': calls, 'errors': errors,
+                             'mean_seconds': total / calls if calls else 0.0, 'max_seconds': slowest}
+                    for method, (calls, errors, total, slowest) in self.stats.items()}
+
+    def print_latency_stats(self):
+        for method, stats in sorted(self.latency_stats().items()):
+            print(f"RPC {method} | Calls={stats['calls']} | Errors={stats['errors']} | "
+                  f"Mean={round(stats['mean_seconds'] * 1000, 1)}ms | Max={round(stats['max_seconds'] * 1000, 1)}ms")
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Returns the client shared by all modules, creating it on first use.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MonerodClient()
+    return _client
+
+
+def set_client(client):
+    # Replaces the shared client, for example to point every module at another daemon.
+    global _client
+    with _client_lock:
+        _client = client
@@ -0,0 +1,39 @@
+import argparse
+import database_manager as db
+
+
+# Lists the outputs picked by the most rings, from the reference counts kept in 'output_stats':
+#
+#   python output_stats.py --top 20
+#   python output_stats.py database/output_to_ring_signature.db --rebuild
+#
+# Heavily referenced outputs are mostly popular decoys; graphs can skip them with a maximum
+# reference count.
+
+DB_PATH = 'database/output_to_ring_signature.db'
+
+
+def print_most_referenced_outputs(db_manager, n):
+    rows = db_manager.get_most_referenced_outputs(n)
+    origins = db_manager.find_origins_by_outputs(output for output, _ in rows)
+    print(f"{'output':>12}{'rings':>10}  created by")
+    for output, ref_count in rows:
+        origin = origins.get(output)
+        print(f"{output:>12}{ref_count:>10}  {origin[1] if origin else '-'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='List the outputs referenced by the most rings.')
+    parser.add_argument('db', nargs='?', default=DB_PATH, help=f'SQLite database (default: {DB_PATH}).')
+    parser.add_argument('--top', type=int, default=20, help='Number of outputs to list (default: 20).')
+    parser.add_argument('--rebuild', action='store_true', help='Recount every output first.')
+    arguments = parser.parse_args()
+
+    db.create_database(arguments.db)
+    db_manager = db.open_database_manager(arguments.db)
+    try:
+        if arguments.rebuild:
+            db_manager.rebuild_output_stats()
+        print_most_referenced_outputs(db_manager, arguments.top)
+    finally:
+        db_manager.close()
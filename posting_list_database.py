@@ -0,0 +1,419 @@
+import sqlite3
+import sys
+import time
+import database_manager as db
+import metrics
+from tx_prefix_parser import encode_varint, read_varint
+
+
+# Alternative storage for ring membership. Instead of one (output, tx_key) row per pair in 'signature',
+# 'ring_posting' holds the sorted keys of the transactions that use each output as a ring member, like
+# the posting lists of a search engine. The list of an output is split into buckets of at most
+# POSTINGS_PER_BUCKET keys, one row each:
+#
+#   output          the output
+#   bucket          0, 1, 2... in key order; the row with the largest bucket is the tail of the list
+#   n_keys          number of keys in the bucket
+#   last_tx_key     largest key in the bucket, so appends need not decode it
+#   postings        varint(first key) varint(second - first) varint(third - second) ...
+#
+# A pair takes one to three bytes instead of a full B-tree row. Lists only grow at the end during sync,
+# because transactions are processed in key order, so an append rewrites the tail bucket only, or adds
+# a new one once it is full. Popular decoys gain keys in almost every batch, and rewriting their whole
+# list each time would cost writes quadratic in its length.
+
+POSTINGS_PER_BUCKET = 128
+
+POSTING_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS ring_posting (
+    output INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    n_keys INTEGER NOT NULL,
+    last_tx_key INTEGER NOT NULL,
+    postings BLOB NOT NULL,
+    PRIMARY KEY (output, bucket)
+) WITHOUT ROWID;
+"""
+
+INSERT_BUCKET_SQL = "INSERT OR REPLACE INTO ring_posting (output, bucket, n_keys, last_tx_key, postings) VALUES (?, ?, ?, ?, ?)"
+
+
+def encode_postings(tx_keys, previous=0):
+    """
+    Delta and varint encodes increasing tx keys.
+
+    Parameters:
+    tx_keys (iterable): Tx keys in increasing order, all above previous.
+    previous (int): Last key already in the list (0 for a new list).
+
+    Returns:
+    bytes: The encoded keys, to be appended to the list.
+    """
+    encoded = bytearray()
+    for tx_key in tx_keys:
+        encoded += encode_varint(tx_key - previous)
+        previous = tx_key
+    return bytes(encoded)
+
+
+def decode_postings(postings):
+    tx_keys = []
+    offset = 0
+    tx_key = 0
+    while offset < len(postings):
+        delta, offset = read_varint(postings, offset)
+        tx_key += delta
+        tx_keys.append(tx_key)
+    return tx_keys
+
+
+def bucket_rows(output, tx_keys, first_bucket=0):
+    """
+    Splits increasing tx keys into buckets of POSTINGS_PER_BUCKET keys.
+
+    Returns:
+    list: 'ring_posting' rows (output, bucket, n_keys, last_tx_key, postings), numbered from first_bucket.
+    """
+    rows = []
+    for start in range(0, len(tx_keys), POSTINGS_PER_BUCKET):
+        tx_keys_in_bucket = tx_keys[start:start + POSTINGS_PER_BUCKET]
+        rows.append((output, first_bucket + start // POSTINGS_PER_BUCKET, len(tx_keys_in_bucket),
+                     tx_keys_in_bucket[-1], encode_postings(tx_keys_in_bucket)))
+    return rows
+
+
+def decode_postings_bulk(posting_lists):
+    """
+    Decodes many posting lists at once with NumPy.
+
+    Parameters:
+    posting_lists (list): Encoded lists (bytes).
+
+    Returns:
+    tuple: (counts, tx_keys) arrays. List i holds counts[i] keys, which are the matching consecutive
+           slice of tx_keys.
+    """
+    import numpy as np
+    if not posting_lists:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    data = np.frombuffer(b''.join(posting_lists), dtype=np.uint8)
+    lengths = np.fromiter((len(postings) for postings in posting_lists), dtype=np.int64, count=len(posting_lists))
+
+    # Every byte below 0x80 ends a varint. Each byte contributes its low 7 bits, shifted by 7 for every
+    # earlier byte of the same varint.
+    is_last = data < 0x80
+    ends = np.flatnonzero(is_last)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    position = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+    payload = (data & 0x7f).astype(np.int64) << (7 * position)
+    deltas = np.add.reduceat(payload, starts) if len(starts) else np.zeros(0, dtype=np.int64)
+
+    # Number of varints in each list, then a running sum of the deltas restarted at every list.
+    list_ends = np.cumsum(lengths)
+    counts = np.diff(np.concatenate(([0], np.cumsum(is_last)[list_ends - 1])))
+    tx_keys = np.cumsum(deltas)
+    first_of_list = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    offsets = np.repeat(tx_keys[first_of_list] - deltas[first_of_list], counts)
+    return counts, tx_keys - offsets
+
+
+def _postings_up_to(counts, tx_keys, max_tx_key):
+    # Drops the keys above max_tx_key from the (counts, tx_keys) of decode_postings_bulk.
+    import numpy as np
+    kept = np.concatenate(([0], np.cumsum(tx_keys <= max_tx_key)))
+    list_bounds = np.concatenate(([0], np.cumsum(counts)))
+    return np.diff(kept[list_bounds]), tx_keys[tx_keys <= max_tx_key]
+
+
+def uses_posting_lists(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ring_posting'").fetchone() is not None
+
+
+def has_posting_buckets(conn):
+    # Databases converted before the lists were split into buckets keep one row per output.
+    return any(column[1] == 'bucket' for column in conn.execute("PRAGMA table_info(ring_posting)"))
+
+
+def _write_buckets(conn, lists):
+    # Saves (output, increasing tx keys) lists as buckets.
+    conn.executemany(INSERT_BUCKET_SQL, (row for output, tx_keys in lists for row in bucket_rows(output, tx_keys)))
+
+
+def split_posting_lists(conn, rows_per_chunk=100_000):
+    """
+    Splits the one-row-per-output lists of an older 'ring_posting' into buckets. The caller commits;
+    until then the split can be rolled back.
+    """
+    print('Splitting posting lists into buckets.')
+    if not conn.in_transaction:
+        conn.execute("BEGIN")
+    conn.execute("ALTER TABLE ring_posting RENAME TO ring_posting_unsplit")
+    conn.execute(POSTING_TABLE_SQL)
+    read = conn.execute("SELECT output, postings FROM ring_posting_unsplit ORDER BY output")
+    while True:
+        rows = read.fetchmany(rows_per_chunk)
+        if not rows:
+            break
+        _write_buckets(conn, [(output, decode_postings(postings)) for output, postings in rows])
+    conn.execute("DROP TABLE ring_posting_unsplit")
+
+
+def convert_database(db_path, rows_per_chunk=1_000_000, vacuum=False):
+    """
+    Switches a database to posting lists: creates 'ring_posting', fills it from 'signature' (read in
+    output order, one chunk at a time) and empties 'signature'. On a new database this only creates
+    the table. The conversion runs in one transaction, so an interrupted run leaves the database as it was.
+    """
+    db.create_database(db_path)
+    conn = sqlite3.connect(db_path)
+    if uses_posting_lists(conn):
+        if has_posting_buckets(conn):
+            print(f'{db_path} already uses posting lists.')
+        else:
+            split_posting_lists(conn)
+            conn.commit()
+        conn.close()
+        return
+
+    print('Converting signature table to posting lists.')
+    conn.execute(POSTING_TABLE_SQL)
+    read = conn.cursor()
+    read.execute("SELECT output, tx_key FROM signature ORDER BY output, tx_key")
+
+    n_pairs = 0
+    current_output = None
+    current_keys = []
+    while True:
+        rows = read.fetchmany(rows_per_chunk)
+        lists = []
+        for output, tx_key in rows:
+            if output != current_output:
+                if current_keys:
+                    lists.append((current_output, current_keys))
+                current_output, current_keys = output, []
+            current_keys.append(tx_key)
+        if not rows and current_keys:
+            lists.append((current_output, current_keys))
+        _write_buckets(conn, lists)
+        n_pairs += len(rows)
+        if not rows:
+            break
+        print(f'Converted {n_pairs} pairs.')
+
+    conn.execute("DELETE FROM signature")
+    conn.commit()
+    if vacuum:
+        print('Running VACUUM.')
+        conn.execute("VACUUM")
+    conn.close()
+    print(f'Converted {n_pairs} pairs to posting lists.')
+
+
+class PostingListDatabaseManager(db.DatabaseManager):
+    """
+    DatabaseManager that keeps ring membership in 'ring_posting' instead of 'signature'.
+
+    Appends read the tail bucket of every touched list in one query, and rewrite it or add buckets
+    after it. Keys not above the last one stored are skipped, so batches replayed after an interruption
+    are harmless. Lookups decode all the buckets of a query together with decode_postings_bulk.
+    Lists saved before buckets existed are split when the database is opened for writing.
+    """
+
+    def __init__(self, db_path, check_same_thread=True, read_only=False, shared_cache=False):
+        super().__init__(db_path, check_same_thread, read_only, shared_cache)
+        if not has_posting_buckets(self.conn):
+            if read_only:
+                self.conn.close()
+                raise ValueError(f'The posting lists of {db_path} must be split into buckets first: '
+                                 f'run python posting_list_database.py {db_path}')
+            split_posting_lists(self.conn)
+            self.conn.commit()
+        print('Ring membership stored as posting lists.')
+
+    # Pairs are appended straight to the lists; the staging table of the bulk load does not apply.
+    def should_bulk_load(self):
+        return False
+
+    def _set_query_outputs(self, cursor, outputs):
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS query_outputs (output INTEGER PRIMARY KEY)")
+        cursor.execute("DELETE FROM query_outputs")
+        cursor.executemany("INSERT OR IGNORE INTO query_outputs (output) VALUES (?)", ((output,) for output in outputs))
+
+    # The queries below use CROSS JOIN, which SQLite never reorders: the temporary table has no
+    # statistics, and the planner would otherwise scan the whole of 'ring_posting'.
+    def _load_lists(self, cursor, outputs):
+        # Every bucket of the lists of outputs, as (output, bucket, postings) in list order.
+        self._set_query_outputs(cursor, outputs)
+        cursor.execute("""
+        SELECT ring_posting.output, ring_posting.bucket, ring_posting.postings
+        FROM query_outputs
+        CROSS JOIN ring_posting ON ring_posting.output = query_outputs.output
+        ORDER BY query_outputs.output, ring_posting.bucket
+        """)
+        return cursor.fetchall()
+
+    def _load_tails(self, cursor, outputs):
+        # The last bucket of the lists of outputs, as (output, bucket, n_keys, last_tx_key, postings).
+        self._set_query_outputs(cursor, outputs)
+        cursor.execute("""
+        SELECT ring_posting.output, ring_posting.bucket, ring_posting.n_keys, ring_posting.last_tx_key, ring_posting.postings
+        FROM query_outputs
+        CROSS JOIN ring_posting ON ring_posting.output = query_outputs.output
+        AND ring_posting.bucket = (SELECT MAX(bucket) FROM ring_posting WHERE output = query_outputs.output)
+        """)
+        return cursor.fetchall()
+
+    def _append_pairs(self, cursor, output_tx_pairs):
+        # Returns the pairs appended; keys not above the last one of their list are already stored.
+        new_keys = {}
+        for output, tx_key in output_tx_pairs:
+            new_keys.setdefault(output, []).append(tx_key)
+
+        tails = {output: (bucket, n_keys, last_tx_key, postings)
+                 for output, bucket, n_keys, last_tx_key, postings in self._load_tails(cursor, new_keys)}
+        rows = []
+        appended = []
+        for output, tx_keys in new_keys.items():
+            # A new list starts at bucket 0.
+            bucket, n_keys, last_tx_key, postings = tails.get(output, (-1, POSTINGS_PER_BUCKET, 0, b''))
+            tx_keys = [tx_key for tx_key in sorted(set(tx_keys)) if tx_key > last_tx_key]
+            if not tx_keys:
+                continue
+            appended.extend((output, tx_key) for tx_key in tx_keys)
+
+            # Fill the tail bucket, then start new ones.
+            room = max(0, POSTINGS_PER_BUCKET - n_keys)
+            if room:
+                head = tx_keys[:room]
+                rows.append((output, bucket, n_keys + len(head), head[-1], postings + encode_postings(head, last_tx_key)))
+            rows.extend(bucket_rows(output, tx_keys[room:], bucket + 1))
+        cursor.executemany(INSERT_BUCKET_SQL, rows)
+        return appended
+
+    def add_output_tx_pair(self, output_tx_pairs, tx_outputs=(), last_tx_key=None):
+        cursor = self.conn.cursor()
+        try:
+            self._count_references(cursor, self._append_pairs(cursor, output_tx_pairs))
+            self._insert_tx_outputs(cursor, tx_outputs)
+            if last_tx_key is not None:
+                self._record_sync_state(cursor, 'signature', None, last_tx_key)
+                self._record_sync_state(cursor, 'tx_output', None, last_tx_key)
+            with metrics.histogram('sqlite_commit_seconds', 'Time spent in COMMIT.', operation='add_output_tx_pair').time():
+                self.conn.commit()
+            metrics.counter('sqlite_rows_written_total', 'Rows written.', table='ring_posting').inc(len(output_tx_pairs))
+            print(f'SAVED {len(output_tx_pairs)} OUTPUT-TX PAIRS as POSTINGS and {len(tx_outputs)} TX OUTPUT LISTS to DATABASE.')
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            self.conn.rollback()
+        finally:
+            cursor.close()
+
+    # Hooks used by add_block and rollback_to_block.
+    def _insert_signature_pairs(self, cursor, output_tx_pairs):
+        self._append_pairs(cursor, output_tx_pairs)
+
+    def _rewrite_buckets(self, cursor, buckets, keep):
+        # Rewrites each (output, bucket, postings) bucket with the keys accepted by keep(output, tx_key),
+        # and returns the pairs dropped. Emptied buckets are deleted; rollbacks remove the newest keys,
+        # so those are the last buckets of their lists.
+        updates = []
+        deletions = []
+        removed = []
+        for output, bucket, postings in buckets:
+            tx_keys = []
+            for tx_key in decode_postings(postings):
+                if keep(output, tx_key):
+                    tx_keys.append(tx_key)
+                else:
+                    removed.append((output, tx_key))
+            if tx_keys:
+                updates.append((len(tx_keys), tx_keys[-1], encode_postings(tx_keys), output, bucket))
+            else:
+                deletions.append((output, bucket))
+        cursor.executemany("UPDATE ring_posting SET n_keys = ?, last_tx_key = ?, postings = ? WHERE output = ? AND bucket = ?", updates)
+        cursor.executemany("DELETE FROM ring_posting WHERE output = ? AND bucket = ?", deletions)
+        return removed
+
+    def _delete_signature_pairs(self, cursor, output_tx_pairs):
+        removed = set(output_tx_pairs)
+        buckets = self._load_lists(cursor, set(output for output, _ in removed))
+        self._rewrite_buckets(cursor, buckets, lambda output, tx_key: (output, tx_key) not in removed)
+
+    def _delete_signature_from_tx_key(self, cursor, first_tx_key):
+        cursor.execute("SELECT output, bucket, postings FROM ring_posting WHERE last_tx_key >= ?", (first_tx_key,))
+        return self._rewrite_buckets(cursor, cursor.fetchall(), lambda output, tx_key: tx_key < first_tx_key)
+
+    def _count_all_references(self, cursor):
+        # The length of each posting list is the reference count of its output.
+        cursor.execute("INSERT INTO output_stats (output, ref_count) SELECT output, SUM(n_keys) FROM ring_posting GROUP BY output")
+
+    def find_transactions_by_outputs(self, output_values, max_tx_key=None):
+        cursor = self.conn.cursor()
+        try:
+            buckets = self._load_lists(cursor, set(output_values))
+            counts, tx_keys = decode_postings_bulk([postings for _, _, postings in buckets])
+            if max_tx_key is not None:
+                # Postings are in tx key order, so this only trims the tail of each list.
+                counts, tx_keys = _postings_up_to(counts, tx_keys, max_tx_key)
+        finally:
+            cursor.close()
+
+        hashes = {tx_key: hash.hex() for tx_key, hash in self._select_joined('query_tx_keys', set(tx_keys.tolist()), """
+        SELECT tx.key, tx.hash
+        FROM query_tx_keys
+        INNER JOIN tx ON tx.key = query_tx_keys.tx_key
+        """)}
+
+        # The buckets of a list are consecutive and in key order.
+        transactions = {}
+        position = 0
+        tx_keys = tx_keys.tolist()
+        for (output, _, _), count in zip(buckets, counts.tolist()):
+            transactions.setdefault(output, []).extend((tx_key, hashes[tx_key]) for tx_key in tx_keys[position:position + count]
+                                                       if tx_key in hashes)
+            position += count
+        return {output: ring for output, ring in sorted(transactions.items()) if ring}
+
+    def find_hashes_by_output(self, output_value):
+        return [hash for _, hash in self.find_transactions_by_outputs([output_value]).get(output_value, [])]
+
+    def get_largest_tx_value_from_signature_table(self):
+        return self.conn.execute("SELECT MAX(last_tx_key) FROM ring_posting").fetchone()[0]
+
+    def get_largest_ring_output(self):
+        return self.conn.execute("SELECT MAX(output) FROM ring_posting").fetchone()[0]
+
+    def iter_ring_pairs(self, rows_per_chunk=1_000_000):
+        # The buckets of a list follow each other in key order.
+        pairs = []
+        cursor = self.conn.execute("SELECT output, postings FROM ring_posting ORDER BY output, bucket")
+        try:
+            for output, postings in cursor:
+                pairs.extend((output, tx_key) for tx_key in decode_postings(postings))
+                if len(pairs) >= rows_per_chunk:
+                    yield pairs
+                    pairs = []
+        finally:
+            cursor.close()
+        if pairs:
+            yield pairs
+
+    def get_table_row_count(self, table_name):
+        if table_name != 'signature':
+            return super().get_table_row_count(table_name)
+
+        # Number of pairs.
+        return self.conn.execute("SELECT COALESCE(SUM(n_keys), 0) FROM ring_posting").fetchone()[0]
+
+
+if __name__ == "__main__":
+    DB_PATH = 'database/output_to_ring_signature.db'
+
+    arguments = [argument for argument in sys.argv[1:] if not argument.startswith('--')]
+    db_path = arguments[0] if arguments else DB_PATH
+
+    start = time.time()
+    convert_database(db_path, vacuum='--vacuum' in sys.argv)
+    print(f'Done in {round(time.time() - start, 2)}s.')
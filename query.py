@@ -0,0 +1,93 @@
+import argparse
+import contextlib
+import sys
+import database_manager as db
+import transaction_graph as tg
+import monerod_rpc as rpc
+import graph_render
+import metrics
+
+
+# Builds the graph of one transaction without the interactive menu of main.py, for workers that
+# only answer queries:
+#
+#   python query.py <tx hash> --limit 500 > graph.json
+#   python query.py <tx hash> --direction both --format graphml --output graph.graphml
+#
+# The graph is written as JSON or GraphML, so nothing used for drawing is imported; render.py turns
+# the JSON into an image. monerod is only contacted for transactions missing from the database.
+
+DB_PATH = 'database/output_to_ring_signature.db'
+
+
+def write_graph(graph, tx_hash, graph_format, output):
+    if graph_format == 'graphml':
+        output.writelines(graph_render.graphml_lines(graph))
+    else:
+        output.writelines(graph_render.iter_graph_json(graph, tx_hash))
+        output.write('\n')
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Build the transaction graph of one transaction.')
+    parser.add_argument('tx_hash', help='Hex hash of the root transaction.')
+    parser.add_argument('--db', default=DB_PATH, help=f'SQLite database (default: {DB_PATH}).')
+    parser.add_argument('--limit', type=int, default=200, help='Maximum number of nodes (default: 200).')
+    parser.add_argument('--direction', choices=tg.DIRECTIONS, default=tg.DESCENDANTS,
+                        help=f'Trace descendants, ancestors or both (default: {tg.DESCENDANTS}).')
+    parser.add_argument('--max-block-distance', type=int,
+                        help='Only follow transactions within this many blocks of the root (default: no limit).')
+    parser.add_argument('--max-depth', type=int, help='Maximum number of levels in each direction (default: no limit).')
+    parser.add_argument('--max-ref-count', type=int,
+                        help='Skip outputs used by more rings than this (default: no limit).')
+    parser.add_argument('--format', choices=('json', 'graphml'), default='json', help='Output format (default: json).')
+    parser.add_argument('--output', default='-', help="Output file, or '-' for stdout (default).")
+    parser.add_argument('--tx-cache', help='Persistent transaction cache in front of monerod, e.g. database/tx_cache.db.')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    tx_hash = arguments.tx_hash.strip()
+
+    # Progress messages printed by the other modules go to stderr, so stdout only carries the graph.
+    with contextlib.redirect_stdout(sys.stderr):
+        metrics.configure_from_environment()
+        persistent_cache = None
+        fetch_transactions = tg.get_transactions
+        if arguments.tx_cache:
+            import tx_cache
+            persistent_cache = tx_cache.TransactionCache(arguments.tx_cache)
+            fetch_transactions = persistent_cache.get_transactions
+
+        db_manager = db.open_database_manager(arguments.db, read_only=True)
+        error = None
+        try:
+            with metrics.profile('graph'):
+                graph = tg.create_transaction_graph_from_tx_id(
+                    tx_hash, db_manager, max(1, arguments.limit), fetch_transactions, arguments.direction,
+                    arguments.max_block_distance, arguments.max_depth, arguments.max_ref_count)
+        except rpc.RPCError as e:
+            error = f'Could not get transactions from monerod: {e}'
+        except tg.TransactionNotFoundError:
+            error = 'Transaction not found.'
+        except ValueError as e:
+            # A malformed hash, or a block distance for a transaction whose block is unknown.
+            error = f'Could not create the graph: {e}'
+        finally:
+            db_manager.close()
+            if persistent_cache is not None:
+                persistent_cache.print_stats()
+                persistent_cache.close()
+            metrics.stop_reporting()
+
+    if error is not None:
+        print(error, file=sys.stderr)
+        sys.exit(1)
+
+    if arguments.output == '-':
+        write_graph(graph, tx_hash, arguments.format, sys.stdout)
+    else:
+        with open(arguments.output, 'w') as f:
+            write_graph(graph, tx_hash, arguments.format, f)
+        print(f'Graph with {len(graph)} transactions saved to {arguments.output}.', file=sys.stderr)
@@ -0,0 +1,353 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import queue
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+import database_manager as db
+import transaction_graph as tg
+import graph_render
+import metrics
+
+
+# Long-lived HTTP service answering graph, ring and transaction queries for several clients at once:
+#
+#   python query_service.py --db database/output_to_ring_signature.db --port 8080 --pool-size 8
+#
+#   GET /graph/<tx hash>?limit=1000&direction=both&max_block_distance=5000&format=json
+#   GET /rings?outputs=123,456
+#   GET /tx/<tx hash>
+#
+# Queries run on worker threads, each borrowing one of a fixed set of read-only database
+# connections, so the database can keep syncing in another process. Identical queries that arrive
+# while the first one is still running share its result. Graphs are streamed as JSON or GraphML,
+# or rendered as PNG or SVG images.
+
+DB_PATH = 'database/output_to_ring_signature.db'
+TX_HASH = re.compile('^[0-9a-f]{64}$')
+GRAPH_FORMATS = {
+    'json': 'application/json',
+    'graphml': 'application/xml',
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ConnectionPool:
+    """
+    Fixed set of read-only database managers, lent to one worker thread at a time.
+
+    The managers are opened once, with a page cache shared by all of them if shared_cache is set,
+    so queries neither pay for opening the database nor read the same pages once per connection.
+    """
+
+    def __init__(self, db_path, size, shared_cache=True):
+        self.size = size
+        self.idle = queue.Queue()
+        for _ in range(size):
+            self.idle.put(db.open_database_manager(db_path, check_same_thread=False, read_only=True,
+                                                   shared_cache=shared_cache))
+
+    @contextlib.contextmanager
+    def connection(self):
+        db_manager = self.idle.get()
+        try:
+            yield db_manager
+        finally:
+            self.idle.put(db_manager)
+
+    def close(self):
+        for _ in range(self.size):
+            self.idle.get().close()
+
+
+class QueryCoalescer:
+    """
+    Runs concurrent identical queries once. The first caller of a key starts the query; callers
+    arriving before it finishes wait for the same result. Finished results are not kept.
+    Only used from the event loop thread.
+    """
+
+    def __init__(self):
+        self.in_flight = {}
+
+    async def run(self, key, start_query):
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(start_query())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        else:
+            metrics.counter('service_coalesced_total', 'Queries answered by a query already running.').inc()
+        # A client hanging up must not cancel the query for the others waiting on it.
+        return await asyncio.shield(task)
+
+
+class QueryService:
+    """
+    Answers the HTTP requests of the service. Database work runs on pool_size threads, one pool
+    connection each; images are rendered on render_workers threads of their own.
+    """
+
+    def __init__(self, db_path, pool_size=4, shared_cache=True, fetch_transactions=tg.get_transactions,
+                 max_limit=100_000, render_workers=1):
+        self.pool = ConnectionPool(db_path, pool_size, shared_cache)
+        self.workers = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='query')
+        self.renderers = ThreadPoolExecutor(max_workers=render_workers, thread_name_prefix='render')
+        self.coalescer = QueryCoalescer()
+        self.fetch_transactions = fetch_transactions
+        self.max_limit = max_limit
+
+    def _query(self, function, *args):
+        # Runs function(db_manager, *args) on a worker thread with a pooled connection.
+        def run():
+            with self.pool.connection() as db_manager:
+                return function(db_manager, *args)
+        return asyncio.get_running_loop().run_in_executor(self.workers, run)
+
+    # Queries, run on the worker threads.
+
+    def _build_graph(self, db_manager, tx_id, limit, direction, max_block_distance, max_depth, max_ref_count):
+        try:
+            graph = tg.create_transaction_graph_from_tx_id(tx_id, db_manager, limit, self.fetch_transactions, direction,
+                                                           max_block_distance, max_depth, max_ref_count)
+        except tg.TransactionNotFoundError:
+            raise HTTPError(404, 'Transaction not found.')
+        return graph, tg.determine_levels(graph)
+
+    @staticmethod
+    def _find_rings(db_manager, outputs, max_tx_key):
+        return db_manager.find_transactions_by_outputs(outputs, max_tx_key)
+
+    @staticmethod
+    def _find_transaction(db_manager, tx_id):
+        row = db_manager.find_transaction_by_hash(bytes.fromhex(tx_id))
+        if row is None:
+            raise HTTPError(404, 'Transaction not found.')
+        tx_key, _, block = row
+        return {'tx_id': tx_id, 'key': tx_key, 'block': block,
+                'outputs': db_manager.get_outputs_by_tx_keys([tx_key]).get(tx_key)}
+
+    def _serialise(self, pieces, chunk_size=1 << 16):
+        # Joins the pieces of a JSON or GraphML document into chunks of about chunk_size characters
+        # on the worker threads, so serialising a large graph does not hold up the event loop.
+        pieces = iter(pieces)
+        loop = asyncio.get_running_loop()
+
+        def next_chunk():
+            chunk, size = [], 0
+            for piece in pieces:
+                chunk.append(piece)
+                size += len(piece)
+                if size >= chunk_size:
+                    break
+            return ''.join(chunk).encode()
+
+        async def chunks():
+            while True:
+                data = await loop.run_in_executor(self.workers, next_chunk)
+                if not data:
+                    return
+                yield data
+        return chunks()
+
+    @staticmethod
+    def _render(graph, tx_id, image_format):
+        image = io.BytesIO()
+        with contextlib.redirect_stdout(io.StringIO()):
+            graph_render.render_image(graph, tx_id, image, image_format)
+        return image.getvalue()
+
+    # Endpoints. Each returns (content type, body), the body being bytes or an async iterator of bytes chunks.
+
+    async def graph(self, tx_id, parameters):
+        limit = min(max(1, integer_parameter(parameters, 'limit', 1000)), self.max_limit)
+        direction = parameters.get('direction', tg.DESCENDANTS)
+        if direction not in tg.DIRECTIONS:
+            raise HTTPError(400, f'direction must be one of {", ".join(tg.DIRECTIONS)}.')
+        output_format = parameters.get('format', 'json')
+        if output_format not in GRAPH_FORMATS:
+            raise HTTPError(400, f'format must be one of {", ".join(GRAPH_FORMATS)}.')
+        options = (limit, direction, integer_parameter(parameters, 'max_block_distance'),
+                   integer_parameter(parameters, 'max_depth'), integer_parameter(parameters, 'max_ref_count'))
+
+        graph_key = ('graph', tx_id) + options
+        build = lambda: self._query(self._build_graph, tx_id, *options)
+        if output_format in ('png', 'svg'):
+            async def render():
+                graph, _ = await self.coalescer.run(graph_key, build)
+                return await asyncio.get_running_loop().run_in_executor(self.renderers, self._render,
+                                                                        graph, tx_id, output_format)
+            return GRAPH_FORMATS[output_format], await self.coalescer.run(graph_key + (output_format,), render)
+
+        graph, levels = await self.coalescer.run(graph_key, build)
+        if output_format == 'graphml':
+            return GRAPH_FORMATS[output_format], self._serialise(graph_render.graphml_lines(graph, levels))
+        return GRAPH_FORMATS[output_format], self._serialise(graph_render.iter_graph_json(graph, tx_id, levels))
+
+    async def rings(self, parameters):
+        try:
+            outputs = tuple(sorted(set(int(output) for output in parameters.get('outputs', '').split(',') if output)))
+        except ValueError:
+            raise HTTPError(400, 'outputs must be a comma separated list of integers.')
+        if not outputs:
+            raise HTTPError(400, 'outputs is required.')
+        max_tx_key = integer_parameter(parameters, 'max_tx_key')
+        rings = await self.coalescer.run(('rings', outputs, max_tx_key),
+                                         lambda: self._query(self._find_rings, outputs, max_tx_key))
+        return 'application/json', json.dumps({str(output): ring for output, ring in rings.items()}).encode()
+
+    async def transaction(self, tx_id):
+        found = await self.coalescer.run(('tx', tx_id), lambda: self._query(self._find_transaction, tx_id))
+        return 'application/json', json.dumps(found).encode()
+
+    async def route(self, method, target):
+        if method != 'GET':
+            raise HTTPError(405, 'Only GET is supported.')
+        url = urlsplit(target)
+        parameters = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split('/') if part]
+
+        if parts == ['health']:
+            return 'application/json', b'{"status": "ok"}'
+        if parts == ['rings']:
+            return await self.rings(parameters)
+        if len(parts) == 2 and parts[0] in ('graph', 'tx'):
+            tx_id = parts[1].lower()
+            if not TX_HASH.match(tx_id):
+                raise HTTPError(400, 'Not a 64 character hex hash.')
+            return await (self.graph(tx_id, parameters) if parts[0] == 'graph' else self.transaction(tx_id))
+        raise HTTPError(404, 'Unknown endpoint.')
+
+    # HTTP/1.1 over asyncio streams, with keep-alive and chunked streaming.
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                method, target, version = (request_line.decode('latin-1').split() + ['', '', ''])[:3]
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                if not await self.respond(writer, method, target, keep_alive) or not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, method, target, keep_alive):
+        # Returns False if the response was cut short and the connection must be closed.
+        start = time.perf_counter()
+        endpoint = target.split('?', 1)[0].strip('/').split('/', 1)[0] or 'root'
+        try:
+            content_type, body = await self.route(method, target)
+            status = 200
+        except HTTPError as e:
+            status, content_type, body = e.status, 'application/json', json.dumps({'error': str(e)}).encode()
+        except Exception as e:
+            status, content_type, body = 500, 'application/json', json.dumps({'error': f'{type(e).__name__}: {e}'}).encode()
+
+        head = [f'HTTP/1.1 {status} {STATUS_TEXT[status]}', f'Content-Type: {content_type}',
+                f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        if isinstance(body, bytes):
+            writer.write(('\r\n'.join(head + [f'Content-Length: {len(body)}']) + '\r\n\r\n').encode() + body)
+        else:
+            writer.write(('\r\n'.join(head + ['Transfer-Encoding: chunked']) + '\r\n\r\n').encode())
+            try:
+                async for data in body:
+                    writer.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+                    await writer.drain()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                raise
+            except Exception as e:
+                # The status line is already sent, so the error cannot be reported. Closing the
+                # connection without the last chunk tells the client the body is incomplete.
+                print(f'Streaming {target} failed: {type(e).__name__}: {e}')
+                metrics.counter('service_stream_errors_total', 'Responses cut short by an error while streaming.',
+                                endpoint=endpoint).inc()
+                writer.transport.abort()
+                return False
+            writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+        metrics.counter('service_requests_total', 'HTTP requests answered.', endpoint=endpoint, status=str(status)).inc()
+        metrics.histogram('service_request_seconds', 'Time to answer one HTTP request.', endpoint=endpoint).observe(
+            time.perf_counter() - start)
+        return True
+
+    async def start(self, host, port):
+        # Returns the listening asyncio server; port 0 picks a free port.
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Query service listening on http://{host}:{server.sockets[0].getsockname()[1]}/ "
+              f"with {self.pool.size} read-only connections.")
+        return server
+
+    async def serve(self, host, port):
+        server = await self.start(host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.workers.shutdown()
+        self.renderers.shutdown()
+        self.pool.close()
+
+
+def integer_parameter(parameters, name, default=None):
+    if name not in parameters:
+        return default
+    try:
+        return int(parameters[name])
+    except ValueError:
+        raise HTTPError(400, f'{name} must be an integer.')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve graph, ring and transaction queries over HTTP.')
+    parser.add_argument('--db', default=DB_PATH, help=f'SQLite database (default: {DB_PATH}).')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1).')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on (default: 8080).')
+    parser.add_argument('--pool-size', type=int, default=4,
+                        help='Read-only database connections, and queries run at once (default: 4).')
+    parser.add_argument('--no-shared-cache', action='store_true', help='Give each connection its own page cache.')
+    parser.add_argument('--tx-cache', help='Persistent transaction cache in front of monerod, e.g. database/tx_cache.db.')
+    arguments = parser.parse_args()
+
+    metrics.configure_from_environment()
+    persistent_cache = None
+    fetch_transactions = tg.get_transactions
+    if arguments.tx_cache:
+        import tx_cache
+        persistent_cache = tx_cache.TransactionCache(arguments.tx_cache)
+        fetch_transactions = persistent_cache.get_transactions
+
+    service = QueryService(arguments.db, max(1, arguments.pool_size), not arguments.no_shared_cache, fetch_transactions)
+    try:
+        asyncio.run(service.serve(arguments.host, arguments.port))
+    except KeyboardInterrupt:
+        print('Query service stopped.')
+    finally:
+        service.close()
+        if persistent_cache is not None:
+            persistent_cache.close()
+        metrics.stop_reporting()
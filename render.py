@@ -0,0 +1,36 @@
+import argparse
+import json
+import sys
+import graph_render
+
+
+# Draws a graph written by query.py, so only this step loads NumPy and matplotlib:
+#
+#   python query.py <tx hash> | python render.py - --output graph.png
+#   python render.py graph.json
+#
+# Without --output the graph is shown in a window.
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Draw a transaction graph saved as JSON by query.py.')
+    parser.add_argument('graph', nargs='?', default='-', help="JSON graph file, or '-' for stdin (default).")
+    parser.add_argument('--output', help='Image to write, .png or .svg (default: show in a window).')
+    arguments = parser.parse_args()
+
+    if arguments.graph == '-':
+        document = json.load(sys.stdin)
+    else:
+        with open(arguments.graph) as f:
+            document = json.load(f)
+
+    graph, tx_hash = graph_render.graph_from_json(document)
+
+    if arguments.output:
+        extension = arguments.output.rsplit('.', 1)[-1].lower()
+        if extension not in ('png', 'svg'):
+            parser.error(f'Unsupported image format: .{extension}')
+        graph_render.render_image(graph, tx_hash, arguments.output, extension)
+        print(f'Graph with {len(graph)} transactions saved to {arguments.output}.')
+    else:
+        graph_render.show_graph(graph, tx_hash)
@@ -0,0 +1,331 @@
+import json
+import os
+import sys
+import time
+import numpy as np
+import database_manager as db
+
+
+# Read-only snapshot of the database in compressed sparse row (CSR) form, stored as .npy files
+# that are memory-mapped, so every process using the index shares one copy in the page cache.
+#
+#   ring_offsets.npy        int64[max_output + 2]    rings referencing output o are ring_tx_keys[ring_offsets[o]:ring_offsets[o + 1]]
+#   ring_tx_keys.npy        uint32/uint64[n_pairs]   tx keys, sorted by (output, tx_key)
+#   tx_hashes.npy           uint8[max_tx_key + 1, 32] tx hash by tx key (row 0 and deleted keys are zero)
+#   tx_blocks.npy           int64[max_tx_key + 1]    block height by tx key (-1 if absent)
+#   hash_prefixes.npy       uint64[n_txs]            first 8 bytes of each hash (big-endian), sorted
+#   hash_order.npy          uint32/uint64[n_txs]     tx keys in the order of hash_prefixes
+#   output_offsets.npy      int64[max_tx_key + 2]    outputs created by tx k are output_indices[output_offsets[k]:output_offsets[k + 1]]
+#   output_indices.npy      int64[n_outputs]
+#   output_origins.npy      uint32/uint64[max_rct_output + 1]  key of the tx that created each RingCT output (0 if unknown)
+#   meta.json               sizes and the sync state the snapshot was taken at
+
+INDEX_FORMAT_VERSION = 3
+HASH_SIZE = 32
+
+
+def _tx_key_dtype(max_tx_key):
+    return np.uint32 if max_tx_key < 2**32 else np.uint64
+
+
+def _truncate_array(index_dir, name, array, length, rows_per_chunk):
+    # Rewrites the .npy file of a memory-mapped array with its first length rows, a chunk at a time.
+    path = os.path.join(index_dir, name)
+    truncated = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype=array.dtype, shape=(length,))
+    for start in range(0, length, rows_per_chunk):
+        end = min(start + rows_per_chunk, length)
+        truncated[start:end] = array[start:end]
+    truncated.flush()
+    del truncated
+    os.replace(path + '.tmp', path)
+
+
+def build_ring_index(db_path, index_dir, rows_per_chunk=5_000_000):
+    """
+    Exports the rings, 'tx', 'tx_output' and 'rct_output_origin' tables of a database to a read-only CSR index.
+    The rings are read through the manager of the database's storage layout, so plain, sharded and
+    posting-list databases give the same index.
+
+    Every table is streamed in primary key order. Apart from one chunk of rows_per_chunk rows, memory
+    use is about 16 bytes per transaction for the hash sort and 8 bytes per output for the output lists.
+
+    Parameters:
+    db_path (str): Path to the SQLite database.
+    index_dir (str): Directory the index files are written to. Existing files are replaced.
+    rows_per_chunk (int): Number of rows read from SQLite at a time.
+    """
+    print('--------------------------------')
+    print(f'Building ring index in {index_dir}.')
+    print('This might take a while.\n')
+
+    os.makedirs(index_dir, exist_ok=True)
+    db_manager = db.open_database_manager(db_path)
+    if db_manager.has_signature_staging_table():
+        db_manager.close()
+        raise ValueError(f'{db_path} is in the middle of a bulk load; finish the sync before building a ring index.')
+    conn = db_manager.conn
+    start = time.time()
+
+    def open_array(name, dtype, shape):
+        return np.lib.format.open_memmap(os.path.join(index_dir, name), mode='w+', dtype=dtype, shape=shape)
+
+    max_output = db_manager.get_largest_ring_output()
+    max_output = max_output if max_output is not None else -1
+    max_tx_key = db_manager.get_largest_key_from_tx_table() or 0
+    n_pairs = db_manager.get_table_row_count('signature')
+    tx_key_dtype = _tx_key_dtype(max_tx_key)
+    print(f'Pairs: {n_pairs} | Largest output: {max_output} | Largest tx key: {max_tx_key}')
+
+    # Transaction hashes and blocks, addressed directly by tx key.
+    tx_hashes = open_array('tx_hashes.npy', np.uint8, (max_tx_key + 1, HASH_SIZE))
+    tx_blocks = open_array('tx_blocks.npy', np.int64, (max_tx_key + 1,))
+    tx_hashes[:] = 0
+    tx_blocks[:] = -1
+    present = np.zeros(max_tx_key + 1, dtype=bool)
+    cursor = conn.execute("SELECT key, hash, block FROM tx ORDER BY key")
+    while True:
+        rows = cursor.fetchmany(rows_per_chunk)
+        if not rows:
+            break
+        keys = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        tx_hashes[keys] = np.frombuffer(b''.join(row[1] for row in rows), dtype=np.uint8).reshape(-1, HASH_SIZE)
+        tx_blocks[keys] = np.fromiter((row[2] for row in rows), dtype=np.int64, count=len(rows))
+        present[keys] = True
+    tx_hashes.flush()
+    tx_blocks.flush()
+
+    # Sorted hash prefixes for lookups by hash.
+    keys = np.flatnonzero(present)
+    prefixes = tx_hashes[keys, :8].copy().view('>u8').ravel().astype(np.uint64)
+    order = np.argsort(prefixes, kind='stable')
+    np.save(os.path.join(index_dir, 'hash_prefixes.npy'), prefixes[order])
+    np.save(os.path.join(index_dir, 'hash_order.npy'), keys[order].astype(tx_key_dtype))
+    del prefixes, order, keys
+    print('Exported transaction hashes.')
+
+    # Ring postings. Pairs arrive sorted by output, so postings are written sequentially and
+    # the per-output counts are turned into offsets with a prefix sum at the end. Pairs of
+    # transactions that are no longer in 'tx' (a shard write that outlived a rollback) are skipped.
+    ring_offsets = open_array('ring_offsets.npy', np.int64, (max_output + 2,))
+    ring_tx_keys = open_array('ring_tx_keys.npy', tx_key_dtype, (n_pairs,))
+    ring_offsets[:] = 0
+    position = 0
+    for rows in db_manager.iter_ring_pairs(rows_per_chunk):
+        chunk = np.array(rows, dtype=np.int64)
+        chunk = chunk[(chunk[:, 1] <= max_tx_key) & present[np.minimum(chunk[:, 1], max_tx_key)]]
+        if not len(chunk):
+            continue
+        outputs, tx_keys = chunk[:, 0], chunk[:, 1]
+        lowest = outputs[0]
+        counts = np.bincount(outputs - lowest)
+        ring_offsets[lowest + 1:lowest + 1 + len(counts)] += counts
+        ring_tx_keys[position:position + len(chunk)] = tx_keys
+        position += len(chunk)
+        print(f'Exported {position} of {n_pairs} pairs.')
+    np.cumsum(ring_offsets, out=ring_offsets)
+    ring_offsets.flush()
+    ring_tx_keys.flush()
+    if position < n_pairs:
+        _truncate_array(index_dir, 'ring_tx_keys.npy', ring_tx_keys, position, rows_per_chunk)
+    n_pairs = position
+    del ring_offsets, ring_tx_keys, present
+
+    # Outputs created by each transaction.
+    output_counts = np.zeros(max_tx_key + 2, dtype=np.int64)
+    output_values = []
+    cursor = conn.execute("SELECT tx_key, outputs FROM tx_output ORDER BY tx_key")
+    while True:
+        rows = cursor.fetchmany(rows_per_chunk)
+        if not rows:
+            break
+        chunk_values = []
+        for tx_key, packed in rows:
+            outputs = db.unpack_output_indices(packed)
+            output_counts[tx_key + 1] = len(outputs)
+            chunk_values.extend(outputs)
+        output_values.append(np.array(chunk_values, dtype=np.int64))
+    output_values = np.concatenate(output_values) if output_values else np.zeros(0, dtype=np.int64)
+    np.save(os.path.join(index_dir, 'output_offsets.npy'), np.cumsum(output_counts))
+    np.save(os.path.join(index_dir, 'output_indices.npy'), output_values)
+    del output_values
+
+    # The creator of each RingCT output, so an origin is a single gather. Pre-RingCT outputs are indexed
+    # per amount and left out, as in 'rct_output_origin'.
+    max_rct_output = conn.execute("SELECT MAX(output) FROM rct_output_origin").fetchone()[0]
+    output_origins = np.zeros(max_rct_output + 1 if max_rct_output is not None else 0, dtype=tx_key_dtype)
+    cursor = conn.execute("SELECT output, tx_key FROM rct_output_origin ORDER BY output")
+    while True:
+        rows = cursor.fetchmany(rows_per_chunk)
+        if not rows:
+            break
+        chunk = np.array(rows, dtype=np.int64)
+        output_origins[chunk[:, 0]] = chunk[:, 1]
+    np.save(os.path.join(index_dir, 'output_origins.npy'), output_origins)
+    del output_origins
+    print('Exported transaction outputs.')
+
+    meta = {
+        'format_version': INDEX_FORMAT_VERSION,
+        'n_pairs': n_pairs,
+        'max_output': max_output,
+        'max_tx_key': max_tx_key,
+        'last_tx_key_completed': db_manager.get_latest_tx_key_completed('signature'),
+        'built_at': int(time.time()),
+    }
+    with open(os.path.join(index_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=4)
+
+    db_manager.close()
+    print(f'Ring index built in {round(time.time() - start, 2)}s.')
+    print('--------------------------------\n')
+
+
+class RingIndex:
+    """
+    Read-only, memory-mapped index built by build_ring_index.
+
+    It implements the query methods of DatabaseManager used by the graph builder, so it can be
+    passed in place of a DatabaseManager. The batch methods do their work with NumPy gathers
+    instead of one SQL lookup per output.
+    """
+
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta['format_version'] != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported ring index format version: {self.meta['format_version']}")
+
+        def load(name):
+            return np.load(os.path.join(index_dir, name), mmap_mode='r')
+
+        self.ring_offsets = load('ring_offsets.npy')
+        self.ring_tx_keys = load('ring_tx_keys.npy')
+        self.tx_hashes = load('tx_hashes.npy')
+        self.tx_blocks = load('tx_blocks.npy')
+        self.hash_prefixes = load('hash_prefixes.npy')
+        self.hash_order = load('hash_order.npy')
+        self.output_offsets = load('output_offsets.npy')
+        self.output_indices = load('output_indices.npy')
+        self.output_origins = load('output_origins.npy')
+        self._block_floor = None  # built by the first get_tx_key_range
+        print(f"Ring index loaded from {index_dir} (up to tx key {self.meta['last_tx_key_completed']}).")
+
+    def lookup_outputs(self, output_values):
+        """
+        Vectorized ring lookup for a batch of outputs.
+
+        Parameters:
+        output_values (array-like): Global output indices.
+
+        Returns:
+        tuple: (outputs, counts, tx_keys) as NumPy arrays. outputs[i] is referenced by counts[i]
+               transactions, whose keys are the matching consecutive slice of tx_keys.
+        """
+        outputs = np.unique(np.asarray(list(output_values), dtype=np.int64))
+        outputs = outputs[(outputs >= 0) & (outputs < len(self.ring_offsets) - 1)]
+        starts = self.ring_offsets[outputs]
+        counts = self.ring_offsets[outputs + 1] - starts
+
+        # Gather all postings at once: position j of output i is starts[i] + j.
+        total = int(counts.sum())
+        first_of_run = np.repeat(np.cumsum(counts) - counts, counts)
+        positions = np.repeat(starts, counts) + (np.arange(total, dtype=np.int64) - first_of_run)
+        return outputs, counts, self.ring_tx_keys[positions].astype(np.int64)
+
+    def _hex_hashes(self, tx_keys):
+        joined = self.tx_hashes[tx_keys].tobytes().hex()
+        return [joined[i:i + 2 * HASH_SIZE] for i in range(0, len(joined), 2 * HASH_SIZE)]
+
+    def find_transactions_by_outputs(self, output_values, max_tx_key=None):
+        outputs, counts, tx_keys = self.lookup_outputs(output_values)
+        if max_tx_key is not None:
+            # Rings are in tx key order; recount each one without its keys above max_tx_key.
+            kept = np.concatenate(([0], np.cumsum(tx_keys <= max_tx_key)))
+            counts = np.diff(kept[np.concatenate(([0], np.cumsum(counts)))])
+            tx_keys = tx_keys[tx_keys <= max_tx_key]
+        hashes = self._hex_hashes(tx_keys)
+
+        transactions = {}
+        position = 0
+        for output, count in zip(outputs.tolist(), counts.tolist()):
+            if count:
+                transactions[output] = list(zip(tx_keys[position:position + count].tolist(),
+                                                hashes[position:position + count]))
+            position += count
+        return transactions
+
+    def find_hashes_by_outputs(self, output_values):
+        return {output: [hash for _, hash in transactions]
+                for output, transactions in self.find_transactions_by_outputs(output_values).items()}
+
+    def find_hashes_by_output(self, output_value):
+        return self.find_hashes_by_outputs([output_value]).get(output_value, [])
+
+    def get_tx_key_range(self, first_block, last_block):
+        # Same as DatabaseManager.get_tx_key_range. Absent keys (-1) take the block of the key before
+        # them, which keeps the blocks sorted so both ends are binary searches.
+        if self._block_floor is None:
+            self._block_floor = np.maximum.accumulate(self.tx_blocks)
+        first = int(np.searchsorted(self._block_floor, first_block, side='left'))
+        last = int(np.searchsorted(self._block_floor, last_block, side='right')) - 1
+        return (first if first < len(self._block_floor) else None,
+                last if last >= 0 and self._block_floor[last] >= 0 else None)
+
+    def find_transaction_by_hash(self, hash_value):
+        prefix = np.frombuffer(hash_value[:8], dtype='>u8').astype(np.uint64)[0]
+        first = np.searchsorted(self.hash_prefixes, prefix, side='left')
+        last = np.searchsorted(self.hash_prefixes, prefix, side='right')
+        for tx_key in self.hash_order[first:last].tolist():
+            if self.tx_hashes[tx_key].tobytes() == hash_value:
+                return (tx_key, hash_value, int(self.tx_blocks[tx_key]))
+        return None
+
+    def find_origins_by_outputs(self, output_values, min_tx_key=None):
+        outputs = np.unique(np.asarray(list(output_values), dtype=np.int64))
+        outputs = outputs[(outputs >= 0) & (outputs < len(self.output_origins))]
+        tx_keys = self.output_origins[outputs].astype(np.int64)
+        found = tx_keys >= max(1, min_tx_key or 0)
+        outputs, tx_keys = outputs[found], tx_keys[found]
+        return dict(zip(outputs.tolist(), zip(tx_keys.tolist(), self._hex_hashes(tx_keys))))
+
+    def get_reference_counts(self, output_values):
+        # The length of the ring list of an output is its reference count.
+        outputs = np.unique(np.asarray(list(output_values), dtype=np.int64))
+        outputs = outputs[(outputs >= 0) & (outputs < len(self.ring_offsets) - 1)]
+        counts = (self.ring_offsets[outputs + 1] - self.ring_offsets[outputs]).astype(np.int64)
+        return dict(zip(outputs[counts > 0].tolist(), counts[counts > 0].tolist()))
+
+    def get_transaction_reference_counts(self, tx_keys):
+        outputs = self.get_outputs_by_tx_keys(tx_keys)
+        counts = self.get_reference_counts(output for tx_outputs in outputs.values() for output in tx_outputs)
+        return {tx_key: sum(counts.get(output, 0) for output in tx_outputs) for tx_key, tx_outputs in outputs.items()}
+
+    def get_most_referenced_outputs(self, n):
+        counts = np.diff(self.ring_offsets).astype(np.int64)
+        n = min(n, len(counts))
+        top = np.argpartition(-counts, n - 1)[:n] if n > 0 else np.zeros(0, dtype=np.int64)
+        top = top[np.lexsort((top, -counts[top]))]
+        return [(output, count) for output, count in zip(top.tolist(), counts[top].tolist()) if count > 0]
+
+    def get_outputs_by_tx_keys(self, tx_keys):
+        outputs = {}
+        for tx_key in tx_keys:
+            if 0 <= tx_key < len(self.output_offsets) - 1:
+                start, end = self.output_offsets[tx_key], self.output_offsets[tx_key + 1]
+                if end > start:
+                    outputs[tx_key] = self.output_indices[start:end].tolist()
+        return outputs
+
+    def close(self):
+        # The memory maps are released when the arrays are garbage collected.
+        pass
+
+
+if __name__ == "__main__":
+    DB_PATH = 'database/output_to_ring_signature.db'
+    RING_INDEX_DIR = 'database/ring_index'
+
+    db_path = sys.argv[1] if len(sys.argv) > 1 else DB_PATH
+    index_dir = sys.argv[2] if len(sys.argv) > 2 else RING_INDEX_DIR
+
+    build_ring_index(db_path, index_dir)
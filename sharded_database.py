@@ -0,0 +1,385 @@
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import database_manager as db
+import metrics
+
+
+# Optional layout that moves the 'signature' table out of the main database into n_shards SQLite files:
+#
+#   database/output_to_ring_signature.db            tx, tx_output, block, sync_state, ... (as before)
+#   database/output_to_ring_signature.db.shards.json   {"n_shards": 4, "stripe_size": 65536}
+#   database/output_to_ring_signature.db.shard0 ... .shard3   signature (output, tx_key) WITHOUT ROWID
+#
+# Global outputs are cut into stripes of stripe_size consecutive indices, dealt round-robin to the
+# shards: output o lives in shard (o // stripe_size) % n_shards. Ring members cluster around recent
+# outputs, so striping (rather than one contiguous range per shard) spreads every batch of writes over
+# all shards, while each shard's B-tree still receives runs of neighbouring keys.
+
+DEFAULT_N_SHARDS = 4
+DEFAULT_STRIPE_SIZE = 65536
+
+# Same as the main 'signature' table, without the foreign key: 'tx' lives in the main database.
+SHARD_SIGNATURE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS signature (
+    output INTEGER NOT NULL,
+    tx_key INTEGER NOT NULL,
+    PRIMARY KEY (output, tx_key)
+) WITHOUT ROWID;
+"""
+
+
+def layout_path(db_path):
+    return db_path + '.shards.json'
+
+
+def shard_path(db_path, shard):
+    return f'{db_path}.shard{shard}'
+
+
+def is_sharded(db_path):
+    return os.path.exists(layout_path(db_path))
+
+
+def create_sharded_database(db_path, n_shards=DEFAULT_N_SHARDS, stripe_size=DEFAULT_STRIPE_SIZE):
+    """
+    Creates the main database (if needed) and the shard files, and records the layout.
+    Pairs already in the main 'signature' table are moved into the shards, in output order.
+    """
+    db.create_database(db_path)
+    if is_sharded(db_path):
+        print(f'{db_path} is already sharded.')
+        return
+
+    for shard in range(n_shards):
+        conn = sqlite3.connect(shard_path(db_path, shard))
+        conn.execute(SHARD_SIGNATURE_TABLE_SQL)
+        conn.commit()
+        conn.close()
+
+    layout = {'n_shards': n_shards, 'stripe_size': stripe_size}
+    manager = ShardedDatabaseManager(db_path, layout)
+    try:
+        cursor = manager.conn.execute("SELECT output, tx_key FROM signature ORDER BY output, tx_key")
+        n_moved = 0
+        while True:
+            rows = cursor.fetchmany(1_000_000)
+            if not rows:
+                break
+            manager.write_pairs(rows)
+            n_moved += len(rows)
+            print(f'Moved {n_moved} pairs to the shards.')
+        manager.conn.execute("DELETE FROM signature")
+        manager.conn.commit()
+    finally:
+        manager.close()
+
+    # Written last, so an interrupted split leaves an unsharded database that can be split again.
+    with open(layout_path(db_path), 'w') as f:
+        json.dump(layout, f, indent=4)
+    print(f'Created {n_shards} shards with stripes of {stripe_size} outputs.')
+
+
+class ShardWriter:
+    """
+    Thread owning the write connection of one shard. Batches are committed in the order they are
+    submitted; the Future returned by submit completes once its batch is committed.
+    """
+
+    def __init__(self, path, max_queued=8):
+        self.path = path
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            pairs, future = item
+            try:
+                # Sorted inserts walk the B-tree in order. Replayed batches are ignored, so a batch
+                # committed here whose main database commit was lost can simply be written again.
+                pairs.sort()
+                with metrics.histogram('sqlite_commit_seconds', 'Time spent in COMMIT.', operation='shard_write').time():
+                    conn.executemany("INSERT OR IGNORE INTO signature (output, tx_key) VALUES (?, ?)", pairs)
+                    conn.commit()
+                future.set_result(len(pairs))
+            except Exception as e:
+                conn.rollback()
+                future.set_exception(e)
+        conn.close()
+
+    def submit(self, pairs):
+        future = Future()
+        self.queue.put((pairs, future))
+        return future
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+class ShardedDatabaseManager(db.DatabaseManager):
+    """
+    DatabaseManager whose 'signature' table is split across shard files.
+
+    Writes: add_output_tx_pair splits each batch by shard and hands the parts to one writer thread
+    per shard, then returns. Once every shard has committed a batch, its 'tx_output' rows, reference
+    counts and sync state are committed to the main database, in batch order, so the recorded progress never covers
+    pairs that are not on disk. At most max_pending batches are in flight.
+
+    Reads: lookups by output are routed to the shards holding them and run in parallel.
+    All other tables, and their methods, are those of DatabaseManager.
+    """
+
+    def __init__(self, db_path, layout=None, max_pending=4, check_same_thread=True, read_only=False, shared_cache=False):
+        super().__init__(db_path, check_same_thread, read_only, shared_cache)
+        if layout is None:
+            with open(layout_path(db_path)) as f:
+                layout = json.load(f)
+        self.n_shards = layout['n_shards']
+        self.stripe_size = layout['stripe_size']
+        self.max_pending = max_pending
+
+        paths = [shard_path(db_path, shard) for shard in range(self.n_shards)]
+        self.paths = paths
+        self.writers = None # started on the first write, so read-only users have no writer threads
+        self.pending = deque() # (shard futures, output_tx_pairs, tx_outputs, last_tx_key), oldest first
+
+        # One read connection per shard; a lock keeps each one to a single thread at a time.
+        self.readers = [db.connect(path, False, read_only, shared_cache) for path in paths]
+        self.reader_locks = [threading.Lock() for _ in paths]
+        self.router = ThreadPoolExecutor(max_workers=self.n_shards)
+        print(f'Sharded signature table: {self.n_shards} shards, stripes of {self.stripe_size} outputs.')
+
+    def shard_of(self, output):
+        return (output // self.stripe_size) % self.n_shards
+
+    def _split(self, output_tx_pairs):
+        parts = [[] for _ in range(self.n_shards)]
+        stripe_size, n_shards = self.stripe_size, self.n_shards
+        for pair in output_tx_pairs:
+            parts[(pair[0] // stripe_size) % n_shards].append(tuple(pair))
+        return parts
+
+    def _submit(self, output_tx_pairs):
+        if self.writers is None:
+            self.writers = [ShardWriter(path) for path in self.paths]
+        return [self.writers[shard].submit(part) for shard, part in enumerate(self._split(output_tx_pairs)) if part]
+
+    def write_pairs(self, output_tx_pairs):
+        # Writes pairs to the shards and waits until they are committed.
+        for future in self._submit(output_tx_pairs):
+            future.result()
+
+    # Bulk loading stages pairs in the main database, which the shards replace.
+    def should_bulk_load(self):
+        return False
+
+    def begin_bulk_load(self):
+        pass
+
+    def end_bulk_load(self):
+        pass
+
+    def add_output_tx_pair(self, output_tx_pairs, tx_outputs=(), last_tx_key=None):
+        futures = self._submit(output_tx_pairs)
+        self.pending.append((futures, output_tx_pairs, list(tx_outputs), last_tx_key))
+        self._complete_pending(keep=self.max_pending)
+
+    def _complete_pending(self, keep=0):
+        # Records the batches whose shard writes are done, oldest first, and waits for the oldest
+        # ones while more than keep batches are still pending.
+        while self.pending:
+            futures, output_tx_pairs, tx_outputs, last_tx_key = self.pending[0]
+            if len(self.pending) <= keep and not all(future.done() for future in futures):
+                break
+            for future in futures:
+                future.result()
+            self.pending.popleft()
+
+            cursor = self.conn.cursor()
+            try:
+                self._count_references(cursor, output_tx_pairs)
+                self._insert_tx_outputs(cursor, tx_outputs)
+                if last_tx_key is not None:
+                    self._record_sync_state(cursor, 'signature', None, last_tx_key)
+                    self._record_sync_state(cursor, 'tx_output', None, last_tx_key)
+                with metrics.histogram('sqlite_commit_seconds', 'Time spent in COMMIT.', operation='add_output_tx_pair').time():
+                    self.conn.commit()
+                print(f'SAVED {len(output_tx_pairs)} OUTPUT-TX PAIRS to {self.n_shards} SHARDS and {len(tx_outputs)} TX OUTPUT LISTS to DATABASE.')
+            except sqlite3.Error:
+                self.conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def flush(self):
+        self._complete_pending()
+
+    # Hooks used by add_block and rollback_to_block. The shard writes are committed before the
+    # main database transaction, and are idempotent, so a failed block can be written again.
+    def _insert_signature_pairs(self, cursor, output_tx_pairs):
+        self.write_pairs(output_tx_pairs)
+
+    def _delete_signature_pairs(self, cursor, output_tx_pairs):
+        self.flush()
+        parts = self._split(output_tx_pairs)
+        self._fan_out(lambda shard: self._delete_from_shard(shard, "DELETE FROM signature WHERE output = ? AND tx_key = ?",
+                                                            parts[shard], many=True))
+
+    def _delete_signature_from_tx_key(self, cursor, first_tx_key):
+        self.flush()
+
+        def delete(shard):
+            with self.reader_locks[shard]:
+                conn = self.readers[shard]
+                removed = conn.execute("SELECT output, tx_key FROM signature WHERE tx_key >= ?", (first_tx_key,)).fetchall()
+                conn.execute("DELETE FROM signature WHERE tx_key >= ?", (first_tx_key,))
+                conn.commit()
+                return removed
+
+        return [pair for removed in self._fan_out(delete) for pair in removed]
+
+    def _count_all_references(self, cursor, rows_per_chunk=100_000):
+        # Stripes never span two shards, so each output is counted by exactly one shard.
+        for shard in range(self.n_shards):
+            with self.reader_locks[shard]:
+                read = self.readers[shard].execute("SELECT output, COUNT(*) FROM signature GROUP BY output")
+                while True:
+                    counts = read.fetchmany(rows_per_chunk)
+                    if not counts:
+                        break
+                    cursor.executemany("INSERT INTO output_stats (output, ref_count) VALUES (?, ?)", counts)
+
+    def _delete_from_shard(self, shard, sql, parameters, many=False):
+        with self.reader_locks[shard]:
+            conn = self.readers[shard]
+            if many:
+                conn.executemany(sql, parameters)
+            else:
+                conn.execute(sql, parameters)
+            conn.commit()
+
+    def _fan_out(self, function):
+        return list(self.router.map(function, range(self.n_shards)))
+
+    def _query_shard(self, shard, outputs, max_tx_key=db.MAX_TX_KEY):
+        if not outputs:
+            return []
+        with self.reader_locks[shard]:
+            conn = self.readers[shard]
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS query_outputs (output INTEGER PRIMARY KEY)")
+            conn.execute("DELETE FROM query_outputs")
+            conn.executemany("INSERT OR IGNORE INTO query_outputs (output) VALUES (?)", ((output,) for output in outputs))
+            rows = conn.execute("""
+            SELECT signature.output, signature.tx_key
+            FROM query_outputs
+            INNER JOIN signature ON signature.output = query_outputs.output
+            WHERE signature.tx_key <= ?
+            """, (max_tx_key,)).fetchall()
+            conn.commit()
+            return rows
+
+    def _hashes_by_tx_keys(self, tx_keys):
+        return {tx_key: hash.hex() for tx_key, hash in self._select_joined('query_tx_keys', tx_keys, """
+        SELECT tx.key, tx.hash
+        FROM query_tx_keys
+        INNER JOIN tx ON tx.key = query_tx_keys.tx_key
+        """)}
+
+    def find_transactions_by_outputs(self, output_values, max_tx_key=None):
+        parts = [[] for _ in range(self.n_shards)]
+        for output in set(output_values):
+            parts[self.shard_of(output)].append(output)
+
+        if max_tx_key is None:
+            max_tx_key = db.MAX_TX_KEY
+        rows = [row for shard_rows in self._fan_out(lambda shard: self._query_shard(shard, parts[shard], max_tx_key))
+                for row in shard_rows]
+        hashes = self._hashes_by_tx_keys(set(tx_key for _, tx_key in rows))
+
+        # Pairs of transactions rolled back from the main database may linger in a shard; skip them.
+        transactions = {}
+        for output, tx_key in sorted(rows):
+            if tx_key in hashes:
+                transactions.setdefault(output, []).append((tx_key, hashes[tx_key]))
+        return transactions
+
+    def find_hashes_by_output(self, output_value):
+        return [hash for _, hash in self.find_transactions_by_outputs([output_value]).get(output_value, [])]
+
+    def get_largest_tx_value_from_signature_table(self):
+        def largest(shard):
+            with self.reader_locks[shard]:
+                return self.readers[shard].execute("SELECT MAX(tx_key) FROM signature").fetchone()[0]
+        values = [value for value in self._fan_out(largest) if value is not None]
+        return max(values) if values else None
+
+    def get_largest_ring_output(self):
+        def largest(shard):
+            with self.reader_locks[shard]:
+                return self.readers[shard].execute("SELECT MAX(output) FROM signature").fetchone()[0]
+        values = [value for value in self._fan_out(largest) if value is not None]
+        return max(values) if values else None
+
+    def iter_ring_pairs(self, rows_per_chunk=1_000_000):
+        # Stripes are dealt round-robin, so reading them in turn, each from its shard, gives output order.
+        self.flush()
+        max_output = self.get_largest_ring_output()
+        if max_output is None:
+            return
+        pairs = []
+        for stripe in range(max_output // self.stripe_size + 1):
+            shard = stripe % self.n_shards
+            with self.reader_locks[shard]:
+                pairs.extend(self.readers[shard].execute(
+                    "SELECT output, tx_key FROM signature WHERE output >= ? AND output < ? ORDER BY output, tx_key",
+                    (stripe * self.stripe_size, (stripe + 1) * self.stripe_size)).fetchall())
+            if len(pairs) >= rows_per_chunk:
+                yield pairs
+                pairs = []
+        if pairs:
+            yield pairs
+
+    def get_table_row_count(self, table_name):
+        if table_name != 'signature':
+            return super().get_table_row_count(table_name)
+
+        def count(shard):
+            with self.reader_locks[shard]:
+                return self.readers[shard].execute("SELECT COUNT(*) FROM signature").fetchone()[0]
+        return sum(self._fan_out(count))
+
+    def close(self):
+        self.flush()
+        for writer in self.writers or []:
+            writer.close()
+        self.router.shutdown()
+        for reader in self.readers:
+            reader.close()
+        super().close()
+
+
+if __name__ == "__main__":
+    DB_PATH = 'database/output_to_ring_signature.db'
+
+    arguments = [argument for argument in sys.argv[1:] if not argument.startswith('--')]
+    options = dict(argument[2:].split('=', 1) for argument in sys.argv[1:] if argument.startswith('--') and '=' in argument)
+    db_path = arguments[0] if arguments else DB_PATH
+
+    start = time.time()
+    create_sharded_database(db_path, int(options.get('shards', DEFAULT_N_SHARDS)),
+                            int(options.get('stripe', DEFAULT_STRIPE_SIZE)))
+    print(f'Done in {round(time.time() - start, 2)}s.')
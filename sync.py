@@ -0,0 +1,95 @@
+import argparse
+import sys
+import time
+import database_manager as db
+import update_tx_table as tx
+import update_signature_table as sig
+import follow_chain as fc
+import monerod_rpc as rpc
+import metrics
+
+
+# Syncs the database with monerod without the interactive menu of main.py, for workers that only
+# keep the database up to date:
+#
+#   python sync.py
+#   python sync.py database/output_to_ring_signature.db --follow --wait 30
+#
+# Nothing used to draw or trace graphs is imported, so the process starts quickly.
+
+DB_PATH = 'database/output_to_ring_signature.db'
+
+
+def is_monerod_running():
+    print('Checking if monerod is running.')
+
+    # A single attempt: callers decide whether to ask the user, wait or give up.
+    try:
+        return rpc.get_client().json_rpc('get_info', max_retries=0) is not None
+    except (rpc.RPCError, ValueError):
+        return False
+
+
+def wait_for_monerod(timeout, poll_interval=5):
+    """
+    Waits up to timeout seconds for monerod to answer.
+
+    Returns:
+    bool: True once monerod is running, False if it did not start in time.
+    """
+    deadline = time.monotonic() + timeout
+    while not is_monerod_running():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(min(poll_interval, max(0, deadline - time.monotonic())))
+    return True
+
+
+def update_database(db_manager):
+    # The initial sync loads into an unindexed staging table and indexes it at the end.
+    bulk_load = db_manager.should_bulk_load()
+    if bulk_load:
+        db_manager.begin_bulk_load()
+
+    tx.update_tx_table(db_manager)
+    sig.update_output_tx_pairs_table(db_manager)
+
+    if bulk_load:
+        db_manager.end_bulk_load()
+
+    rpc.get_client().print_latency_stats()
+
+
+def sync(db_path, follow=False, poll_interval=5):
+    # Catches up with the chain, then, if follow is set, keeps up with new blocks until interrupted.
+    db.create_database(db_path)
+    db_manager = db.open_database_manager(db_path)
+    try:
+        update_database(db_manager)
+        if follow:
+            fc.follow_chain(db_manager, poll_interval)
+    finally:
+        db_manager.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Create or update the transactions database from monerod.')
+    parser.add_argument('db', nargs='?', default=DB_PATH, help=f'SQLite database (default: {DB_PATH}).')
+    parser.add_argument('--follow', action='store_true', help='Keep following the chain after catching up.')
+    parser.add_argument('--poll-interval', type=float, default=5,
+                        help='Seconds between checks for new blocks with --follow (default: 5).')
+    parser.add_argument('--wait', type=float, default=0,
+                        help='Seconds to wait for monerod to start before giving up (default: 0).')
+    arguments = parser.parse_args()
+
+    metrics.configure_from_environment()
+    if not wait_for_monerod(arguments.wait):
+        print('monerod is not running.', file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        sync(arguments.db, arguments.follow, arguments.poll_interval)
+    except KeyboardInterrupt:
+        print('Sync stopped.')
+    finally:
+        metrics.stop_reporting()
@@ -0,0 +1,54 @@
+"""
+Tests of batch_trace with a stand-in for the tracer: roots are read lazily and deduplicated, no more
+than twice as many traces as workers are submitted ahead of the written results, and every root gets
+its line.
+
+    python -m pytest tests
+"""
+import io
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+import batch_trace
+
+
+class BatchTraceTest(unittest.TestCase):
+    def test_roots_are_read_lazily(self):
+        lines = iter(['# roots', 'AA', '', 'bb', 'aa'])
+        roots = batch_trace.read_roots(lines)
+        self.assertEqual(next(roots), 'aa')
+        self.assertEqual(next(lines), '')
+        self.assertEqual(list(roots), ['bb'])
+
+    def test_submissions_are_bounded(self):
+        output = io.StringIO()
+        n_read = 0
+        ahead = []
+
+        def roots():
+            nonlocal n_read
+            for n in range(50):
+                n_read += 1
+                yield f'{n:064x}'
+
+        def trace_root(root, *args):
+            ahead.append(n_read - output.getvalue().count('\n'))
+            return root, None, 0.0, 'Transaction not found.'
+
+        with mock.patch.object(batch_trace, 'trace_root', trace_root):
+            n_traced, n_failed = batch_trace.batch_trace(roots(), None, 10, 2, 'ndjson', output)
+
+        self.assertEqual((n_traced, n_failed), (50, 50))
+        self.assertLessEqual(max(ahead), 4)
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(sorted(record['root'] for record in records), [f'{n:064x}' for n in range(50)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+Tests of blockchain_import against small raw exports written by benchmarks/synthetic_export.py.
+
+The synthetic blocks cycle through every RingCT type, and the regular transactions are listed under
+their Keccak hashes, so the imports run with verify_hashes and check every block and transaction hash.
+The saved rows are compared with the rings and output indices of the synthetic chain.
+
+    python -m pytest tests
+"""
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, os.path.join(os.path.dirname(TESTS_DIR), 'benchmarks'))
+
+import blockchain_import
+import database_manager as db
+import tx_prefix_parser
+from synthetic_chain import SyntheticChain
+from synthetic_export import write_raw_export
+
+
+def synthetic_chain(n_blocks):
+    # The chains of the same seed share their first blocks, so a shorter one is a prefix of a longer one.
+    return SyntheticChain(n_blocks, txs_per_block=3, ring_size=4, spend_pattern='uniform', seed=7)
+
+
+class BlockchainImportTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.directory.name, 'test.db')
+        db.create_database(self.db_path)
+        self.db_manager = db.open_database_manager(self.db_path)
+
+    def tearDown(self):
+        self.db_manager.close()
+        self.directory.cleanup()
+
+    def write_export(self, chain):
+        path = os.path.join(self.directory.name, f'blockchain-{len(chain.blocks)}.raw')
+        block_hashes = write_raw_export(chain, path, seed=7, real_tx_hashes=True)
+        return path, block_hashes
+
+    def import_export(self, path, blocks_per_commit):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return blockchain_import.import_raw_export(self.db_manager, path, blocks_per_commit, verify_hashes=True)
+
+    def assert_rows_match(self, chain, block_hashes):
+        conn = self.db_manager.conn
+        tx_rows = conn.execute("SELECT key, block FROM tx ORDER BY key").fetchall()
+        # Transactions are saved block by block, the miner transaction first.
+        transactions = [chain.transactions[tx_hash] for block in chain.blocks
+                        for tx_hash in [block['miner_tx_hash']] + block['tx_hashes']]
+        self.assertEqual([block for _, block in tx_rows], [transaction['height'] for transaction in transactions])
+        tx_keys = [key for key, _ in tx_rows]
+
+        self.assertEqual([self.db_manager.get_block_hash(height) for height in range(len(chain.blocks))], block_hashes)
+
+        expected_pairs = sorted((member, tx_key) for tx_key, transaction in zip(tx_keys, transactions)
+                                for member in tx_prefix_parser.ring_members_from_hex(transaction['blob']))
+        self.assertTrue(expected_pairs)
+        self.assertEqual(conn.execute("SELECT output, tx_key FROM signature ORDER BY output, tx_key").fetchall(),
+                         expected_pairs)
+
+        self.assertEqual(self.db_manager.get_outputs_by_tx_keys(tx_keys),
+                         {tx_key: transaction['output_indices'] for tx_key, transaction in zip(tx_keys, transactions)})
+
+    def test_import_matches_the_chain(self):
+        chain = synthetic_chain(12)
+        path, block_hashes = self.write_export(chain)
+        self.assertEqual(self.import_export(path, blocks_per_commit=5), 12)
+        self.assert_rows_match(chain, block_hashes)
+
+        # Every RingCT type was parsed and hashed.
+        export = blockchain_import.RawBlockchainExport(path)
+        try:
+            rct_types = {transaction['rct_type'] for block in export.block_packages()
+                         for transaction in block['transactions']}
+        finally:
+            export.close()
+        self.assertEqual(rct_types, set(range(blockchain_import.RCT_TYPE_FULL,
+                                              blockchain_import.RCT_TYPE_BULLETPROOF_PLUS + 1)))
+
+    def test_import_resumes_after_the_last_saved_block(self):
+        short_path, _ = self.write_export(synthetic_chain(6))
+        chain = synthetic_chain(12)
+        path, block_hashes = self.write_export(chain)
+
+        self.assertEqual(self.import_export(short_path, blocks_per_commit=2), 6)
+        self.assertEqual(self.import_export(path, blocks_per_commit=2), 6)
+        self.assert_rows_match(chain, block_hashes)
+        self.assertEqual(self.import_export(path, blocks_per_commit=2), 0)
+
+    def test_hash_mismatch(self):
+        chain = synthetic_chain(6)
+        path = os.path.join(self.directory.name, 'blockchain.raw')
+        # The blocks list the synthetic transaction hashes, which are not the hashes of the blobs.
+        write_raw_export(chain, path, seed=7)
+        with self.assertRaises(ValueError):
+            self.import_export(path, blocks_per_commit=2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+"""
+Tests of the bulk-load mode of DatabaseManager: pairs staged during the initial sync are copied into
+'signature' one range of outputs at a time, resuming an interrupted copy, and the connection settings
+changed for the load, temp_store included, are restored afterwards.
+
+    python -m pytest tests
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+import database_manager as db
+import ring_index
+
+
+def tx_hash(n):
+    return n.to_bytes(32, 'big')
+
+
+class BulkLoadTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.db_path = os.path.join(self.directory.name, 'test.db')
+        db.create_database(self.db_path)
+        self.db_manager = db.open_database_manager(self.db_path)
+        self.addCleanup(lambda: self.db_manager.close())
+
+        # Transaction n of block n uses outputs n to n + 4 and creates outputs 10 + 2n and 11 + 2n.
+        self.blocks = [(n, tx_hash(1000 + n), [(tx_hash(n), set(range(n, n + 5)), [10 + 2 * n, 11 + 2 * n], 2)])
+                       for n in range(1, 21)]
+        self.pairs = sorted((output, n) for n in range(1, 21) for output in range(n, n + 5))
+
+    def pragma(self, name):
+        return self.db_manager.conn.execute(f'PRAGMA {name}').fetchone()[0]
+
+    def test_pairs_are_copied_in_ranges(self):
+        default_temp_store = sqlite3.connect(':memory:').execute('PRAGMA temp_store').fetchone()[0]
+        self.db_manager.begin_bulk_load()
+        self.assertEqual(self.pragma('temp_store'), 2)
+        self.db_manager.add_blocks(self.blocks)
+        self.assertEqual(self.db_manager.get_table_row_count('signature'), 0)
+
+        self.db_manager.end_bulk_load(outputs_per_commit=3)
+        self.assertEqual(self.db_manager.conn.execute("SELECT output, tx_key FROM signature").fetchall(), self.pairs)
+        self.assertFalse(self.db_manager.has_signature_staging_table())
+        self.assertEqual(self.db_manager.get_reference_counts([1, 5, 24, 25]), {1: 1, 5: 5, 24: 1})
+        self.assertEqual(self.pragma('temp_store'), default_temp_store)
+        self.assertEqual(self.pragma('journal_mode'), 'delete')
+        self.assertEqual(self.pragma('synchronous'), 2)
+        self.assertEqual(self.pragma('foreign_keys'), 1)
+
+    def test_interrupted_copy_is_resumed(self):
+        self.db_manager.begin_bulk_load()
+        self.db_manager.add_blocks(self.blocks)
+        # A copy interrupted after the first ranges leaves those pairs in both tables.
+        self.db_manager.conn.execute("INSERT INTO signature SELECT output, tx_key FROM signature_staging WHERE output < 8")
+        self.db_manager.conn.commit()
+
+        self.db_manager.end_bulk_load(outputs_per_commit=4)
+        self.assertEqual(self.db_manager.conn.execute("SELECT output, tx_key FROM signature").fetchall(), self.pairs)
+        self.assertEqual(self.db_manager.get_reference_counts([5, 8]), {5: 5, 8: 5})
+
+
+    def test_ring_index_needs_a_finished_load(self):
+        self.db_manager.begin_bulk_load()
+        self.db_manager.add_blocks(self.blocks)
+        with self.assertRaises(ValueError):
+            ring_index.build_ring_index(self.db_path, os.path.join(self.directory.name, 'ring_index'))
+
+
+if __name__ == "__main__":
+    unittest.main()
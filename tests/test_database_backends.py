@@ -0,0 +1,186 @@
+"""
+Tests that the storage backends answer the graph queries alike. The same synthetic chain is saved in
+a plain database, a posting-list database (with buckets of four keys), a sharded database and ring
+indices built from each of them; the reference counts, output origins, rings and the graphs built from
+them must agree with each other and with counts taken from the chain itself. Reference counts must
+also follow a reorg, whether the rolled back rings come from the journal or a scan of the rings.
+
+    python -m pytest tests
+"""
+import os
+import random
+import sys
+import tempfile
+import unittest
+from collections import Counter
+from unittest import mock
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+import database_manager as db
+import posting_list_database as postings
+import ring_index
+import sharded_database as sharded
+import transaction_graph as tg
+
+SQL_BACKENDS = ('plain', 'posting_list', 'sharded')
+
+
+def tx_hash(n):
+    return n.to_bytes(32, 'big')
+
+
+def make_chain(n_blocks, seed=3):
+    """
+    Returns the blocks of a chain of RingCT transactions, as taken by add_blocks. Every transaction
+    creates two outputs; after the first block, each one has a ring of four earlier outputs, picked
+    mostly among the recent ones so some outputs are referenced by many rings.
+    """
+    rng = random.Random(seed)
+    blocks = []
+    n_outputs = n_txs = 0
+    for height in range(n_blocks):
+        # Outputs can only be used from the next block on.
+        spendable = n_outputs
+        transactions = []
+        for _ in range(1 if height == 0 else 3):
+            n_txs += 1
+            ring = set()
+            if spendable >= 4:
+                while len(ring) < 4:
+                    ring.add(max(0, spendable - 1 - int(rng.expovariate(0.1))) if rng.random() < 0.7 else rng.randrange(spendable))
+            transactions.append((tx_hash(n_txs), ring, [n_outputs, n_outputs + 1], 2))
+            n_outputs += 2
+        blocks.append((height, tx_hash(10_000 + height), transactions))
+    return blocks
+
+
+def reference_counts(blocks):
+    return dict(Counter(member for _, _, transactions in blocks for _, ring, _, _ in transactions for member in ring))
+
+
+def open_backend(kind, db_path):
+    if kind == 'posting_list':
+        postings.convert_database(db_path)
+    elif kind == 'sharded':
+        sharded.create_sharded_database(db_path, n_shards=3, stripe_size=8)
+    else:
+        db.create_database(db_path)
+    return db.open_database_manager(db_path)
+
+
+class BackendParityTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(postings, 'POSTINGS_PER_BUCKET', 4)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        self.blocks = make_chain(40)
+        self.backends = {}
+        for kind in SQL_BACKENDS:
+            manager = open_backend(kind, os.path.join(directory.name, f'{kind}.db'))
+            self.addCleanup(manager.close)
+            manager.add_blocks(self.blocks)
+            self.backends[kind] = manager
+
+        # A pair left in a shard by a rollback whose main database commit was lost.
+        self.backends['sharded'].write_pairs([(3, 999)])
+
+        # A ring index built from each layout.
+        for kind in SQL_BACKENDS:
+            index_dir = os.path.join(directory.name, f'{kind}_index')
+            ring_index.build_ring_index(os.path.join(directory.name, f'{kind}.db'), index_dir, rows_per_chunk=50)
+            self.backends[f'{kind}_index'] = ring_index.RingIndex(index_dir)
+            self.addCleanup(self.backends[f'{kind}_index'].close)
+
+        # Ancestors need the ring members of each transaction, which monerod would return.
+        self.transactions = {tx.hex(): {'tx_id': tx.hex(), 'outputs': outputs, 'ring_members': sorted(ring), 'full': None}
+                             for _, _, transactions in self.blocks for tx, ring, outputs, _ in transactions}
+        self.n_outputs = sum(len(outputs) for _, _, transactions in self.blocks for _, _, outputs, _ in transactions)
+
+    def fetch_transactions(self, tx_hashes):
+        return {tx_id: self.transactions[tx_id] for tx_id in tx_hashes if tx_id in self.transactions}
+
+    def assertBackendsAgree(self, query):
+        expected = query(self.backends['plain'])
+        for kind, manager in self.backends.items():
+            with self.subTest(backend=kind):
+                self.assertEqual(query(manager), expected)
+        return expected
+
+    def test_reference_counts(self):
+        outputs = range(self.n_outputs + 5)
+        counts = self.assertBackendsAgree(lambda manager: manager.get_reference_counts(outputs))
+        self.assertEqual(counts, reference_counts(self.blocks))
+        self.assertGreater(max(counts.values()), 4)
+
+    def test_origins(self):
+        outputs = range(self.n_outputs + 5)
+        origins = self.assertBackendsAgree(lambda manager: manager.find_origins_by_outputs(outputs))
+        self.assertEqual(len(origins), self.n_outputs)
+        self.assertBackendsAgree(lambda manager: manager.find_origins_by_outputs(outputs, min_tx_key=50))
+
+    def test_rings(self):
+        outputs = range(self.n_outputs + 5)
+        for max_tx_key in (None, 60):
+            self.assertBackendsAgree(lambda manager: {output: sorted(transactions) for output, transactions
+                                                      in manager.find_transactions_by_outputs(outputs, max_tx_key).items()})
+
+    def test_graphs(self):
+        # Roots from the first, a middle and a late block, traced with and without bounds.
+        roots = [tx_hash(n).hex() for n in (1, 30, 100)]
+        options = [dict(direction=direction) for direction in tg.DIRECTIONS]
+        options += [dict(direction=tg.DESCENDANTS, max_ref_count=3), dict(direction='both', max_block_distance=5, max_depth=3)]
+
+        def graphs(manager):
+            return [{tx_id: sorted(children) for tx_id, children in tg.transaction_graph_to_hash_graph(
+                        tg.create_transaction_graph_from_tx_id(root, manager, 10_000, self.fetch_transactions, **option)).items()}
+                    for root in roots for option in options]
+
+        self.assertGreater(len(self.assertBackendsAgree(graphs)[0]), 20)
+
+
+class RollbackOutputStatsTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(postings, 'POSTINGS_PER_BUCKET', 4)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.blocks = make_chain(30)
+
+    def output_stats(self, manager):
+        return dict(manager.conn.execute("SELECT output, ref_count FROM output_stats").fetchall())
+
+    def check_rollback(self, journal_depth):
+        for kind in SQL_BACKENDS:
+            with self.subTest(backend=kind):
+                manager = open_backend(kind, os.path.join(self.directory.name, f'{kind}_{journal_depth}.db'))
+                try:
+                    manager.add_blocks(self.blocks[:20], journal_depth)
+                    manager.add_blocks(self.blocks[20:], journal_depth)
+                    self.assertEqual(self.output_stats(manager), reference_counts(self.blocks))
+
+                    manager.rollback_to_block(15)
+                    self.assertEqual(self.output_stats(manager), reference_counts(self.blocks[:16]))
+                    self.assertEqual(manager.get_reference_counts(range(200)), reference_counts(self.blocks[:16]))
+
+                    # The other side of the reorg.
+                    other_blocks = make_chain(30, seed=4)[16:]
+                    manager.add_blocks(other_blocks, journal_depth)
+                    self.assertEqual(self.output_stats(manager), reference_counts(self.blocks[:16] + other_blocks))
+                finally:
+                    manager.close()
+
+    def test_rollback_through_the_journal(self):
+        self.check_rollback(journal_depth=100)
+
+    def test_rollback_without_the_journal(self):
+        self.check_rollback(journal_depth=5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+"""
+Tests of the 'rct_output_origin' index, which maps RingCT outputs to the transaction that created them.
+
+Pre-RingCT outputs are numbered per amount, so their indices collide with RingCT ones and are not
+indexed; these tests save colliding transactions of both kinds and roll them back.
+
+    python -m pytest tests
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+import database_manager as db
+
+
+def tx_hash(n):
+    return bytes([n]) * 32
+
+
+class OutputOriginTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.directory.name, 'test.db')
+        db.create_database(self.db_path)
+        self.db_manager = db.open_database_manager(self.db_path)
+
+    def tearDown(self):
+        self.db_manager.close()
+        self.directory.cleanup()
+
+    def add_blocks(self, blocks):
+        # blocks = [(height, [(tx number, output indices, tx version), ...]), ...]
+        self.db_manager.add_blocks([(height, tx_hash(100 + height), [(tx_hash(n), set(), outputs, version)
+                                                                     for n, outputs, version in transactions])
+                                    for height, transactions in blocks])
+
+    def origins(self, outputs):
+        return {output: bytes.fromhex(hash_hex)[0]
+                for output, (_, hash_hex) in self.db_manager.find_origins_by_outputs(outputs).items()}
+
+    def test_pre_ringct_outputs_are_not_indexed(self):
+        # Output 5 of amount 0 created in block 2 shares its index with pre-RingCT outputs before and after it.
+        self.add_blocks([(1, [(1, [5, 6], 1)]),
+                         (2, [(2, [5, 6], 2)]),
+                         (3, [(3, [5], 1), (4, [7], 2)])])
+        self.assertEqual(self.origins([5, 6, 7, 8]), {5: 2, 6: 2, 7: 4})
+        self.assertEqual(self.db_manager.get_outputs_by_tx_keys([1, 3]), {1: [5, 6], 3: [5]})
+
+    def test_rollback_keeps_the_creator(self):
+        self.add_blocks([(1, [(1, [5, 6], 2)]),
+                         (2, [(2, [5], 1), (3, [7], 2)])])
+        self.db_manager.rollback_to_block(1)
+        self.assertEqual(self.origins([5, 6, 7]), {5: 1, 6: 1})
+
+        self.db_manager.rollback_to_block(0)
+        self.assertEqual(self.origins([5, 6, 7]), {})
+
+    def test_databases_with_the_old_index_sync_it_again(self):
+        self.add_blocks([(1, [(1, [5, 6], 2)])])
+        self.db_manager.close()
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("DROP TABLE rct_output_origin")
+        conn.execute("CREATE TABLE output_origin (output INTEGER PRIMARY KEY, tx_key INTEGER NOT NULL)")
+        conn.commit()
+        conn.close()
+
+        db.create_database(self.db_path)
+        self.db_manager = db.open_database_manager(self.db_path)
+        self.assertEqual(self.origins([5, 6]), {})
+        self.assertEqual(self.db_manager.get_latest_tx_key_completed('tx_output'), 0)
+        self.assertEqual(self.db_manager.get_latest_tx_key_completed('signature'), 1)
+        self.assertIsNone(self.db_manager.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'output_origin'").fetchone())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+"""
+Tests of the bucketed posting lists of posting_list_database, with buckets of four keys so a few
+blocks fill several of them: appends only rewrite the tail bucket, lookups read every bucket, and
+rollbacks and databases converted before buckets existed keep the lists intact.
+
+    python -m pytest tests
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+import database_manager as db
+import posting_list_database as postings
+
+
+def tx_hash(n):
+    return n.to_bytes(32, 'big')
+
+
+class PostingListDatabaseTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(postings, 'POSTINGS_PER_BUCKET', 4)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.db_path = os.path.join(self.directory.name, 'test.db')
+        postings.convert_database(self.db_path)
+        self.db_manager = db.open_database_manager(self.db_path)
+        self.addCleanup(lambda: self.db_manager.close())
+
+    def add_blocks(self, first_height, n_blocks):
+        # Block h holds transaction h + 1, which uses outputs 0 and 1 and, every other block, output 2.
+        self.db_manager.add_blocks([(height, tx_hash(1000 + height),
+                                     [(tx_hash(height + 1), {0, 1} | ({2} if height % 2 else set()), [10 + height], 2)])
+                                    for height in range(first_height, first_height + n_blocks)])
+
+    def ring_keys(self, outputs):
+        return {output: [tx_key for tx_key, _ in transactions]
+                for output, transactions in self.db_manager.find_transactions_by_outputs(outputs).items()}
+
+    def buckets(self, output):
+        return self.db_manager.conn.execute(
+            "SELECT bucket, n_keys, last_tx_key FROM ring_posting WHERE output = ? ORDER BY bucket", (output,)).fetchall()
+
+    def test_appends_fill_buckets_in_order(self):
+        for height in range(10):
+            self.add_blocks(height, 1)
+        self.assertEqual(self.buckets(0), [(0, 4, 4), (1, 4, 8), (2, 2, 10)])
+        self.assertEqual(self.buckets(2), [(0, 4, 8), (1, 1, 10)])
+        self.assertEqual(self.ring_keys([0, 2, 3]), {0: list(range(1, 11)), 2: [2, 4, 6, 8, 10]})
+        self.assertEqual(self.db_manager.get_table_row_count('signature'), 25)
+        self.assertEqual(self.db_manager.get_reference_counts([0, 1, 2]), {0: 10, 1: 10, 2: 5})
+
+    def test_replayed_pairs_are_skipped(self):
+        self.add_blocks(0, 6)
+        self.db_manager.add_output_tx_pair([(0, 3), (0, 6), (3, 5)])
+        self.assertEqual(self.ring_keys([0, 3]), {0: list(range(1, 7)), 3: [5]})
+        self.assertEqual(self.db_manager.get_reference_counts([0, 3]), {0: 6, 3: 1})
+
+    def test_max_tx_key_spans_buckets(self):
+        self.add_blocks(0, 10)
+        self.assertEqual({output: [tx_key for tx_key, _ in transactions] for output, transactions
+                          in self.db_manager.find_transactions_by_outputs([0, 2], max_tx_key=6).items()},
+                         {0: list(range(1, 7)), 2: [2, 4, 6]})
+
+    def test_rollback_empties_the_last_buckets(self):
+        self.add_blocks(0, 10)
+        self.db_manager.rollback_to_block(4)
+        self.assertEqual(self.buckets(0), [(0, 4, 4), (1, 1, 5)])
+        self.assertEqual(self.ring_keys([0, 2]), {0: [1, 2, 3, 4, 5], 2: [2, 4]})
+        self.assertEqual(self.db_manager.get_reference_counts([0, 1, 2]), {0: 5, 1: 5, 2: 2})
+
+        # The list grows again from the partly filled bucket; tx keys are not reused.
+        self.add_blocks(5, 4)
+        self.assertEqual(self.buckets(0), [(0, 4, 4), (1, 4, 13), (2, 1, 14)])
+
+    def test_lists_without_buckets_are_split(self):
+        self.db_manager.close()
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("DROP TABLE ring_posting")
+        conn.execute("CREATE TABLE ring_posting (output INTEGER PRIMARY KEY, last_tx_key INTEGER NOT NULL, postings BLOB NOT NULL)")
+        conn.executemany("INSERT INTO tx (key, hash, block) VALUES (?, ?, ?)", ((n, tx_hash(n), n) for n in range(1, 10)))
+        conn.execute("INSERT INTO ring_posting VALUES (0, 9, ?)", (postings.encode_postings(range(1, 10)),))
+        conn.commit()
+        conn.close()
+
+        self.db_manager = db.open_database_manager(self.db_path)
+        self.assertEqual(self.buckets(0), [(0, 4, 4), (1, 4, 8), (2, 1, 9)])
+        self.assertEqual(self.ring_keys([0]), {0: list(range(1, 10))})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,187 @@
+"""
+Tests of query_service against a small database: the service listens on a free port and is queried
+over HTTP, checking the graph, ring and transaction endpoints, the mapping of bad requests to 400 and
+unknown transactions to 404, that identical graph queries arriving together are built once, and that
+a graph whose serialisation fails midway is cut short rather than sent as a complete document.
+
+    python -m pytest tests
+"""
+import asyncio
+import http.client
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+import xml.etree.ElementTree as ElementTree
+from unittest import mock
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+import database_manager as db
+import metrics
+import query_service
+
+
+def tx_hash(n):
+    return f'{n:064x}'
+
+
+# (tx number, ring members, outputs) by block: transaction 1 creates outputs 0 to 3, transactions 2
+# and 3 spend them and create 4 to 7, and transaction 4 spends outputs of both.
+BLOCKS = [(0, [(1, set(), [0, 1, 2, 3])]),
+          (1, [(2, {0, 1}, [4, 5]), (3, {1, 2}, [6, 7])]),
+          (2, [(4, {3, 5, 6}, [8])])]
+TRANSACTIONS = {tx_hash(n): {'tx_id': tx_hash(n), 'outputs': outputs, 'ring_members': sorted(ring), 'full': None}
+                for _, transactions in BLOCKS for n, ring, outputs in transactions}
+
+
+class QueryServiceTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        db_path = os.path.join(directory.name, 'test.db')
+        db.create_database(db_path)
+        db_manager = db.open_database_manager(db_path)
+        db_manager.add_blocks([(height, bytes([height]) * 32, [(bytes.fromhex(tx_hash(n)), ring, outputs, 2)
+                                                               for n, ring, outputs in transactions])
+                               for height, transactions in BLOCKS])
+        db_manager.close()
+
+        # Stands in for monerod; a test can hold the fetches until it sets release.
+        self.fetches = []
+        self.fetching = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+        self.service = query_service.QueryService(db_path, pool_size=2, fetch_transactions=self.fetch_transactions)
+        self.addCleanup(self.service.close)
+
+    def fetch_transactions(self, tx_hashes):
+        self.fetches.append(list(tx_hashes))
+        self.fetching.set()
+        self.release.wait(10)
+        return {tx_id: TRANSACTIONS[tx_id] for tx_id in tx_hashes if tx_id in TRANSACTIONS}
+
+    async def asyncSetUp(self):
+        self.server = await self.service.start('127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def get(self, path, method='GET'):
+        # Returns (status, content type, body), read by http.client on a thread of its own.
+        def request():
+            connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+            try:
+                connection.request(method, path)
+                response = connection.getresponse()
+                return response.status, response.getheader('Content-Type'), response.read()
+            finally:
+                connection.close()
+        return await asyncio.to_thread(request)
+
+    async def get_json(self, path):
+        status, _, body = await self.get(path)
+        self.assertEqual(status, 200, body)
+        return json.loads(body)
+
+    async def test_graph(self):
+        graph = await self.get_json(f'/graph/{tx_hash(1)}')
+        tx_ids = [node['tx_id'] for node in graph['nodes']]
+        self.assertEqual(graph['root'], tx_hash(1))
+        self.assertEqual(sorted(tx_ids), [tx_hash(n) for n in (1, 2, 3, 4)])
+        self.assertEqual(sorted((tx_ids[source], tx_ids[target]) for source, target in graph['edges']),
+                         [(tx_hash(1), tx_hash(n)) for n in (2, 3, 4)] + [(tx_hash(2), tx_hash(4)), (tx_hash(3), tx_hash(4))])
+
+        graph = await self.get_json(f'/graph/{tx_hash(4)}?direction=ancestors&max_depth=1')
+        self.assertEqual(sorted(node['tx_id'] for node in graph['nodes']), [tx_hash(n) for n in (1, 2, 3, 4)])
+        self.assertEqual(len((await self.get_json(f'/graph/{tx_hash(1)}?limit=2'))['nodes']), 2)
+
+        status, content_type, body = await self.get(f'/graph/{tx_hash(2)}?format=graphml')
+        self.assertEqual((status, content_type), (200, 'application/xml'))
+        namespace = '{http://graphml.graphdrawing.org/xmlns}'
+        graph = ElementTree.fromstring(body).find(f'{namespace}graph')
+        self.assertEqual([node.get('id') for node in graph.iter(f'{namespace}node')], [tx_hash(2), tx_hash(4)])
+        self.assertEqual([(edge.get('source'), edge.get('target')) for edge in graph.iter(f'{namespace}edge')],
+                         [(tx_hash(2), tx_hash(4))])
+
+    async def test_documents_are_joined_into_chunks(self):
+        chunks = [chunk async for chunk in self.service._serialise(['x' * 100] * 1000, chunk_size=30_000)]
+        self.assertEqual([len(chunk) for chunk in chunks], [30_000, 30_000, 30_000, 10_000])
+
+    async def test_failed_stream_is_cut_short(self):
+        def iter_graph_json(graph, tx_id, levels):
+            yield ' ' * (1 << 17)
+            raise RuntimeError('serialiser failed')
+
+        def request():
+            connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+            try:
+                connection.request('GET', f'/graph/{tx_hash(1)}')
+                response = connection.getresponse()
+                self.assertEqual(response.status, 200)
+                with self.assertRaises(http.client.IncompleteRead):
+                    response.read()
+            finally:
+                connection.close()
+
+        stream_errors = metrics.counter('service_stream_errors_total', endpoint='graph')
+        stream_errors_before = stream_errors.value
+        with mock.patch.object(query_service.graph_render, 'iter_graph_json', iter_graph_json):
+            await asyncio.to_thread(request)
+        self.assertEqual(stream_errors.value, stream_errors_before + 1)
+        self.assertEqual(len((await self.get_json(f'/graph/{tx_hash(1)}'))['nodes']), 4)
+
+    async def test_rings_and_transactions(self):
+        rings = await self.get_json('/rings?outputs=1,3,99')
+        self.assertEqual(rings, {'1': [[2, tx_hash(2)], [3, tx_hash(3)]], '3': [[4, tx_hash(4)]]})
+        self.assertEqual(await self.get_json('/rings?outputs=1&max_tx_key=2'), {'1': [[2, tx_hash(2)]]})
+
+        self.assertEqual(await self.get_json(f'/tx/{tx_hash(3).upper()}'),
+                         {'tx_id': tx_hash(3), 'key': 3, 'block': 1, 'outputs': [6, 7]})
+        self.assertEqual(await self.get_json('/health'), {'status': 'ok'})
+
+    async def test_errors(self):
+        for path, status in [(f'/graph/{tx_hash(1)}?direction=sideways', 400),
+                             (f'/graph/{tx_hash(1)}?format=pdf', 400),
+                             (f'/graph/{tx_hash(1)}?limit=many', 400),
+                             ('/graph/1234', 400),
+                             ('/rings', 400),
+                             ('/rings?outputs=1,two', 400),
+                             (f'/graph/{tx_hash(99)}', 404),
+                             (f'/tx/{tx_hash(99)}', 404),
+                             ('/blocks', 404)]:
+            with self.subTest(path=path):
+                response_status, content_type, body = await self.get(path)
+                self.assertEqual((response_status, content_type), (status, 'application/json'))
+                self.assertIn('error', json.loads(body))
+        self.assertEqual((await self.get('/health', method='POST'))[0], 405)
+
+    async def test_identical_queries_are_coalesced(self):
+        coalesced = metrics.counter('service_coalesced_total')
+        coalesced_before = coalesced.value
+        self.release.clear()
+        path = f'/graph/{tx_hash(4)}?direction=ancestors'
+        first = asyncio.ensure_future(self.get(path))
+        self.assertTrue(await asyncio.to_thread(self.fetching.wait, 10))
+
+        second = asyncio.ensure_future(self.get(path))
+        for _ in range(1000):
+            if coalesced.value > coalesced_before:
+                break
+            await asyncio.sleep(0.01)
+        self.release.set()
+
+        responses = await asyncio.gather(first, second)
+        self.assertEqual(coalesced.value, coalesced_before + 1)
+        self.assertEqual(responses[0], responses[1])
+        self.assertEqual(responses[0][0], 200)
+        self.assertEqual(self.fetches.count([tx_hash(4)]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
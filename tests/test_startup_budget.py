@@ -0,0 +1,38 @@
+"""
+Checks the startup budgets of benchmarks/startup_budget.py for every entry point: no forbidden module
+is loaded, and the import time and peak RSS stay within the budgets.
+
+Test machines are slower and noisier than the one the budgets were set on, so the time budgets are
+multiplied by STARTUP_TIME_SCALE (default 5) and the RSS budgets by STARTUP_RSS_SCALE (default 1.5).
+The forbidden modules are checked exactly.
+
+    python -m pytest tests
+"""
+import os
+import statistics
+import sys
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(TESTS_DIR), 'benchmarks'))
+
+from startup_budget import BUDGETS, measure
+
+TIME_SCALE = float(os.environ.get('STARTUP_TIME_SCALE', 5))
+RSS_SCALE = float(os.environ.get('STARTUP_RSS_SCALE', 1.5))
+RUNS = 3
+
+
+class StartupBudgetTest(unittest.TestCase):
+    def test_entry_points_within_budget(self):
+        for module, (max_ms, max_rss_mb, forbidden) in BUDGETS.items():
+            with self.subTest(entry_point=module):
+                samples = [measure(module, forbidden) for _ in range(RUNS)]
+                self.assertEqual(sorted(set(name for sample in samples for name in sample['loaded'])), [])
+                import_ms = statistics.median(sample['seconds'] for sample in samples) * 1000
+                self.assertLessEqual(import_ms, max_ms * TIME_SCALE)
+                self.assertLessEqual(max(sample['rss_mb'] for sample in samples), max_rss_mb * RSS_SCALE)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+"""
+Tests of tx_cache.TransactionCache with a stand-in for monerod: the least recently used transactions
+are evicted first, entries survive a reopen, hits and misses are counted per hash, and two caches
+sharing one file keep it within max_entries and evict in the order the entries were used by either.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+import transaction_graph as tg
+import tx_cache
+
+
+def tx_hash(n):
+    return f'{n:064x}'
+
+
+class FakeMonerod:
+    # Knows the transactions 0 to 99 and records the hashes it is asked for.
+    def __init__(self):
+        self.requests = []
+
+    def get_transactions(self, tx_hashes):
+        self.requests.append(list(tx_hashes))
+        return {tx_id: {'tx_id': tx_id, 'outputs': [int(tx_id, 16)], 'ring_members': [1, int(tx_id, 16) + 2], 'full': None}
+                for tx_id in tx_hashes if int(tx_id, 16) < 100}
+
+
+class TransactionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.cache_path = os.path.join(self.directory.name, 'tx_cache.db')
+        self.monerod = FakeMonerod()
+
+    def open_cache(self, max_entries=3):
+        cache = tx_cache.TransactionCache(self.cache_path, max_entries, self.monerod.get_transactions)
+        self.addCleanup(cache.close)
+        return cache
+
+    def cached(self, cache, numbers):
+        return sorted(int(tx_id, 16) for tx_id in cache.get_cached([tx_hash(n) for n in numbers]))
+
+    def test_least_recently_used_are_evicted(self):
+        cache = self.open_cache()
+        cache.get_transactions([tx_hash(n) for n in (1, 2, 3)])
+        cache.get_transaction(tx_hash(1))
+        cache.get_transactions([tx_hash(4), tx_hash(5)])
+
+        self.assertEqual(self.cached(cache, range(1, 6)), [1, 4, 5])
+        self.assertEqual(cache.stats()['entries'], 3)
+        self.assertEqual(cache.stats()['evictions'], 2)
+
+    def test_entries_survive_a_reopen(self):
+        cache = self.open_cache()
+        cache.get_transactions([tx_hash(n) for n in (1, 2)])
+        cache.close()
+
+        cache = self.open_cache()
+        transaction = cache.get_transaction(tx_hash(2))
+        self.assertEqual(transaction['outputs'], [2])
+        self.assertEqual(transaction['ring_members'], [1, 4])
+        self.assertEqual(self.monerod.requests, [[tx_hash(1), tx_hash(2)]])
+
+        # The order of use carries over as well.
+        cache.get_transaction(tx_hash(3))
+        cache.get_transaction(tx_hash(4))
+        self.assertEqual(self.cached(cache, range(1, 5)), [2, 3, 4])
+
+    def test_hits_and_misses(self):
+        cache = self.open_cache(max_entries=10)
+        cache.get_transactions([tx_hash(n) for n in (1, 2, 2)])
+        cache.get_transactions([tx_hash(n) for n in (1, 2, 3)])
+
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 3))
+        self.assertAlmostEqual(stats['hit_rate'], 0.4)
+        self.assertEqual(self.monerod.requests, [[tx_hash(1), tx_hash(2)], [tx_hash(3)]])
+
+    def test_shared_file_stays_within_max_entries(self):
+        first, second = self.open_cache(), self.open_cache()
+        first.get_transactions([tx_hash(n) for n in (1, 2)])
+        second.get_transactions([tx_hash(n) for n in (3, 4)])
+        first.get_transactions([tx_hash(5)])
+
+        self.assertEqual(first.stats()['entries'], 3)
+        self.assertEqual(second.stats()['entries'], 3)
+
+    def test_shared_file_keeps_one_recency_order(self):
+        # Each cache uses the entries last touched by the other, so only a clock kept in the file
+        # orders them as they were used: 1, 2, 3, then 2, 3 again and 1 last.
+        first, second = self.open_cache(), self.open_cache()
+        first.get_transaction(tx_hash(1))
+        for n in (2, 3, 2, 3):
+            second.get_transaction(tx_hash(n))
+        first.get_transaction(tx_hash(1))
+        first.get_transaction(tx_hash(4))
+
+        self.assertEqual(self.cached(second, range(1, 5)), [1, 3, 4])
+        self.assertEqual(second.stats()['entries'], 3)
+
+    def test_caches_without_counters_are_counted(self):
+        cache = self.open_cache()
+        cache.get_transactions([tx_hash(n) for n in (1, 2)])
+        cache.get_transaction(tx_hash(1))
+        cache.conn.execute("DROP TABLE tx_cache_meta")
+        cache.conn.commit()
+        cache.close()
+
+        cache = self.open_cache()
+        self.assertEqual(cache.stats()['entries'], 2)
+        cache.get_transactions([tx_hash(n) for n in (3, 4)])
+        self.assertEqual(self.cached(cache, range(1, 5)), [1, 3, 4])
+
+    def test_unknown_transaction(self):
+        cache = self.open_cache()
+        with self.assertRaises(tg.TransactionNotFoundError):
+            cache.get_transaction(tx_hash(100))
+        self.assertEqual(cache.stats()['entries'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
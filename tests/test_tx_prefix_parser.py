@@ -0,0 +1,118 @@
+"""
+Differential test of tx_prefix_parser against the JSON decoding of the same transactions.
+
+tests/fixtures/transactions.json holds real transactions, each with its 'as_hex' blob and an
+'as_json' document in the layout of monerod's decode_as_json:
+
+    mainnet genesis coinbase (version 1, txin_gen)
+    RingCT type 1 (full, one MLSAG and no pseudo outputs), from testnet
+    RingCT type 2 spending pre-RingCT outputs (non-zero input amounts)
+    RingCT type 5 (CLSAG)
+    RingCT type 6 (CLSAG and Bulletproofs+)
+
+The blobs are checked against their transaction hashes, so a fixture cannot drift from the chain.
+No monerod was reachable when they were collected, so the JSON side was decoded with the
+independent monero-serialize library rather than recorded. No RingCT type 3 or 4 transaction
+(mainnet blocks 1685555 to 1787999 and 1788000 to 2210719) and no version 1 transaction with key
+inputs is included yet. More fixtures can be recorded from a node with
+'python benchmarks/tx_parser_benchmark.py record', which also stores the pruned blob the sync receives
+as 'pruned_as_hex', and appended to the file.
+
+    python -m pytest tests
+"""
+import json
+import os
+import sys
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+import blockchain_import
+import tx_prefix_parser
+
+FIXTURES_PATH = os.path.join(TESTS_DIR, 'fixtures', 'transactions.json')
+
+
+def load_fixtures():
+    with open(FIXTURES_PATH) as f:
+        return json.load(f)
+
+
+def key_inputs_from_json(as_json):
+    # (amount, absolute ring member indices) of every key input, as the JSON path expands them.
+    return [(tx_input['key']['amount'], tx_prefix_parser.relative_to_absolute(tx_input['key']['key_offsets']))
+            for tx_input in json.loads(as_json)['vin'] if 'key' in tx_input]
+
+
+class TransactionPrefixParserTest(unittest.TestCase):
+    def setUp(self):
+        self.fixtures = load_fixtures()
+
+    def test_fixtures_match_their_hashes(self):
+        for fixture in self.fixtures:
+            with self.subTest(tx_hash=fixture['tx_hash']):
+                blob = bytes.fromhex(fixture['as_hex'])
+                transaction = blockchain_import.read_transaction(blob, 0)
+                self.assertEqual(transaction['end'], len(blob))
+                self.assertEqual(blockchain_import.transaction_hash(blob, transaction).hex(), fixture['tx_hash'])
+
+    def test_ring_members_match_json(self):
+        for fixture in self.fixtures:
+            with self.subTest(tx_hash=fixture['tx_hash']):
+                expected = set()
+                for _, ring in key_inputs_from_json(fixture['as_json']):
+                    expected.update(ring)
+                self.assertEqual(tx_prefix_parser.ring_members_from_hex(fixture['as_hex']), expected)
+
+    def test_ring_members_by_amount(self):
+        # amount=0 keeps the RingCT rings only; the type 2 fixture spends pre-RingCT outputs alone.
+        for fixture in self.fixtures:
+            with self.subTest(tx_hash=fixture['tx_hash']):
+                expected = set()
+                for amount, ring in key_inputs_from_json(fixture['as_json']):
+                    if amount == 0:
+                        expected.update(ring)
+                self.assertEqual(tx_prefix_parser.ring_members_from_hex(fixture['as_hex'], amount=0), expected)
+                self.assertEqual(tx_prefix_parser.transaction_version(fixture['as_hex']),
+                                 json.loads(fixture['as_json'])['version'])
+        pre_ringct = [fixture for fixture in self.fixtures if fixture['tx_hash'].startswith('5aa78faf')]
+        self.assertEqual(len(pre_ringct), 1)
+        self.assertTrue(tx_prefix_parser.ring_members_from_hex(pre_ringct[0]['as_hex']))
+        self.assertEqual(tx_prefix_parser.ring_members_from_hex(pre_ringct[0]['as_hex'], amount=0), set())
+
+    def test_inputs_match_json(self):
+        for fixture in self.fixtures:
+            with self.subTest(tx_hash=fixture['tx_hash']):
+                blob = bytes.fromhex(fixture['as_hex'])
+                document = json.loads(fixture['as_json'])
+                parsed = tx_prefix_parser.parse_transaction_prefix_inputs(blob)
+                self.assertEqual(parsed['version'], document['version'])
+                self.assertEqual(parsed['unlock_time'], document['unlock_time'])
+                self.assertEqual([tx_input['type'] for tx_input in parsed['inputs']],
+                                 ['key' if 'key' in tx_input else 'gen' for tx_input in document['vin']])
+
+                amounts = [tx_input['amount'] for tx_input in parsed['inputs'] if tx_input['type'] == 'key']
+                rings = tx_prefix_parser.absolute_key_offsets(blob)
+                self.assertEqual(list(zip(amounts, rings)), key_inputs_from_json(fixture['as_json']))
+
+    def test_pruned_blobs(self):
+        # The sync asks monerod for pruned blobs; only the bytes up to the end of the inputs are read.
+        for fixture in self.fixtures:
+            with self.subTest(tx_hash=fixture['tx_hash']):
+                blob = bytes.fromhex(fixture['as_hex'])
+                inputs_end = tx_prefix_parser.parse_transaction_prefix_inputs(blob)['inputs_end']
+                expected = tx_prefix_parser.ring_members_from_hex(fixture['as_hex'])
+                self.assertEqual(tx_prefix_parser.ring_members_from_hex(blob[:inputs_end].hex()), expected)
+                if 'pruned_as_hex' in fixture:
+                    self.assertEqual(tx_prefix_parser.ring_members_from_hex(fixture['pruned_as_hex']), expected)
+
+    def test_truncated_blob(self):
+        blob = bytes.fromhex(self.fixtures[-1]['as_hex'])
+        inputs_end = tx_prefix_parser.parse_transaction_prefix_inputs(blob)['inputs_end']
+        with self.assertRaises(ValueError):
+            tx_prefix_parser.parse_transaction_prefix_inputs(blob[:inputs_end - 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+"""
+Tests of fetch_transactions in update_signature_table against canned /get_transactions responses:
+transactions are matched to the request by hash, and incomplete or failed responses raise RPCError
+before anything is saved.
+
+    python -m pytest tests
+"""
+import json
+import os
+import sys
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+import monerod_rpc as rpc
+import update_signature_table as ust
+
+
+class CannedResponse:
+    def __init__(self, document):
+        self.content = json.dumps(document).encode()
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class CannedClient:
+    def __init__(self, document):
+        self.document = document
+
+    def get_transactions(self, tx_hashes, prune=True):
+        return CannedResponse(self.document)
+
+
+def tx_hash(n):
+    return f'{n:064x}'
+
+
+def transaction(n):
+    return {'tx_hash': tx_hash(n), 'as_hex': f'{n:02x}', 'output_indices': [n]}
+
+
+class FetchTransactionsTest(unittest.TestCase):
+    def tearDown(self):
+        rpc.set_client(None)
+
+    def fetch(self, document, hashes):
+        rpc.set_client(CannedClient(document))
+        transactions, _, _ = ust.fetch_transactions(hashes)
+        return transactions
+
+    def test_transactions_follow_the_request_order(self):
+        hashes = [tx_hash(n) for n in (1, 2, 3)]
+        transactions = self.fetch({'status': 'OK', 'txs': [transaction(3), transaction(1), transaction(2)]}, hashes)
+        self.assertEqual([t['tx_hash'] for t in transactions], hashes)
+
+    def test_missed_transactions(self):
+        document = {'status': 'OK', 'txs': [transaction(1), transaction(3)], 'missed_tx': [tx_hash(2)]}
+        with self.assertRaises(rpc.RPCError):
+            self.fetch(document, [tx_hash(n) for n in (1, 2, 3)])
+
+    def test_failed_status(self):
+        with self.assertRaises(rpc.RPCError):
+            self.fetch({'status': 'Failed'}, [tx_hash(1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
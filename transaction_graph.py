@@ -1,169 +1,404 @@
-import requests
-import json
-import time
 import database_manager as db
-import networkx as nx
-import matplotlib.pyplot as plt
+import monerod_rpc as rpc
+import tx_prefix_parser
+import update_signature_table as sig
+import metrics
+import time
+from array import array
 from collections import deque
 
-
-class TransactionNode:
-    def __init__(self, transaction):
-        self.tx_id = transaction['tx_id']
-        self.outputs = transaction['outputs']
-        self.transaction_full = transaction['full']
-        self.children = []
-
-    def add_child(self, node):
-        self.children.append(node)
+DESCENDANTS = 'descendants'
+ANCESTORS = 'ancestors'
+BOTH = 'both'
+DIRECTIONS = (DESCENDANTS, ANCESTORS, BOTH)
+
+
+class TransactionNotFoundError(Exception):
+    """Raised when the root of a graph is neither in the database nor returned by monerod."""
+
+
+class TransactionGraph:
+    """
+    Transaction DAG with one node per unique transaction.
+
+    Node ids are consecutive integers interned from the transaction hashes. Edges, from the
+    transaction that created an output to a transaction using it as a ring member, are kept in
+    two parallel integer arrays, and each edge is stored once however many outputs it stands for.
+    """
+    __slots__ = ('tx_ids', 'node_ids', 'levels', 'edge_sources', 'edge_targets', 'missing', '_edge_set')
+
+    def __init__(self):
+        self.tx_ids = []                 # node id -> hex hash
+        self.node_ids = {}               # hex hash -> node id, doubles as the visited set
+        self.levels = array('l')         # node id -> breadth first level, the root being 0
+        self.edge_sources = array('l')
+        self.edge_targets = array('l')
+        self.missing = set()             # node ids of transactions that could not be loaded, kept as leaves
+        self._edge_set = set()
+
+    def __len__(self):
+        return len(self.tx_ids)
+
+    def __contains__(self, tx_id):
+        return tx_id in self.node_ids
+
+    def add_node(self, tx_id, level):
+        # Returns the id of the node, creating it if the transaction was not seen before.
+        node_id = self.node_ids.get(tx_id)
+        if node_id is None:
+            node_id = len(self.tx_ids)
+            self.node_ids[tx_id] = node_id
+            self.tx_ids.append(tx_id)
+            self.levels.append(level)
+        return node_id
+
+    def add_edge(self, source, target):
+        if (source, target) not in self._edge_set:
+            self._edge_set.add((source, target))
+            self.edge_sources.append(source)
+            self.edge_targets.append(target)
+
+    def edges(self):
+        return zip(self.edge_sources, self.edge_targets)
+
+    def adjacency(self):
+        """
+        Returns the successors of every node in CSR form.
+
+        Returns:
+        tuple: (offsets, targets) arrays; the successors of node n are targets[offsets[n]:offsets[n + 1]].
+        """
+        counts = [0] * (len(self) + 1)
+        for source in self.edge_sources:
+            counts[source + 1] += 1
+        for node_id in range(len(self)):
+            counts[node_id + 1] += counts[node_id]
+        offsets = array('l', counts)
+
+        targets = array('l', [0] * len(self.edge_targets))
+        position = list(counts[:-1])
+        for source, target in self.edges():
+            targets[position[source]] = target
+            position[source] += 1
+        return offsets, targets
 
     def print_tree(self):
-        print(f'Root: {self.tx_id}')
-        for child in self.children:
-            child.print_tree()
+        print(f'Root: {self.tx_ids[0]}')
+        for source, target in self.edges():
+            print(f'{self.tx_ids[source]} -> {self.tx_ids[target]}')
+
+
+def get_transactions(tx_hashes, batch_size=100):
+    """
+    Fetches several transactions from monerod. The hashes are split into requests of batch_size,
+    which are sent concurrently over the pooled connections of the RPC client.
+
+    Parameters:
+    tx_hashes (iterable): Hex hashes of the transactions to fetch.
+    batch_size (int): Maximum number of hashes sent in one request.
+
+    Returns:
+    dict: Maps each hash to a dictionary with the keys 'tx_id', 'outputs' and 'full'.
+    """
+    tx_hashes = list(dict.fromkeys(tx_hashes))
+    payloads = [{
+        "txs_hashes": tx_hashes[batch_start:batch_start + batch_size],
+        "decode_as_json": False,
+        "prune": True
+    } for batch_start in range(0, len(tx_hashes), batch_size)]
+
+    transactions = {}
+    for response in rpc.get_client().post_json_batch('/get_transactions', payloads):
+        for transaction in response.get('txs', []):
+            transactions[transaction['tx_hash']] = {
+                'tx_id' : transaction['tx_hash'],
+                'outputs' : transaction['output_indices'],
+                'full' : transaction
+            }
+
+    return transactions
 
 
 def get_transaction(tx_hash):
-    headers = {'content-type': 'application/json'}
-    url = "http://127.0.0.1:18081/get_transactions"
-    payload = {
-        "txs_hashes": [tx_hash],
-        "decode_as_json": True
-    }
-
-    while True:
-        try:
-            response = requests.post(url, data=json.dumps(payload), headers=headers)
-            break
-        except KeyboardInterrupt:
-            print('Operation interrupted by user.')
-            raise
-        except Exception as e:
-            print(f'Request error encountered. Waiting 1 second.')
-            time.sleep(1)
-            
-
-    outputs = response.json()['txs'][0]['output_indices']
-
-    # pretty_json = json.dumps(data, indent=4)
-    # print(pretty_json)
-
-    data = {
-        'tx_id' : tx_hash,
-        'outputs' : outputs,
-        'full' : response.json()['txs'][0]
-    }
-
-    return data;
-
-
-def transaction_graph_to_hash_graph(root_node):
-    graph = {}
-    nodes_to_check = [root_node]
-
-    while nodes_to_check:
-        transaction = nodes_to_check.pop(0)
-
-        graph[transaction.tx_id] = []
-
-        for child in transaction.children:
-            graph[transaction.tx_id].append(child.tx_id)
-            nodes_to_check.append(child)
-    
+    transaction = get_transactions([tx_hash]).get(tx_hash)
+    if transaction is None:
+        raise rpc.RPCError(f'monerod did not return the transaction {tx_hash}.')
+    return transaction
+
+
+def load_transactions(db_manager, transactions_to_load, fetch_transactions=get_transactions):
+    """
+    Looks up the outputs of the given transactions in the 'tx_output' table, asking monerod only
+    for the ones that are not stored there yet.
+
+    Parameters:
+    db_manager (DatabaseManager): The open database.
+    transactions_to_load (iterable): (tx key, hex hash) tuples. The key may be None if unknown.
+    fetch_transactions (function): Fetches the missing transactions, like get_transactions.
+
+    Returns:
+    dict: Maps each hash to a dictionary with the keys 'tx_id', 'outputs' and 'full'.
+          'full' is only set for transactions fetched from monerod.
+    """
+    transactions_to_load = dict((tx_hash, tx_key) for tx_key, tx_hash in transactions_to_load)
+    outputs_by_key = db_manager.get_outputs_by_tx_keys(
+        tx_key for tx_key in transactions_to_load.values() if tx_key is not None)
+
+    transactions = {}
+    missing = []
+    for tx_hash, tx_key in transactions_to_load.items():
+        if tx_key in outputs_by_key:
+            transactions[tx_hash] = {
+                'tx_id' : tx_hash,
+                'outputs' : outputs_by_key[tx_key],
+                'full' : None
+            }
+        else:
+            missing.append(tx_hash)
+
+    if missing:
+        transactions.update(fetch_transactions(missing))
+
+    return transactions
+
+
+def transaction_graph_to_hash_graph(graph):
+    # Adjacency list keyed by transaction hash, with every node present as a key.
+    offsets, targets = graph.adjacency()
+    return {tx_id: [graph.tx_ids[target] for target in targets[offsets[node_id]:offsets[node_id + 1]]]
+            for node_id, tx_id in enumerate(graph.tx_ids)}
+
+
+def ring_members_of(transaction):
+    # RingCT ring members of a transaction returned by get_transactions or a TransactionCache. Inputs
+    # spending pre-RingCT outputs are left out: their indices are per amount and have no origin in
+    # 'rct_output_origin'.
+    if transaction.get('ring_members') is not None:
+        return transaction['ring_members']
+    if not transaction.get('full'):
+        raise ValueError(f"The ring members of {transaction['tx_id']} are unknown.")
+    return sorted(tx_prefix_parser.ring_members_from_hex(sig.transaction_blob_hex(transaction['full']), amount=0))
+
+
+def mark_missing(graph, node_id):
+    # A transaction found in the rings or origins of the database, but that monerod did not return
+    # (for example one orphaned by a reorganisation the database has not followed). It stays in the
+    # graph as a leaf, since the edge leading to it is known, but is not expanded.
+    graph.missing.add(node_id)
+    metrics.counter('graph_transactions_missing_total', 'Transactions of a graph that could not be loaded.').inc()
+
+
+def expand_descendants(graph, frontier, level, db_manager, limit, fetch_transactions, max_tx_key=None, max_ref_count=None):
+    """
+    Adds the transactions that use the outputs of the frontier as ring members, one level down.
+
+    Parameters:
+    frontier (list): (node id, outputs) of the nodes whose outputs have not been looked up yet.
+    max_tx_key (int): If given, transactions with a larger tx key are not added.
+    max_ref_count (int): If given, outputs referenced by more rings are not followed.
+
+    Returns:
+    list: The frontier of the next level.
+    """
+    frontier_outputs = set()
+    for _, outputs in frontier:
+        frontier_outputs.update(outputs)
+
+    if max_ref_count is not None:
+        # Outputs picked as decoys by many rings say little about where the coins went, and are the
+        # ones whose rings are the most expensive to load.
+        ref_counts = db_manager.get_reference_counts(frontier_outputs)
+        hot_outputs = set(output for output in frontier_outputs if ref_counts.get(output, 0) > max_ref_count)
+        frontier_outputs -= hot_outputs
+        metrics.counter('graph_outputs_pruned_total', 'Outputs not followed for having too many references.').inc(len(hot_outputs))
+
+    with metrics.histogram('graph_ring_lookup_seconds', 'Time per level spent resolving rings.').time():
+        rings = db_manager.find_transactions_by_outputs(frontier_outputs, max_tx_key)
+
+    # Create the new nodes first, so no transaction beyond the limit is loaded.
+    new_nodes = {} # node id -> (tx key, hex hash)
+    for node_id, outputs in frontier:
+        for output in outputs:
+            for child_tx_key, child_tx_id in rings.get(output, []):
+                if child_tx_id not in graph:
+                    if len(graph) >= limit:
+                        continue
+                    new_nodes[graph.add_node(child_tx_id, level)] = (child_tx_key, child_tx_id)
+                graph.add_edge(node_id, graph.node_ids[child_tx_id])
+
+    with metrics.histogram('graph_load_seconds', 'Time per level spent loading transaction outputs.').time():
+        transactions = load_transactions(db_manager, new_nodes.values(), fetch_transactions)
+
+    next_frontier = []
+    for node_id, (_, child_tx_id) in new_nodes.items():
+        if child_tx_id in transactions:
+            next_frontier.append((node_id, transactions[child_tx_id]['outputs']))
+        else:
+            mark_missing(graph, node_id)
+    return next_frontier
+
+
+def expand_ancestors(graph, frontier, level, db_manager, limit, fetch_transactions, min_tx_key=None):
+    """
+    Adds the transactions that created the ring members of the frontier, one level up.
+
+    The ring members come from fetch_transactions (monerod or a cache), since the database only
+    indexes rings by output. Their origins are resolved with one lookup in 'rct_output_origin', so
+    only RingCT inputs are followed.
+
+    Parameters:
+    frontier (list): (node id, hex hash) of the nodes whose ring members have not been looked up yet.
+    min_tx_key (int): If given, transactions with a smaller tx key are not added.
+
+    Returns:
+    list: The frontier of the next level.
+    """
+    with metrics.histogram('graph_load_seconds', 'Time per level spent loading transaction outputs.').time():
+        transactions = fetch_transactions([tx_id for _, tx_id in frontier])
+
+    ring_members = {}
+    for node_id, tx_id in frontier:
+        if tx_id in transactions:
+            ring_members[tx_id] = ring_members_of(transactions[tx_id])
+        else:
+            mark_missing(graph, node_id)
+
+    with metrics.histogram('graph_origin_lookup_seconds', 'Time per level spent resolving output origins.').time():
+        origins = db_manager.find_origins_by_outputs(
+            set(member for members in ring_members.values() for member in members), min_tx_key)
+
+    next_frontier = []
+    for node_id, tx_id in frontier:
+        for member in ring_members.get(tx_id, ()):
+            if member not in origins:
+                continue
+            _, parent_tx_id = origins[member]
+            if parent_tx_id not in graph:
+                if len(graph) >= limit:
+                    continue
+                next_frontier.append((graph.add_node(parent_tx_id, level), parent_tx_id))
+            graph.add_edge(graph.node_ids[parent_tx_id], node_id)
+    return next_frontier
+
+
+def tx_key_window(db_manager, root_block, max_block_distance):
+    """
+    Maps the blocks within max_block_distance of root_block to tx key bounds, so the ring and origin
+    lookups can leave out the transactions outside the window inside the database.
+
+    Returns:
+    tuple: (min tx key of ancestors, max tx key of descendants).
+    """
+    first_key, last_key = db_manager.get_tx_key_range(root_block - max_block_distance, root_block + max_block_distance)
+    # With no transaction on one side of the window, nothing can be found on that side.
+    return (first_key if first_key is not None else db.MAX_TX_KEY,
+            last_key if last_key is not None else 0)
+
+
+def create_transaction_graph_from_tx_id(tx_id, db_manager, limit, fetch_transactions=get_transactions, direction=DESCENDANTS,
+                                        max_block_distance=None, max_depth=None, max_ref_count=None):
+    """
+    Builds the graph of transactions that spend, as ring members, the outputs of tx_id (descendants),
+    of the transactions whose outputs tx_id uses as ring members (ancestors), or both.
+
+    The graph is expanded breadth first, one level at a time. For descendants, the rings of all the
+    outputs of a level are resolved with one database query and the outputs of the new transactions
+    are read from the 'tx_output' table; monerod is only called for transactions missing from that
+    table. For ancestors, the ring members of a level are fetched together and their origins resolved
+    with one query on 'rct_output_origin'; inputs spending pre-RingCT outputs are not followed. With
+    both, the two directions advance one level in turn, and ancestors get negative levels. Each
+    transaction becomes one node, however many paths lead to it, and expansion stops once the graph
+    holds limit transactions. Edges always point from the transaction that created an output to the
+    one using it.
+
+    max_block_distance keeps the graph to transactions at most that many blocks after (descendants)
+    or before (ancestors) the root. The window is turned into a tx key bound once, and the bound is
+    applied by the database lookups, so out-of-window rings are never loaded. max_depth stops the
+    expansion after that many levels in each direction. max_ref_count leaves out the descendants reached
+    through outputs used by more than that many rings, read from the reference counts kept during sync.
+
+    fetch_transactions replaces get_transactions for the calls to monerod, for example with a cache.
+    """
+    if direction not in DIRECTIONS:
+        raise ValueError(f'Unknown direction: {direction}')
+    query_start = time.perf_counter()
+
+    root_row = db_manager.find_transaction_by_hash(bytes.fromhex(tx_id))
+    root_key = root_row[0] if root_row is not None else None
+    transaction = load_transactions(db_manager, [(root_key, tx_id)], fetch_transactions).get(tx_id) # dictionary
+    if transaction is None:
+        raise TransactionNotFoundError(f'{tx_id} is neither in the database nor known to monerod.')
+
+    min_tx_key = max_tx_key = None
+    if max_block_distance is not None:
+        root_block = root_row[2] if root_row is not None else (transaction.get('full') or {}).get('block_height')
+        if root_block is None:
+            raise ValueError(f'The block of {tx_id} is unknown, so max_block_distance cannot be applied.')
+        min_tx_key, max_tx_key = tx_key_window(db_manager, root_block, max_block_distance)
+
+    graph = TransactionGraph()
+    root_id = graph.add_node(tx_id, 0)
+
+    descendant_frontier = [(root_id, transaction['outputs'])] if direction != ANCESTORS else []
+    ancestor_frontier = [(root_id, tx_id)] if direction != DESCENDANTS else []
+    level = 0
+
+    while (descendant_frontier or ancestor_frontier) and (max_depth is None or level < max_depth):
+        level += 1
+        if descendant_frontier:
+            descendant_frontier = expand_descendants(graph, descendant_frontier, level, db_manager, limit,
+                                                     fetch_transactions, max_tx_key, max_ref_count)
+        if ancestor_frontier:
+            ancestor_frontier = expand_ancestors(graph, ancestor_frontier, -level, db_manager, limit,
+                                                 fetch_transactions, min_tx_key)
+
+    if graph.missing:
+        print(f'{len(graph.missing)} transactions could not be loaded and were not expanded.')
+    metrics.histogram('graph_query_seconds', 'Time to build one transaction graph.').observe(time.perf_counter() - query_start)
+    metrics.counter('graph_nodes_total', 'Nodes added to transaction graphs.').inc(len(graph))
     return graph
 
 
-def create_transaction_graph_from_tx_id(tx_id, db_manager, limit):
-
-    transaction = get_transaction(tx_id) # dictionary
-
-    outputs_to_check = [] # queue
-
-    transaction_dag_root = TransactionNode(transaction)
-
-    output_to_transaction_in_dag = {}
-
-    for output in transaction['outputs']:
-        outputs_to_check.append(output)
-        output_to_transaction_in_dag[output] = transaction_dag_root
-
-    while outputs_to_check:
-        # print(f'size of outputs={len(outputs_to_check)}')
-
-        output = outputs_to_check.pop(0)
-
-        current_node = output_to_transaction_in_dag[output]
-
-        # transactions = get_transactions_where_output_is_used_in_ring(output)
-        transactions = db_manager.find_hashes_by_output(output)
-
-        for tx_id in transactions:
-            transaction = get_transaction(tx_id)
-            
-            node = TransactionNode(transaction)
-            current_node.add_child(node)
-            
-            for output in transaction['outputs']:
-                outputs_to_check.append(output)
-                output_to_transaction_in_dag[output] = node
-
-        if len(outputs_to_check) > limit:
-            break
-
-    return transaction_dag_root
-
-
-def visualise_dag(adjacency_list, tx_hash):
-    G = nx.DiGraph()
-    for source, targets in adjacency_list.items():
-        for target in targets:
-            G.add_edge(source, target)
-
-    def determine_levels(graph):
-        levels = {}
-        level = 0
-        queue = deque([node for node in graph.nodes() if graph.in_degree(node) == 0])
-        while queue:
-            level_size = len(queue)
-            for _ in range(level_size):
-                node = queue.popleft()
-                levels[node] = level
-                for successor in graph.successors(node):
-                    if successor not in levels:
-                        queue.append(successor)
-            level += 1
-        return levels
-
-    levels = determine_levels(G)
-    max_level = max(levels.values())
-
-    # Define a list of distinct colors for each level.
-    colors = plt.cm.get_cmap('viridis_r', max_level + 1)
-
-    node_colors = {node: colors(levels[node]) for node in G.nodes()}
-    labels = {node: f'{node[:3]}...' for node in G.nodes()}
-
-    plt.figure(figsize=(15, 10))
-    pos = nx.spring_layout(G)
-
-    # Draw nodes with level-based colors and adjust opacity.
-    nx.draw_networkx_nodes(G, pos, node_size=2000, node_color=[node_colors[node] for node in G.nodes()], alpha=0.5)
-
-    for source, targets in adjacency_list.items():
-        for target in targets:
-            nx.draw_networkx_edges(G, pos, edgelist=[(source, target)], width=2, edge_color=[node_colors[source]],
-                                   arrows=True, arrowstyle='-|>', arrowsize=10, connectionstyle="arc3,rad=0.1")
-
-    # Draw labels
-    for node, (x, y) in pos.items():
-        plt.text(x, y, labels[node], fontsize=9, ha='center', va='center', fontweight='bold', color='white', alpha=1)
-
-    # Create a legend for the levels
-    # Generate patches for the legend
-    from matplotlib.patches import Patch
-    legend_patches = [Patch(color=colors(i), label=f'Level {i}') for i in range(max_level + 1)]
-    plt.legend(handles=legend_patches, title="Node Levels", loc='best')
-
-    plt.title(f'Monero Transaction Graph\nTX: {tx_hash}', fontweight='bold')
-    plt.axis('off')
-    plt.show()
\ No newline at end of file
+def determine_levels(graph):
+    """
+    Assigns each node of a TransactionGraph to a level: nodes without predecessors are on level 0,
+    and every other node is one level below the first level that reaches it breadth first.
+
+    Returns:
+    list: The level of each node id.
+    """
+    offsets, targets = graph.adjacency()
+
+    has_predecessor = [False] * len(graph)
+    for target in graph.edge_targets:
+        has_predecessor[target] = True
+
+    levels = [None] * len(graph)
+    level = 0
+    queue = deque([node for node in range(len(graph)) if not has_predecessor[node]])
+    for node in queue:
+        levels[node] = 0
+    while queue:
+        level_size = len(queue)
+        for _ in range(level_size):
+            node = queue.popleft()
+            for successor in targets[offsets[node]:offsets[node + 1]]:
+                if levels[successor] is None:
+                    levels[successor] = level + 1
+                    queue.append(successor)
+        level += 1
+    return levels
+
+
+def visualise_dag(graph, tx_hash, output_path=None):
+    """
+    Draws a TransactionGraph, either in an interactive window or, if output_path is given, to a file.
+    The format follows the extension of output_path: .png, .svg, .graphml or .json.
+    Writing to a file does not need a display.
+    """
+    import graph_render
+
+    if output_path:
+        graph_render.export_graph(graph, tx_hash, output_path)
+    else:
+        graph_render.show_graph(graph, tx_hash)
@@ -0,0 +1,213 @@
+import os
+import sqlite3
+import threading
+import database_manager as db
+import tx_prefix_parser
+import update_signature_table as sig
+import transaction_graph as tg
+
+
+TX_CACHE_PATH = 'database/tx_cache.db'
+CACHE_FORMAT_VERSION = 1
+
+
+class TransactionCache:
+    """
+    Persistent cache of transactions fetched from monerod, kept in its own SQLite file.
+
+    For every transaction it stores the global indices of its outputs and of its ring members,
+    packed like the 'tx_output' table, so a cached transaction takes a few dozen bytes instead of
+    its full JSON. The cache holds at most max_entries transactions; when it is full, the least
+    recently used ones are evicted. It can be shared between threads.
+
+    get_transactions has the signature of transaction_graph.get_transactions and asks monerod only
+    for the hashes it does not hold, so it can be passed as fetch_transactions to the graph builder.
+    """
+
+    def __init__(self, cache_path=TX_CACHE_PATH, max_entries=1_000_000, fetch_transactions=tg.get_transactions):
+        directory = os.path.dirname(cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS tx_cache (
+            hash BLOB PRIMARY KEY,
+            outputs BLOB NOT NULL,
+            ring_members BLOB NOT NULL,
+            last_used INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_tx_cache_last_used ON tx_cache (last_used);")
+        # Counters shared by every process using the file, only changed under the write lock:
+        # 'clock' orders the entries by recency and 'entries' counts them without a scan.
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS tx_cache_meta (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        """)
+        self.conn.commit()
+        self.conn.execute("BEGIN IMMEDIATE")
+        # Caches written before version 1 hold the ring members of pre-RingCT inputs as well.
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] < CACHE_FORMAT_VERSION:
+            self.conn.execute("DELETE FROM tx_cache")
+            self.conn.execute("DELETE FROM tx_cache_meta")
+            self.conn.execute(f"PRAGMA user_version = {CACHE_FORMAT_VERSION}")
+        # Caches written before the counters existed are counted once.
+        if self.conn.execute("SELECT COUNT(*) FROM tx_cache_meta").fetchone()[0] < 2:
+            self.conn.execute("""
+            INSERT OR REPLACE INTO tx_cache_meta (name, value)
+            VALUES ('clock', (SELECT COALESCE(MAX(last_used), 0) FROM tx_cache)), ('entries', (SELECT COUNT(*) FROM tx_cache))
+            """)
+        self.conn.commit()
+
+        self.max_entries = max_entries
+        self.fetch_transactions = fetch_transactions
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _tick(cursor):
+        # Recency is a counter rather than a timestamp, so entries used in the same second keep their
+        # order. It lives in the file, so every process sharing the cache advances the same clock.
+        # Called inside a BEGIN IMMEDIATE transaction.
+        cursor.execute("UPDATE tx_cache_meta SET value = value + 1 WHERE name = 'clock'")
+        return cursor.execute("SELECT value FROM tx_cache_meta WHERE name = 'clock'").fetchone()[0]
+
+    def get_cached(self, tx_hashes):
+        """
+        Looks up transactions in the cache only, marking the ones found as recently used.
+
+        Returns:
+        dict: Maps each cached hex hash to a dictionary with the keys 'tx_id', 'outputs',
+              'ring_members' and 'full' (always None).
+        """
+        tx_hashes = list(dict.fromkeys(tx_hashes))
+        with self.lock:
+            cursor = self.conn.cursor()
+            try:
+                cursor.execute("CREATE TEMP TABLE IF NOT EXISTS query_tx_cache (hash BLOB PRIMARY KEY)")
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("DELETE FROM query_tx_cache")
+                cursor.executemany("INSERT OR IGNORE INTO query_tx_cache (hash) VALUES (?)",
+                                   ((bytes.fromhex(tx_hash),) for tx_hash in tx_hashes))
+                cursor.execute("""
+                SELECT tx_cache.hash, tx_cache.outputs, tx_cache.ring_members
+                FROM query_tx_cache
+                JOIN tx_cache ON tx_cache.hash = query_tx_cache.hash
+                """)
+                rows = cursor.fetchall()
+
+                if rows:
+                    last_used = self._tick(cursor)
+                    cursor.executemany("UPDATE tx_cache SET last_used = ? WHERE hash = ?",
+                                       ((last_used, row[0]) for row in rows))
+                self.conn.commit()
+            except sqlite3.Error:
+                self.conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+            self.hits += len(rows)
+            self.misses += len(tx_hashes) - len(rows)
+
+        transactions = {}
+        for hash_value, outputs, ring_members in rows:
+            tx_hash = hash_value.hex()
+            transactions[tx_hash] = {
+                'tx_id' : tx_hash,
+                'outputs' : db.unpack_output_indices(outputs),
+                'ring_members' : db.unpack_output_indices(ring_members),
+                'full' : None
+            }
+        return transactions
+
+    def put(self, transactions):
+        """
+        Stores transactions returned by transaction_graph.get_transactions, evicting the least
+        recently used entries if the cache grows beyond max_entries. Transactions without
+        'ring_members' get them from their blob.
+        """
+        rows = []
+        for tx_hash, transaction in transactions.items():
+            ring_members = transaction.get('ring_members')
+            if ring_members is None:
+                ring_members = tx_prefix_parser.ring_members_from_hex(sig.transaction_blob_hex(transaction['full']), amount=0)
+                transaction['ring_members'] = sorted(ring_members)
+            rows.append((bytes.fromhex(tx_hash), db.pack_output_indices(transaction['outputs']),
+                         db.pack_output_indices(sorted(ring_members))))
+
+        with self.lock:
+            cursor = self.conn.cursor()
+            try:
+                # The write lock is taken first, so the clock and the entry count read here are those of
+                # every process sharing the file.
+                cursor.execute("BEGIN IMMEDIATE")
+                last_used = self._tick(cursor)
+                # Another process may have stored some of them meanwhile; count only the new rows.
+                changes_before = self.conn.total_changes
+                cursor.executemany("""
+                INSERT OR IGNORE INTO tx_cache (hash, outputs, ring_members, last_used) VALUES (?, ?, ?, ?)
+                """, ((hash_value, outputs, ring_members, last_used) for hash_value, outputs, ring_members in rows))
+                cursor.execute("UPDATE tx_cache_meta SET value = value + ? WHERE name = 'entries'",
+                               (self.conn.total_changes - changes_before,))
+                entries = cursor.execute("SELECT value FROM tx_cache_meta WHERE name = 'entries'").fetchone()[0]
+
+                excess = entries - self.max_entries
+                if excess > 0:
+                    cursor.execute("""
+                    DELETE FROM tx_cache WHERE hash IN (
+                        SELECT hash FROM tx_cache ORDER BY last_used LIMIT ?
+                    )
+                    """, (excess,))
+                    cursor.execute("UPDATE tx_cache_meta SET value = value - ? WHERE name = 'entries'", (excess,))
+                    self.evictions += excess
+                self.conn.commit()
+            except sqlite3.Error:
+                self.conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def get_transactions(self, tx_hashes):
+        # Cached transactions first, then one fetch from monerod for the rest.
+        tx_hashes = list(dict.fromkeys(tx_hashes))
+        transactions = self.get_cached(tx_hashes)
+        missing = [tx_hash for tx_hash in tx_hashes if tx_hash not in transactions]
+        if missing:
+            fetched = self.fetch_transactions(missing)
+            self.put(fetched)
+            transactions.update(fetched)
+        return transactions
+
+    def get_transaction(self, tx_hash):
+        transaction = self.get_transactions([tx_hash]).get(tx_hash)
+        if transaction is None:
+            raise tg.TransactionNotFoundError(f'{tx_hash} is not known to monerod.')
+        return transaction
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute("SELECT value FROM tx_cache_meta WHERE name = 'entries'").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': entries,
+            'max_entries': self.max_entries,
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"Transaction cache | Hits={stats['hits']} | Misses={stats['misses']} | "
+              f"Hit rate={round(stats['hit_rate'] * 100, 1)}% | Entries={stats['entries']}/{stats['max_entries']} | "
+              f"Evictions={stats['evictions']}")
+
+    def close(self):
+        self.conn.close()
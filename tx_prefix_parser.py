@@ -0,0 +1,170 @@
+"""
+Reads the ring members of a transaction straight from its binary blob (the 'as_hex' field returned by
+monerod's /get_transactions), without asking the daemon to decode it to JSON.
+
+Only the start of the transaction prefix is read:
+
+    version         varint
+    unlock_time     varint
+    vin count       varint
+    vin[]           tag byte followed by the input
+
+Everything after the inputs (outputs, extra, signatures) is ignored, so pruned blobs work as well.
+"""
+
+TXIN_GEN = 0xff
+TXIN_TO_SCRIPT = 0x00
+TXIN_TO_SCRIPTHASH = 0x01
+TXIN_TO_KEY = 0x02
+
+KEY_IMAGE_SIZE = 32
+
+
+def read_varint(blob, offset):
+    """
+    Reads a little-endian base-128 varint.
+
+    Parameters:
+    blob (bytes): The serialized data.
+    offset (int): Position of the first byte of the varint.
+
+    Returns:
+    tuple: (value, offset of the first byte after the varint)
+    """
+    try:
+        byte = blob[offset]
+        if byte < 0x80:
+            return byte, offset + 1
+
+        value = byte & 0x7f
+        shift = 7
+        offset += 1
+        while True:
+            byte = blob[offset]
+            offset += 1
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return value, offset
+            shift += 7
+    except IndexError:
+        raise ValueError('Truncated varint.')
+
+
+def encode_varint(value):
+    """
+    Encodes a non-negative integer as a little-endian base-128 varint.
+
+    Parameters:
+    value (int): The integer to encode.
+
+    Returns:
+    bytes: The encoded varint.
+    """
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def parse_transaction_prefix_inputs(blob):
+    """
+    Parses the version, unlock time and inputs of a serialized transaction.
+
+    Parameters:
+    blob (bytes): The transaction blob, full or pruned.
+
+    Returns:
+    dict: 'version', 'unlock_time', 'inputs' and 'inputs_end' (offset of the first byte after the inputs).
+          Each input is a dict with its 'type'; key inputs also carry 'amount', the relative
+          'key_offsets' and the 'key_image'.
+    """
+    version, offset = read_varint(blob, 0)
+    unlock_time, offset = read_varint(blob, offset)
+    n_inputs, offset = read_varint(blob, offset)
+
+    inputs = []
+    for _ in range(n_inputs):
+        try:
+            tag = blob[offset]
+        except IndexError:
+            raise ValueError('Truncated transaction input.')
+        offset += 1
+
+        if tag == TXIN_TO_KEY:
+            amount, offset = read_varint(blob, offset)
+            n_offsets, offset = read_varint(blob, offset)
+            key_offsets = []
+            for _ in range(n_offsets):
+                key_offset, offset = read_varint(blob, offset)
+                key_offsets.append(key_offset)
+            key_image = blob[offset:offset + KEY_IMAGE_SIZE]
+            if len(key_image) != KEY_IMAGE_SIZE:
+                raise ValueError('Truncated key image.')
+            offset += KEY_IMAGE_SIZE
+            inputs.append({'type': 'key', 'amount': amount, 'key_offsets': key_offsets, 'key_image': key_image})
+
+        elif tag == TXIN_GEN:
+            height, offset = read_varint(blob, offset)
+            inputs.append({'type': 'gen', 'height': height})
+
+        else:
+            # txin_to_script and txin_to_scripthash were never used on the Monero chain.
+            raise ValueError(f'Unsupported transaction input type: {tag:#04x}')
+
+    return {
+        'version': version,
+        'unlock_time': unlock_time,
+        'inputs': inputs,
+        'inputs_end': offset,
+    }
+
+
+def relative_to_absolute(key_offsets):
+    # Each key offset is relative to the previous ring member; the first one is absolute.
+    absolute_indices = []
+    running_total = 0
+    for key_offset in key_offsets:
+        running_total += key_offset
+        absolute_indices.append(running_total)
+    return absolute_indices
+
+
+def absolute_key_offsets(blob):
+    """
+    Returns the absolute global output indices referenced by each key input of a transaction.
+
+    Parameters:
+    blob (bytes): The transaction blob, full or pruned.
+
+    Returns:
+    list: One list of absolute output indices per key input. Coinbase inputs are skipped.
+    """
+    return [relative_to_absolute(tx_input['key_offsets'])
+            for tx_input in parse_transaction_prefix_inputs(blob)['inputs'] if tx_input['type'] == 'key']
+
+
+def ring_members_from_hex(as_hex, amount=None):
+    """
+    Returns the set of distinct global output indices used as ring members by a transaction.
+
+    Parameters:
+    as_hex (str): The hex encoded transaction blob, as returned by /get_transactions.
+    amount (int): If given, only the rings of inputs of this amount are read. Indices are per amount,
+                  so amount=0 keeps the RingCT outputs and leaves out pre-RingCT ones.
+
+    Returns:
+    set: The absolute output indices of all ring members.
+    """
+    ring_members = set()
+    for tx_input in parse_transaction_prefix_inputs(bytes.fromhex(as_hex))['inputs']:
+        if tx_input['type'] != 'key' or (amount is not None and tx_input['amount'] != amount):
+            continue
+        ring_members.update(relative_to_absolute(tx_input['key_offsets']))
+    return ring_members
+
+
+def transaction_version(as_hex):
+    # The first varint of a transaction: 1 before RingCT, 2 and above after.
+    return read_varint(bytes.fromhex(as_hex[:20]), 0)[0]
@@ -1,17 +1,94 @@
-import requests
-import json
 import time
-
-def relative_to_absolute(relative_indices):
-    absolute_indices = []
-    running_total = 0
-    for offset in relative_indices:
-        running_total += offset
-        absolute_indices.append(running_total)
-    return absolute_indices
-
-
-def update_output_tx_pairs_table(db_manager):
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import tx_prefix_parser
+import monerod_rpc as rpc
+import metrics
+
+
+def fetch_transactions(tx_hashes):
+    """
+    Requests the given transactions from monerod.
+
+    Raises RPCError if monerod reports a failure or does not return every transaction, so a chunk is
+    never saved with transactions missing.
+
+    Returns:
+    tuple: (list of transaction dicts in the order of tx_hashes, size of the response in bytes,
+            request latency in seconds)
+    """
+    # Only the inputs of the transaction prefix are needed, so ask for the raw pruned blob
+    # rather than the much larger JSON decoding.
+    request_start = time.time()
+    response = rpc.get_client().get_transactions(tx_hashes, prune=True)
+    latency = time.time() - request_start
+
+    with metrics.histogram('monerod_json_decode_seconds', 'Time spent parsing monerod responses.',
+                           method='get_transactions').time():
+        try:
+            document = response.json()
+        except ValueError as e:
+            raise rpc.RPCError(f'get_transactions returned a response that is not JSON: {e}') from e
+    if document.get('status') != 'OK':
+        raise rpc.RPCError(f"get_transactions returned status {document.get('status')!r}.")
+
+    # monerod leaves out the transactions it does not know (listing them in 'missed_tx'), so the
+    # transactions are matched to the request by hash rather than by position.
+    transactions = {transaction.get('tx_hash'): transaction for transaction in document.get('txs', [])}
+    missing = [tx_hash for tx_hash in tx_hashes if tx_hash not in transactions]
+    if missing:
+        raise rpc.RPCError(f'monerod did not return {len(missing)} of {len(tx_hashes)} transactions, '
+                           f'starting with {missing[0]}.')
+    return [transactions[tx_hash] for tx_hash in tx_hashes], len(response.content), latency
+
+
+def extract_output_tx_pairs(tx_indicies, tx_blobs, first_tx_key=0):
+    # Runs in a worker process: parses each transaction prefix and expands its ring members.
+    # Transactions below first_tx_key already have their pairs saved and are skipped.
+    output_tx_data = []
+
+    for idx, as_hex in zip(tx_indicies, tx_blobs):
+        if idx < first_tx_key:
+            continue
+        for member in tx_prefix_parser.ring_members_from_hex(as_hex):
+            output_tx_data.append((member, idx))
+
+    return output_tx_data
+
+
+def transaction_blob_hex(transaction):
+    # With "prune" set, monerod returns the pruned blob in 'as_hex' (older versions use 'pruned_as_hex').
+    return transaction.get('as_hex') or transaction.get('pruned_as_hex', '')
+
+
+def adapt_chunk_size(chunk_size, response_bytes, latency,
+                     target_latency=2.0, target_bytes=16_000_000, min_chunk=100, max_chunk=5000):
+    # Scale the next chunk so a response lands near the target latency and size,
+    # changing by at most a factor of two each time to smooth out outliers.
+    factors = [2.0]
+    if latency > 0:
+        factors.append(target_latency / latency)
+    if response_bytes > 0:
+        factors.append(target_bytes / response_bytes)
+    factor = max(0.5, min(factors))
+
+    return int(max(min_chunk, min(max_chunk, chunk_size * factor)))
+
+
+def update_output_tx_pairs_table(db_manager, n_fetchers=4, n_decoders=None, fetch_window=8, decode_window=None):
+    """
+    Records the ring members of every transaction after the last one saved in the 'signature' table,
+    and the global output indices it created in the 'tx_output' table.
+    If 'tx_output' lags behind 'signature' (databases synced before it existed), it is caught up first.
+
+    The work runs as a three stage pipeline:
+    - n_fetchers threads request chunks of transactions from monerod, with at most fetch_window chunks in flight.
+    - a pool of n_decoders processes parses the transaction prefixes and expands the key offsets.
+    - the calling thread, which owns the SQLite connection, writes the pairs and outputs in tx key order.
+    Each stage only takes new work while the next one has room, so a slow stage applies backpressure.
+    The chunk size follows the latency and size of the daemon's responses.
+    """
     print('--------------------------------')
     print('Updating signature table.')
     print('This might take a while.\n')
@@ -19,81 +96,93 @@ def update_output_tx_pairs_table(db_manager):
 
     txs_per_commit = 1000
 
-    
+    n_decoders = n_decoders if n_decoders is not None else (os.cpu_count() or 1)
+    decode_window = decode_window if decode_window is not None else 2 * n_decoders
+
+
     print('Getting index of most recently saved transaction.')
-    most_recent_tx_saved_in_signature_table = db_manager.get_largest_tx_value_from_signature_table()
+    most_recent_tx_saved_in_signature_table = db_manager.get_latest_tx_key_completed('signature')
     most_recent_tx_saved_in_signature_table = most_recent_tx_saved_in_signature_table if most_recent_tx_saved_in_signature_table is not None else 0
     print(f'Index of most recent transaction whose ring members were logged: {most_recent_tx_saved_in_signature_table}')
 
+    most_recent_tx_saved_in_tx_output_table = db_manager.get_latest_tx_key_completed('tx_output')
+    most_recent_tx_saved_in_tx_output_table = most_recent_tx_saved_in_tx_output_table if most_recent_tx_saved_in_tx_output_table is not None else 0
+    print(f'Index of most recent transaction whose outputs were logged: {most_recent_tx_saved_in_tx_output_table}')
+
     largest_tx_key = db_manager.get_largest_key_from_tx_table()
+    largest_tx_key = largest_tx_key if largest_tx_key is not None else 0
     print(f'Largest key in tx table: {largest_tx_key}\n')
 
-    start = most_recent_tx_saved_in_signature_table + 1
-    end = start + txs_per_commit - 1
-    
-    while start <= largest_tx_key:
-        print(f'Trying transactions from indicies {start} to {end}')
-
-        txs = db_manager.retrieve_tx_keys_in_range(start, end)
-        tx_indicies = [key for key, _, _ in txs]
-        tx_hashes = [hash.hex() for _, hash, _ in txs]
-
-        # for idx, tx_hashes in zip(tx_indicies, tx_hashes):
-        #     print(idx, tx_hashes)
-        
-        headers = {'content-type': 'application/json'}
-        url = "http://127.0.0.1:18081/get_transactions"
-        payload = {
-            "txs_hashes": tx_hashes,
-            "decode_as_json": True
-        }
-
-        while True:
-            try:
-                response = requests.post(url, data=json.dumps(payload), headers=headers)
-                break
-            except KeyboardInterrupt:
-                print('Operation interrupted by user.')
-                raise
-            except Exception as e:
-                print(f'Request error encountered. Waiting 1 second.')
-                time.sleep(1)
-                
-        
-        transactions = response.json()['txs']
-        print(f'{len(transactions)} transactions retrived.')
-
-        # pretty_json = json.dumps(transactions, indent=4)
-        # print(pretty_json)
-
-        output_tx_data = []
-
-        for idx, transaction in zip(tx_indicies, transactions):
-            # print(hash)
-            ring_members = []
-            for tx_input in json.loads(transaction['as_json'])['vin']:
-                if 'key' in tx_input:
-                    relative_offsets = tx_input['key']['key_offsets']
-                    absolute_offsets = relative_to_absolute(relative_offsets)
-                else:
-                    absolute_offsets = []
-
-                ring_members.extend(absolute_offsets)
-        
-            ring_members = list(set(ring_members))
-
-            for member in ring_members:
-                output_tx_data.append((member, idx))
-
-        
-        print(f'Number of output transaction pairs: {len(output_tx_data)}')
-        # for each in output_tx_data:
-        #     print(each)
-
-        db_manager.add_output_tx_pair(output_tx_data)
-
-        
-        start = end + 1
-        end = start + txs_per_commit - 1
-
+    start = min(most_recent_tx_saved_in_signature_table, most_recent_tx_saved_in_tx_output_table) + 1
+
+    # Chunks waiting on the network and on the decoders, oldest first.
+    fetch_queue = deque()
+    decode_queue = deque()
+
+    fetch_queue_depth = metrics.gauge('sync_queue_depth', 'Chunks waiting in a pipeline queue.', queue='fetch')
+    decode_queue_depth = metrics.gauge('sync_queue_depth', 'Chunks waiting in a pipeline queue.', queue='decode')
+    decode_wait = metrics.histogram('sync_decode_wait_seconds', 'Time the writer waits for the decoders.')
+    chunk_size = metrics.gauge('sync_chunk_size', 'Transactions requested per /get_transactions call.')
+    pairs_written = metrics.counter('sync_pairs_total', 'Output-tx pairs written.')
+    txs_written = metrics.counter('sync_transactions_total', 'Transactions processed.', stage='signature')
+    txs_per_second = metrics.gauge('sync_rows_per_second', 'Processing rate since the stage started.', stage='signature')
+    eta = metrics.gauge('sync_eta_seconds', 'Estimated time until the stage finishes.', stage='signature')
+    first_tx_key = start
+    stage_start = time.time()
+
+    with ThreadPoolExecutor(max_workers=n_fetchers) as fetchers, ProcessPoolExecutor(max_workers=n_decoders) as decoders:
+        while start <= largest_tx_key or fetch_queue or decode_queue:
+
+            # Stage 1: keep the fetchers busy.
+            while start <= largest_tx_key and len(fetch_queue) < fetch_window:
+                end = start + txs_per_commit - 1
+                print(f'Trying transactions from indicies {start} to {end}')
+
+                txs = db_manager.retrieve_tx_keys_in_range(start, end)
+                tx_indicies = [key for key, _, _ in txs]
+                tx_hashes = [hash.hex() for _, hash, _ in txs]
+
+                if tx_indicies:
+                    fetch_queue.append((tx_indicies, fetchers.submit(fetch_transactions, tx_hashes)))
+
+                start = end + 1
+
+            # Stage 3: write the oldest decoded chunk once the decoders are full, nothing else is
+            # waiting on the network, or it is already finished.
+            if decode_queue and (len(decode_queue) >= decode_window or not fetch_queue or decode_queue[0][2].done()):
+                tx_indicies, tx_outputs, future = decode_queue.popleft()
+                with decode_wait.time():
+                    output_tx_data = future.result()
+                print(f'Number of output transaction pairs: {len(output_tx_data)}')
+                db_manager.add_output_tx_pair(output_tx_data, tx_outputs, last_tx_key=tx_indicies[-1])
+
+                pairs_written.inc(len(output_tx_data))
+                txs_written.inc(len(tx_indicies))
+                rate = (tx_indicies[-1] - first_tx_key + 1) / max(time.time() - stage_start, 1e-9)
+                txs_per_second.set(rate)
+                eta.set((largest_tx_key - tx_indicies[-1]) / rate if rate > 0 else 0)
+                decode_queue_depth.set(len(decode_queue))
+                continue
+
+            # Stage 2: hand the oldest fetched chunk to the decoders.
+            if fetch_queue:
+                tx_indicies, future = fetch_queue.popleft()
+                transactions, response_bytes, latency = future.result()
+                print(f'{len(transactions)} transactions retrived ({round(response_bytes / 1_000_000, 2)} MB in {round(latency, 2)}s).')
+
+                tx_blobs = [transaction_blob_hex(transaction) for transaction in transactions]
+                tx_outputs = [(idx, transaction.get('output_indices', []), tx_prefix_parser.transaction_version(tx_blob))
+                              for idx, transaction, tx_blob in zip(tx_indicies, transactions, tx_blobs)
+                              if idx > most_recent_tx_saved_in_tx_output_table]
+
+                decode_queue.append((tx_indicies, tx_outputs, decoders.submit(extract_output_tx_pairs, tx_indicies, tx_blobs,
+                                                                 most_recent_tx_saved_in_signature_table + 1)))
+
+                txs_per_commit = adapt_chunk_size(len(tx_indicies), response_bytes, latency)
+                chunk_size.set(txs_per_commit)
+
+            fetch_queue_depth.set(len(fetch_queue))
+            decode_queue_depth.set(len(decode_queue))
+
+    db_manager.flush()
     print('--------------------------------\n')
\ No newline at end of file
@@ -1,109 +1,127 @@
-import requests
-import json
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import monerod_rpc as rpc
+import metrics
 
 
 def get_blockchain_height():
-    url = "http://localhost:18081/json_rpc"
-    data = {
-        "jsonrpc": "2.0",
-        "id": "0",
-        "method": "get_block_count"
-    }
-    headers = {"Content-Type": "application/json"}
-
-    response = requests.post(url, headers=headers, data=json.dumps(data))
-    latest_block_height = response.json().get("result", {}).get("count", None)
     # note that this is height, but index goes from 0 to height-1
+    return rpc.get_client().get_block_count()
 
-    return latest_block_height
 
+def get_block_tx_hashes(block_idx):
+    result = rpc.get_client().get_block(block_idx)
 
-def update_tx_table(db_manager):
+    # Check if the block data is available and extract the block hash and transaction hashes
+    block_hash = None
+    tx_hashes = []
+    if result:
+        block_hash = result['block_header']['hash']
+        tx_hashes.append(result['miner_tx_hash'])
+
+        if 'tx_hashes' in result:
+            tx_hashes.extend(result['tx_hashes'])
+
+    return block_hash, tx_hashes
+
+
+def update_tx_table(db_manager, n_workers=8, window_size=64):
+    """
+    Fetches every block after the last one saved and stores its transaction hashes in the 'tx' table.
+
+    Blocks are requested over a pool of n_workers threads with at most window_size requests in flight.
+    Results are consumed strictly in height order, so 'tx.key' keeps increasing with the block height.
+    Setting both n_workers and window_size to 1 gives the old one-request-at-a-time behaviour.
+    """
     print('--------------------------------')
     print('Updating tx table.')
     print('This might take a while.\n')
     # print('Getting number of rows in transaction table.')
     # print(f'Size of transactions table is {db_manager.get_table_row_count("tx")} rows.')
 
-    last_block_compelted = db_manager.get_largest_block_value_from_tx_table() # number between 0 and height-1
+    last_block_compelted = db_manager.get_latest_block_completed() # number between 0 and height-1
     last_block_compelted = last_block_compelted if last_block_compelted is not None else -1
     blockchain_height = get_blockchain_height() # note that height is +1 above the largest index
 
     print(f'Last Block Completed: {last_block_compelted}')
     print(f'Last Block Height: {blockchain_height}')
+    print(f'Workers: {n_workers} | In-flight window: {window_size} blocks')
     print('')
 
     tx_hashes = []
+    blocks = []
     total_hashes_saved = 0
     start = time.time()
-
-    for block_idx in range((last_block_compelted+1), blockchain_height):
-    # for block_idx in [3074780]:
-        
-        if block_idx <= 100_000:
-            n_txs_per_save = 1000
-        elif block_idx <= 1_000_000:
-            n_txs_per_save = 10_000
-        elif block_idx <= 2_500_000:
-            n_txs_per_save = 100_000
-        else:
-            n_txs_per_save = 300_000
-
-        headers = {'content-type': 'application/json'}
-        url = "http://127.0.0.1:18081/json_rpc"
-        payload = {
-            "jsonrpc": "2.0",
-            "id": "0",
-            "method": "get_block",
-            "params": {
-                "height": block_idx
-            }
-        }
-
-        # Send the request to the Monero daemon
-        while True:
-            try:
-                response = requests.post(url, data=json.dumps(payload), headers=headers)
-                break
-            except KeyboardInterrupt:
-                print('Operation interrupted by user.')
-                raise
-            except Exception as e:
-                print(f'Request error encountered. Waiting 1 second.')
-                time.sleep(1)
-        
-        result = response.json()
-
-        # Check if the block data is available and extract transaction hashes
-        tx_hashes_temp = []
-        if result.get('result'):
-            tx_hashes_temp.append(result['result']['miner_tx_hash'])
-
-            if 'tx_hashes' in result['result']:
-                tx_hashes_temp.extend(result['result']['tx_hashes'])
-        
-        if tx_hashes_temp:
-            tx_hashes.extend([(bytes.fromhex(tx_hash), block_idx) for tx_hash in tx_hashes_temp])
-        
-        
-        if len(tx_hashes) >= n_txs_per_save:
-            db_manager.add_transactions(tx_hashes)
-            total_hashes_saved += len(tx_hashes)
-            tx_hashes = []
-            # print(f'Size of transactions table is {db_manager.get_table_row_count("tx")} rows.')
-            
-        
-        if block_idx % 100 == 0:
-            block_duration = round((time.time() - start), 2)
-            print(f'Completed={round(((block_idx+1)/blockchain_height)*100, 2)}% | Time per {100} Blocks={block_duration}s | Block={block_idx} | Buffer Size={len(tx_hashes)}')
-            start = time.time()
+    last_printed_block = last_block_compelted
+
+    # Futures for the blocks currently being fetched, oldest (lowest height) first.
+    in_flight = deque()
+    next_block_to_request = last_block_compelted + 1
+
+    blocks_fetched = metrics.counter('sync_blocks_total', 'Blocks fetched.')
+    in_flight_depth = metrics.gauge('sync_queue_depth', 'Chunks waiting in a pipeline queue.', queue='blocks')
+    last_block = metrics.gauge('sync_last_block', 'Height of the last block processed.')
+    blocks_per_second_gauge = metrics.gauge('sync_rows_per_second', 'Processing rate since the stage started.', stage='tx')
+    eta = metrics.gauge('sync_eta_seconds', 'Estimated time until the stage finishes.', stage='tx')
+    stage_start = time.time()
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        while in_flight or next_block_to_request < blockchain_height:
+
+            # Keep the window full so the daemon always has work queued.
+            while next_block_to_request < blockchain_height and len(in_flight) < window_size:
+                future = executor.submit(get_block_tx_hashes, next_block_to_request)
+                in_flight.append((next_block_to_request, future))
+                next_block_to_request += 1
+
+            # Wait for the oldest block only, which keeps the results in height order.
+            block_idx, future = in_flight.popleft()
+            block_hash, tx_hashes_temp = future.result()
+            blocks_fetched.inc()
+            last_block.set(block_idx)
+            in_flight_depth.set(len(in_flight))
+
+            if block_idx <= 100_000:
+                n_txs_per_save = 1000
+            elif block_idx <= 1_000_000:
+                n_txs_per_save = 10_000
+            elif block_idx <= 2_500_000:
+                n_txs_per_save = 100_000
+            else:
+                n_txs_per_save = 300_000
+
+            if tx_hashes_temp:
+                tx_hashes.extend([(bytes.fromhex(tx_hash), block_idx) for tx_hash in tx_hashes_temp])
+                blocks.append((block_idx, bytes.fromhex(block_hash), len(tx_hashes_temp)))
+
+
+            if len(tx_hashes) >= n_txs_per_save:
+                db_manager.add_transactions(tx_hashes, blocks)
+                total_hashes_saved += len(tx_hashes)
+                tx_hashes = []
+                blocks = []
+                # print(f'Size of transactions table is {db_manager.get_table_row_count("tx")} rows.')
+
+
+            if block_idx % 100 == 0:
+                # A resumed sync prints its first line after fewer than 100 blocks.
+                n_blocks = block_idx - last_printed_block
+                block_duration = round((time.time() - start), 2)
+                blocks_per_second = round(n_blocks / block_duration, 2) if block_duration > 0 else float('inf')
+                print(f'Completed={round(((block_idx+1)/blockchain_height)*100, 2)}% | Time per {n_blocks} Blocks={block_duration}s | Blocks/s={blocks_per_second} | In Flight={len(in_flight)} | Block={block_idx} | Buffer Size={len(tx_hashes)}')
+                overall_rate = (block_idx - last_block_compelted) / max(time.time() - stage_start, 1e-9)
+                blocks_per_second_gauge.set(overall_rate)
+                eta.set((blockchain_height - 1 - block_idx) / overall_rate if overall_rate > 0 else 0)
+                start = time.time()
+                last_printed_block = block_idx
 
 
     if len(tx_hashes) > 0:
-        db_manager.add_transactions(tx_hashes)
+        db_manager.add_transactions(tx_hashes, blocks)
         total_hashes_saved += len(tx_hashes)
         tx_hashes = []
+        blocks = []
         # print(f'Size of transactions table is {db_manager.get_table_row_count("tx")} rows.')
     
     print('--------------------------------\n')
\ No newline at end of file